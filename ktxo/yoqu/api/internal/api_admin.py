@@ -20,43 +20,61 @@ async def get_info(resource_name: str, manager=Depends(get_manager)) -> dict:
     return manager.rpas[resource_name].info()
 
 
-@router.get("/status/", summary="Status for all resources")
-async def get_status(manager=Depends(get_manager)) -> dict[str, bool]:
-    rc = {}
-    for name, rpa in manager.rpas.items():
-        rc[name] = manager.status(name)
-    return rc
+@router.get("/status/", summary="Status for all resources, with circuit breaker state of each browser")
+async def get_status(manager=Depends(get_manager)) -> dict[str, dict]:
+    # Last known state only, browsers are checked in their own threads (requests, supervisor)
+    return {name: manager.health(name) for name in manager.rpas.keys()}
+
+
+@router.get("/supervisor/", summary="Health supervisor (probes, restarts)")
+async def get_supervisor(manager=Depends(get_manager)) -> dict:
+    return manager.supervisor.info() if manager.supervisor else {"running": False}
+
+
+@router.get("/ready/", summary="Startup state for all resources (created, lazy, starting, ready, failed)")
+async def get_ready(manager=Depends(get_manager)) -> dict[str, dict]:
+    return manager.readiness()
 
 
 @router.get("/status/{resource_name}")
-async def get_status(resource_name: str, manager=Depends(get_manager), ok=Depends(valid_resource)) -> dict[str, bool]:
-    return {resource_name: manager.status(resource_name)}
+async def get_status(resource_name: str, manager=Depends(get_manager), ok=Depends(valid_resource)) -> dict[str, dict]:
+    return {resource_name: manager.health(resource_name)}
 
 
 @router.post("/refresh/{resource_name}", dependencies=[Depends(valid_resource)])
 async def refresh(resource_name: str, manager=Depends(get_manager)):
     async with manager.get_resource(resource_name) as rpa:
-        rpa.refresh()
+        await manager.run(rpa, rpa.refresh)
         return rpa.info()
 
 
 @router.post("/start/{resource_name}", dependencies=[Depends(valid_resource)])
 async def start(resource_name: str, manager=Depends(get_manager)):
     async with manager.get_resource(resource_name) as rpa:
-        rpa.start()
+        await manager.run(rpa, rpa.start)
         return rpa.info()
 
 
 @router.post("/stop/{resource_name}", dependencies=[Depends(valid_resource)])
 async def stop(resource_name: str, manager=Depends(get_manager)):
     async with manager.get_resource(resource_name) as rpa:
-        rpa.stop()
+        await manager.run(rpa, rpa.stop)
     return {"stop": "TODO", "resource": resource_name}
 
 
 @router.post("/restart/{resource_name}", dependencies=[Depends(valid_resource)])
 async def restart(resource_name: str, manager=Depends(get_manager)):
-    return {"restart": "TODO", "resource": resource_name}
+    return {"restart": await manager.restart(resource_name), "resource": resource_name}
+
+
+@router.get("/routing/", summary="Routing policy for requests without resource_name and requests routed")
+async def get_routing(manager=Depends(get_manager)) -> dict:
+    return manager.router.info()
+
+
+@router.get("/queues/", summary="Queue depth and wait times for all resources")
+async def get_queues(manager=Depends(get_manager)) -> dict:
+    return manager.queues()
 
 
 @router.get("/stats/{resource_name}")
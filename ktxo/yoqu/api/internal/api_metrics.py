@@ -0,0 +1,34 @@
+import logging
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from ktxo.yoqu.api.rpa import get_manager
+from ktxo.yoqu.metrics import metrics
+
+logger = logging.getLogger("ktxo.yoqu")
+
+router = APIRouter(tags=["admin"])
+
+
+def _resource_metrics(manager) -> str:
+    lines = ["# HELP yoqu_requests_total Requests by resource and result",
+             "# TYPE yoqu_requests_total counter"]
+    for name, pool in manager.pools.items():
+        ok = sum(member.rpa.stats.requests.ok for member in pool.members)
+        ko = sum(member.rpa.stats.requests.ko for member in pool.members)
+        lines.append(f'yoqu_requests_total{{resource="{name}",result="ok"}} {ok}')
+        lines.append(f'yoqu_requests_total{{resource="{name}",result="ko"}} {ko}')
+    lines += ["# HELP yoqu_pool_members Browsers by resource and state",
+              "# TYPE yoqu_pool_members gauge"]
+    for name, pool in manager.pools.items():
+        info = pool.info()
+        for state in ["size", "healthy", "busy", "waiting"]:
+            lines.append(f'yoqu_pool_members{{resource="{name}",state="{state}"}} {info[state]}')
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+async def get_metrics(manager=Depends(get_manager)):
+    return PlainTextResponse(metrics.prometheus() + (_resource_metrics(manager) if manager else ""),
+                             media_type="text/plain; version=0.0.4")
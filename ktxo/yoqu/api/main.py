@@ -7,9 +7,10 @@ from fastapi.responses import JSONResponse
 
 from ktxo.yoqu.config import settings
 from ktxo.yoqu.common.exceptions import YoquException
-from ktxo.yoqu.api.rpa import init_rpa
-from ktxo.yoqu.api.internal import api_admin
-from ktxo.yoqu.api.routers import api_resource, api_db
+from ktxo.yoqu.api.rpa import init_rpa, stop_rpa
+from ktxo.yoqu.db import init_db
+from ktxo.yoqu.api.internal import api_admin, api_metrics
+from ktxo.yoqu.api.routers import api_resource, api_db, api_batch, api_jobs
 
 # ----------------------------------------------------------------------
 #
@@ -44,16 +45,21 @@ logger = logging.getLogger("ktxo.yoqu")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await init_db()
     init_rpa()
     yield
     # Cleanup
+    await stop_rpa()
     logger.info(f"Lifespan end.")
 
 
 app = FastAPI(title="Yoqu API", description=api_description, openapi_tags=tags_metadata, lifespan=lifespan)
 app.include_router(api_admin.router)
+app.include_router(api_metrics.router)
 app.include_router(api_resource.router)
 app.include_router(api_db.router)
+app.include_router(api_batch.router)
+app.include_router(api_jobs.router)
 
 
 # ----------------------------------------------------------------------
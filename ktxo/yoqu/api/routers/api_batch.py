@@ -0,0 +1,81 @@
+import json
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from ktxo.yoqu.api.rpa import get_batch_manager
+from ktxo.yoqu.batch import YoquBatch
+from ktxo.yoqu.common.model import BatchRequest
+
+logger = logging.getLogger("ktxo.yoqu")
+
+router = APIRouter(prefix="/yoqu/batches", tags=["api"])
+
+
+async def _batch_response(batch: YoquBatch, wait: bool, stream: bool):
+    if stream:
+        async def events():
+            async for i, item in batch.results():
+                yield f"event: result\ndata: {json.dumps({'index': i, **item}, default=str)}\n\n"
+            yield f"event: batch\ndata: {json.dumps(batch.info(), default=str)}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    if wait:
+        async for _ in batch.results():
+            pass
+        return batch.info(items=True)
+    return batch.info()
+
+
+@router.post("/",
+             summary="Create a batch of Completions, scheduled across all healthy resources (or batch.resources). "
+                     "wait: return results in order when completed, stream: results as they finish (Server-Sent Events)")
+async def create_batch(batch: BatchRequest,
+                       wait: bool = False,
+                       stream: bool = False,
+                       batches=Depends(get_batch_manager)):
+    logger.debug(f"Batch with {len(batch.prompts)} prompts")
+    return await _batch_response(batches.submit(batch.prompts, batch.resources, batch.delete_after, batch.name),
+                                 wait, stream)
+
+
+@router.post("/upload/",
+             summary="Create a batch from a JSONL file, one prompt per line ({\"prompt\": \"...\"} or a json string)")
+async def upload_batch(file: UploadFile,
+                       name: str | None = None,
+                       resources: str | None = None,
+                       delete_after: bool = True,
+                       wait: bool = False,
+                       stream: bool = False,
+                       batches=Depends(get_batch_manager)):
+    prompts = []
+    for n, line in enumerate((await file.read()).decode("utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Line {n} is not valid JSON ({e})")
+        if isinstance(item, dict) and not isinstance(item.get("prompt", None), str):
+            raise HTTPException(status_code=400, detail=f"Line {n} without \"prompt\" (string)")
+        prompts.append(item["prompt"] if isinstance(item, dict) else str(item))
+    resources = [r.strip() for r in resources.split(",")] if resources else None
+    return await _batch_response(batches.submit(prompts, resources, delete_after, name or file.filename),
+                                 wait, stream)
+
+
+@router.get("/", summary="List of batches")
+async def get_batches(batches=Depends(get_batch_manager)) -> list[dict]:
+    return [batch.info() for batch in batches.batches.values()]
+
+
+@router.get("/{batch_id}", summary="Batch status and results (in order)")
+async def get_batch(batch_id: str,
+                    items: bool = True,
+                    batches=Depends(get_batch_manager)) -> dict:
+    return batches.get(batch_id).info(items=items)
+
+
+@router.get("/{batch_id}/events", summary="Batch results as they finish (Server-Sent Events)")
+async def get_batch_events(batch_id: str, batches=Depends(get_batch_manager)):
+    return await _batch_response(batches.get(batch_id), False, True)
@@ -1,12 +1,12 @@
 import logging
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Query, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ktxo.yoqu.config import settings
-from ktxo.yoqu.db import get_session
+from ktxo.yoqu.db import get_session, get_messages
 from ktxo.yoqu.api.rpa import valid_resource
 
 logger = logging.getLogger("ktxo.yoqu")
@@ -18,17 +18,37 @@ templates = Jinja2Templates(directory=settings.api_template_folder)
 
 
 @router.get("/completions/",
-            summary="DB- List of Completions/chats from resource",
+            summary="DB- List of Completions/chats from resource (paginated, q: full-text search)",
             dependencies=[Depends(valid_resource)],
             response_class=HTMLResponse)
 async def get_completions(request: Request,
                           resource_name:str|None = None,
+                          q:str|None = None,
+                          cursor:str|None = None,
+                          limit:int = Query(default=50, ge=1, le=500),
                           session: AsyncSession = Depends(get_session)):
     async with session:
-        #from ktxo.yoqu.db import get_messages
-        #rows = await get_messages()
-        rows = []
-        return templates.TemplateResponse("completions.html", {"request": request, "items": rows})
+        page = await get_messages(session, resource_name=resource_name, query=q, cursor=cursor, limit=limit,
+                                  with_messages=True)
+        return templates.TemplateResponse("completions.html", {"request": request,
+                                                               "items": page["items"],
+                                                               "next": page["next"],
+                                                               "resource_name": resource_name,
+                                                               "q": q,
+                                                               "limit": limit})
+
+
+@router.get("/messages/",
+            summary="DB- Page of Completions/chats, newest first (next: cursor of the next page)")
+async def get_messages_page(resource_name:str|None = None,
+                            name:str|None = None,
+                            q:str|None = None,
+                            cursor:str|None = None,
+                            limit:int = Query(default=50, ge=1, le=500),
+                            with_messages:bool = False,
+                            session: AsyncSession = Depends(get_session)) -> dict:
+    return await get_messages(session, resource_name=resource_name, name=name, query=q, cursor=cursor, limit=limit,
+                              with_messages=with_messages)
 #
 #
 #
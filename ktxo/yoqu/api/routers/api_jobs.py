@@ -0,0 +1,42 @@
+import logging
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ktxo.yoqu.common.exceptions import YoquException, YoquNotFoundException
+from ktxo.yoqu.common.model import CompletionRequest, Jobs
+from ktxo.yoqu.db import get_session, add_job, get_job, get_jobs
+
+logger = logging.getLogger("ktxo.yoqu")
+
+router = APIRouter(prefix="/yoqu/jobs", tags=["api"])
+
+
+@router.post("/",
+             summary="Queue a Completion (create, or update if chat_id), executed by a worker process (ktxo/yoqu/worker.py)")
+async def create_job(completion: CompletionRequest,
+                     session: AsyncSession = Depends(get_session)) -> dict:
+    if not completion.prompt:
+        raise YoquException(f"Missing prompt parameter")
+    job = Jobs(operation="chat" if completion.chat_id else "create",
+               resource=completion.resource_name,
+               request=completion.model_dump_json())
+    job = await add_job(session, job)
+    logger.debug(f"Queued job {job.id}")
+    return job.asdict()
+
+
+@router.get("/", summary="List of jobs (newest first)")
+async def list_jobs(status: str | None = None,
+                    limit: int = 100,
+                    session: AsyncSession = Depends(get_session)) -> list[dict]:
+    return [job.asdict() for job in await get_jobs(session, status, limit)]
+
+
+@router.get("/{job_id}", summary="Job status and result (RPAChat)")
+async def get_job_status(job_id: str,
+                         session: AsyncSession = Depends(get_session)) -> dict:
+    job = await get_job(session, job_id)
+    if job is None:
+        raise YoquNotFoundException(f"Job '{job_id}' not found")
+    return job.asdict()
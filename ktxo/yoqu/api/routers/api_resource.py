@@ -1,9 +1,12 @@
+import dataclasses
+import json
 import logging
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ktxo.yoqu.db import get_session, add_message
+from ktxo.yoqu.db import get_session, add_message, get_chat
 from ktxo.yoqu.api.rpa import get_manager, valid_resource
 from ktxo.yoqu.common.model import CompletionRequest, RPAChat
 
@@ -12,15 +15,27 @@ logger = logging.getLogger("ktxo.yoqu")
 router = APIRouter(prefix="/yoqu", tags=["api"] )
 
 
+def _messages_since(chat: RPAChat, since_message_id: str = None) -> RPAChat:
+    ids = [m.id for m in chat.messages]
+    if since_message_id in ids:
+        return dataclasses.replace(chat,
+                                   messages=chat.messages[ids.index(since_message_id) + 1:],
+                                   since_message_id=since_message_id)
+    return chat
+
+
 @router.get("/completions/",
-            summary="List of Completions/chats from resource",
+            summary="List of Completions/chats from resource (loaded chats, fresh: from the browser)",
             dependencies=[Depends(valid_resource)])
 async def get_completions(resource_name:str|None = None,
+                          fresh:bool = False,
                           manager=Depends(get_manager),
                           session: AsyncSession = Depends(get_session)) -> list[RPAChat]:
+    if not fresh and (chats := manager.cached_chats(resource_name)) is not None:
+        return chats
     async with manager.get_resource(resource_name) as rpa:
         # rpa = manager.rpas[resource_name]
-        return rpa.list_chats()
+        return await manager.run(rpa, rpa.list_chats, fresh)
 
 @router.put("/completions/",
             summary="Update existing Completion/Chat",
@@ -29,8 +44,9 @@ async def completion(completion:CompletionRequest,
                      manager=Depends(get_manager),
                      session: AsyncSession = Depends(get_session)) -> RPAChat:
     logger.debug(f"Updating {completion.chat_id}")
-    async with manager.get_resource(completion.resource_name) as rpa:
-        return rpa.send(completion.chat_id, completion.prompt)
+    async with manager.get_resource(completion.resource_name or await manager.route(completion.chat_id)) as rpa:
+        return await manager.run(rpa, rpa.send, completion.chat_id, completion.prompt,
+                                 completion.since_message_id, completion.incremental)
 
 
 @router.post("/completions/",
@@ -40,18 +56,62 @@ async def completion(completion:CompletionRequest,
                      manager=Depends(get_manager),
                      session: AsyncSession = Depends(get_session)) -> RPAChat:
     logger.debug(f"Creating {completion.prompt[0:30]}...")
-    async with manager.get_resource(completion.resource_name) as rpa:
-        return rpa.create(completion.prompt, completion.name, completion.delete_after)
+    resource_name = completion.resource_name or await manager.route()
+    if chat := await manager.cached(resource_name, completion.prompt, completion.name,
+                                    completion.delete_after, completion.use_cache):
+        return chat
+    async with manager.get_resource(resource_name) as rpa:
+        return await manager.run(rpa, rpa.create, completion.prompt, completion.name,
+                                 completion.delete_after, completion.use_cache)
+
+@router.post("/completions/stream/",
+            summary="Create (no chat_id) or update a Completion/Chat, streaming the response (Server-Sent Events)",
+            dependencies=[Depends(valid_resource)])
+async def completion_stream(completion:CompletionRequest,
+                            manager=Depends(get_manager)) -> StreamingResponse:
+    logger.debug(f"Streaming {completion.prompt[0:30]}...")
+
+    async def events():
+        # Resource is locked while the response is streamed, not only while this function runs
+        try:
+            resource_name = completion.resource_name or await manager.route(completion.chat_id)
+            async with manager.get_resource(resource_name) as rpa:
+                async for event in manager.stream(rpa, rpa.stream,
+                                                  completion.prompt,
+                                                  completion.chat_id,
+                                                  completion.delete_after,
+                                                  completion.since_message_id,
+                                                  completion.incremental):
+                    if "chat" in event:
+                        yield f"event: chat\ndata: {json.dumps(dataclasses.asdict(event['chat']), default=str)}\n\n"
+                    elif "replace" in event:
+                        yield f"event: replace\ndata: {json.dumps(event['replace'])}\n\n"
+                    else:
+                        yield f"event: delta\ndata: {json.dumps(event['delta'])}\n\n"
+        except Exception as e:
+            logger.error(f"Got {e.__class__.__name__}: {e}")
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 
 @router.get("/completions/{chat_id}",
-            summary="Completion/Chat details",
+            summary="Completion/Chat details (last known chat/DB, fresh or incremental: from the browser)",
             dependencies=[Depends(valid_resource)])
 async def get_completion(chat_id:str,
                          resource_name:str|None = None,
+                         since_message_id:str|None = None,
+                         incremental:bool = False,
+                         fresh:bool = False,
                          manager=Depends(get_manager),
                          session: AsyncSession = Depends(get_session)) -> RPAChat:
     logger.debug(f"Getting {chat_id}")
-    async with manager.get_resource(resource_name) as rpa:
-        chat = rpa.get_chat(chat_id)
+    # incremental depends on the messages already extracted by the browser
+    if not fresh and not incremental:
+        chat = manager.recent_chat(chat_id) or await get_chat(session, chat_id)
+        if chat and (not resource_name or chat.resource == resource_name):
+            return _messages_since(chat, since_message_id)
+    async with manager.get_resource(resource_name or await manager.route(chat_id)) as rpa:
+        chat = await manager.run(rpa, rpa.get_chat, chat_id, since_message_id, incremental)
         #add_message(session, chat)
         return chat
@@ -1,23 +1,48 @@
+import asyncio
 import logging
 
 from fastapi import Request, HTTPException
 
+from ktxo.yoqu.batch import YoquBatchManager
 from ktxo.yoqu.config import settings
+from ktxo.yoqu.db import YoquChatWriter
+from ktxo.yoqu.dump import YoquDumpWriter
 from ktxo.yoqu.rpa_manager import RPAManager
+from ktxo.yoqu.supervisor import YoquSupervisor
 
 logger = logging.getLogger("ktxo.yoqu")
 
 
 rpa_manager:RPAManager = None
+batch_manager:YoquBatchManager = None
 
 def init_rpa():
-    global rpa_manager
+    global rpa_manager, batch_manager
     rpa_manager = RPAManager(settings.rpa_config_file, settings.rpa_default_name)
+    if settings.db_write_behind:
+        rpa_manager.writer = YoquChatWriter(settings.db_flush_interval)
+        rpa_manager.writer.start()
+    rpa_manager.supervisor = YoquSupervisor(rpa_manager, settings.supervisor_interval, settings.supervisor_backoff,
+                                            settings.supervisor_backoff_max)
+    rpa_manager.supervisor.start()
+    batch_manager = YoquBatchManager(rpa_manager, settings.batch_folder)
+    batch_manager.start()
+
+async def stop_rpa():
+    if rpa_manager and rpa_manager.supervisor:
+        rpa_manager.supervisor.stop()
+    if rpa_manager and rpa_manager.writer:
+        await rpa_manager.writer.stop()
+    await asyncio.to_thread(YoquDumpWriter.stop_all)
 
 async def get_manager():
     global rpa_manager
     return rpa_manager
 
+async def get_batch_manager():
+    global batch_manager
+    return batch_manager
+
 
 async def valid_resource(request: Request):
     resource_name = request.path_params.get("resource_name", None)
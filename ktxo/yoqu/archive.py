@@ -0,0 +1,226 @@
+#
+# Archive of chats: compressed JSON lines (zstd, gzip without zstandard) partitioned by resource and day
+#
+# PYTHONPATH=$PWD python ktxo/yoqu/archive.py migrate-db [archive_folder]      (default: settings.archive_folder)
+# PYTHONPATH=$PWD python ktxo/yoqu/archive.py migrate-dumps <dump_folder> [archive_folder]   (json and jsonl dumps)
+# PYTHONPATH=$PWD python ktxo/yoqu/archive.py export [archive_folder] [resource] [day_from] [day_to] > chats.jsonl
+#
+import asyncio
+import dataclasses
+from datetime import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ktxo.yoqu.common.exceptions import YoquException
+from ktxo.yoqu.common.helper import build_folders
+from ktxo.yoqu.common.model import RPAChat
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+def chat_record(chat: RPAChat | dict) -> dict:
+    """One line of the archive: RPAChat fields (dataclasses.asdict)"""
+    record = dataclasses.asdict(chat) if isinstance(chat, RPAChat) else dict(chat)
+    record["resource"] = record.get("resource", None) or "default"
+    record["dt"] = str(record.get("dt", None) or datetime.utcnow())
+    return record
+
+
+def row_to_record(row: dict) -> dict:
+    """Messages row (db.get_messages(..., with_messages=True)) -> archive record"""
+    return chat_record({"name": row["name"],
+                        "messages": row["messages"],
+                        "type": row["type"],
+                        "resource": row["resource"],
+                        "chat_id": row["id"],
+                        "online": row["online"],
+                        "dt": row["updated"],
+                        "created": row["created"],
+                        "tags": row["tags"]})
+
+
+class YoquArchive():
+    """
+    Chats are appended to <folder>/<resource>/<YYYY-MM-DD>/<segment>.jsonl.zst, each write() adds one compressed
+    frame with all its chats, segments are closed after segment_size bytes. Segment names include the pid, so API
+    and worker processes can write to the same folder. read() streams the records (no full file in memory).
+    """
+
+    def __init__(self, folder: str = "archive", compression: str = None, level: int = 3,
+                 segment_size: int = 64 * 1024 * 1024):
+        self.folder = build_folders(folder)
+        self.compression = compression or ("zst" if zstandard else "gz")
+        if self.compression == "zst" and zstandard is None:
+            raise YoquException(f"zstandard not installed (pip install zstandard), use compression 'gz'")
+        if self.compression not in ["zst", "gz"]:
+            raise YoquException(f"Compression '{self.compression}' not supported (zst, gz)")
+        self.level = level
+        self.segment_size = segment_size
+        self.extension = f".jsonl.{self.compression}"
+        self.segments: dict[tuple[str, str], str] = {}
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "zst":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return gzip.compress(data, compresslevel=self.level)
+
+    def _open(self, filename: str):
+        fd = open(filename, "rb")
+        if filename.endswith(".zst"):
+            return zstandard.ZstdDecompressor().stream_reader(fd, read_across_frames=True, closefd=True)
+        return gzip.GzipFile(fileobj=fd, mode="rb")
+
+    def _segment(self, resource: str, day: str) -> str:
+        filename = self.segments.get((resource, day), None)
+        if filename is None or os.path.getsize(filename) >= self.segment_size:
+            folder = build_folders(self.folder, resource, day)
+            filename = os.path.join(folder, f"{int(time.time() * 1000)}-{os.getpid()}{self.extension}")
+            self.segments[(resource, day)] = filename
+        return filename
+
+    def write(self, chats: list[RPAChat | dict]) -> int:
+        groups: dict[tuple[str, str], list[str]] = {}
+        for chat in chats:
+            record = chat_record(chat)
+            groups.setdefault((record["resource"], record["dt"][:10]), []).append(
+                json.dumps(record, ensure_ascii=False, default=str))
+        with self.lock:
+            for (resource, day), lines in groups.items():
+                with open(self._segment(resource, day), "ab") as fd:
+                    fd.write(self._compress(("\n".join(lines) + "\n").encode("utf-8")))
+            self.written += len(chats)
+        return len(chats)
+
+    def files(self, resource: str = None, day_from: str = None, day_to: str = None) -> list[str]:
+        """Segments (oldest first), days as YYYY-MM-DD (inclusive)"""
+        files = []
+        for resource_ in sorted(os.listdir(self.folder)):
+            if (resource and resource_ != resource) or not os.path.isdir(os.path.join(self.folder, resource_)):
+                continue
+            for day in sorted(os.listdir(os.path.join(self.folder, resource_))):
+                if (day_from and day < day_from) or (day_to and day > day_to):
+                    continue
+                folder = os.path.join(self.folder, resource_, day)
+                files += [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                          if f.endswith((".jsonl.zst", ".jsonl.gz"))]
+        return files
+
+    def read(self, resource: str = None, day_from: str = None, day_to: str = None) -> Iterator[dict]:
+        for filename in self.files(resource, day_from, day_to):
+            try:
+                with io.TextIOWrapper(self._open(filename), encoding="utf-8") as fd:
+                    for line in fd:
+                        if line.strip():
+                            yield json.loads(line)
+            except Exception as e:
+                # Last frame of a segment being written or a truncated file
+                logger.error(f"Cannot read '{filename}' ({e})")
+
+    def info(self) -> dict:
+        files = self.files()
+        return {"folder": self.folder,
+                "compression": self.compression,
+                "segments": len(files),
+                "size": sum(os.path.getsize(f) for f in files),
+                "written": self.written}
+
+
+async def migrate_db(archive: YoquArchive, page_size: int = 500) -> int:
+    """All rows in Messages -> archive (rows are not deleted)"""
+    from ktxo.yoqu.db import engine, init_db, get_messages
+    from sqlalchemy.ext.asyncio import AsyncSession
+    await init_db()
+    total = 0
+    cursor = None
+    while True:
+        page = await get_messages(AsyncSession(engine), limit=page_size, cursor=cursor, with_messages=True)
+        total += await asyncio.to_thread(archive.write, [row_to_record(row) for row in page["items"]])
+        logger.info(f"{total} chats archived")
+        if not (cursor := page["next"]):
+            return total
+
+
+def _dump_chats(filename: str) -> Iterator[dict]:
+    """Chats in a dump: one per json file (dump_request), one per line of jsonl files (YoquDumpWriter)"""
+    with open(filename, "r", encoding="utf-8") as fd:
+        if filename.endswith(".json"):
+            yield json.load(fd)
+            return
+        for line in fd:
+            if line.strip():
+                dump = json.loads(line)
+                data = dump.get("data", None)
+                if isinstance(data, dict) and not data.get("dt", None):
+                    data["dt"] = dump.get("dt", None)
+                yield data
+
+
+def migrate_dumps(archive: YoquArchive, dump_folder: str, batch_size: int = 500) -> int:
+    """json/jsonl files written by dump_request or YoquDumpWriter (chats) -> archive (files are not deleted)"""
+    total = 0
+    skipped = 0
+    records = []
+    for root, _, files in os.walk(dump_folder):
+        for filename in sorted(files):
+            if not filename.endswith((".json", ".jsonl")):
+                continue
+            try:
+                chats = list(_dump_chats(os.path.join(root, filename)))
+            except Exception as e:
+                logger.error(f"Cannot load '{filename}' ({e})")
+                continue
+            for data in chats:
+                if not isinstance(data, dict) or "messages" not in data:
+                    logger.debug(f"Skipping dump in '{filename}', not a chat")
+                    continue
+                if not isinstance(data["messages"], list):
+                    # Old dumps (RPAChat.asdict()), messages as str(list of RPAMessage), cannot be parsed
+                    skipped += 1
+                    logger.debug(f"Skipping dump in '{filename}', messages not stored as JSON")
+                    continue
+                records.append(data)
+                if len(records) >= batch_size:
+                    total += archive.write(records)
+                    records = []
+    if records:
+        total += archive.write(records)
+    if skipped:
+        logger.warning(f"{skipped} dumps skipped (old format, messages not stored as JSON)")
+    return total
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        stream=sys.stderr)
+    if len(sys.argv) < 2 or sys.argv[1] not in ["migrate-db", "migrate-dumps", "export"]:
+        print(f"Usage: {sys.argv[0]} migrate-db [archive_folder] | migrate-dumps <dump_folder> [archive_folder] | "
+              f"export [archive_folder] [resource] [day_from] [day_to]")
+        sys.exit(1)
+    from ktxo.yoqu.config import settings
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "migrate-db":
+        archive = YoquArchive(args[0] if args else settings.archive_folder)
+        logger.info(f"{asyncio.run(migrate_db(archive))} chats from DB -> {archive.folder}")
+    elif command == "migrate-dumps":
+        archive = YoquArchive(args[1] if len(args) > 1 else settings.archive_folder)
+        logger.info(f"{migrate_dumps(archive, args[0])} chats from {args[0]} -> {archive.folder}")
+    else:
+        archive = YoquArchive(args[0] if args else settings.archive_folder)
+        for record in archive.read(*args[1:4]):
+            print(json.dumps(record, ensure_ascii=False))
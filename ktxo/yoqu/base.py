@@ -6,13 +6,19 @@ from datetime import datetime
 import json
 import logging
 import os
-from typing import Any
+import time
+from typing import Any, Iterator
 
-from ktxo.yoqu.common.exceptions import YoquException, YoquNotFoundException
+from ktxo.yoqu.cache import YoquCompletionCache
+from ktxo.yoqu.common.exceptions import YoquException, YoquNotFoundException, YoquBrowserException
 from ktxo.yoqu.common.helper import build_filename, build_folders, write_json, write_binary
 from ktxo.yoqu.common.model import YoquStatus, YoquStats, RPAChat, RPAMessage
+from ktxo.yoqu.dump import YoquDumpWriter
+from ktxo.yoqu.metrics import metrics, operation, timed
 from ktxo.yoqu.rpa import RPAChrome
 
+from selenium.common.exceptions import WebDriverException
+
 logger = logging.getLogger("ktxo.yoqu")
 
 class YoquResource(ABC):
@@ -28,6 +34,11 @@ class YoquResource(ABC):
         self.resource_config = self.config.get("resource", {})
         self.dump = self.config.get("dump", False)
         self.dump_folder = self.config.get("dump_folder", None)
+        self.dump_writer: YoquDumpWriter = None
+        dump_writer = self.config.get("dump_writer", {})
+        if self.dump and dump_writer.get("format", YoquDumpWriter.JSONL) != "files":
+            self.dump_writer = YoquDumpWriter.get(self.dump_folder or "dump", dump_writer)
+        self.member = self.config.get("member", 0)
         self.stats = YoquStats()
         logger.info(f"Configuration {self.config}")
     
@@ -58,7 +69,7 @@ class YoquResource(ABC):
     def refresh(self, **kwargs):
         pass
 
-    def is_ok(self) -> bool:
+    def is_ok(self, deep: bool = False) -> bool:
         return True
 
     def info(self) -> dict:
@@ -86,7 +97,12 @@ class YoquResource(ABC):
     def status(self, **kwargs) -> YoquStatus:
         return YoquStatus.OK
 
+    @timed("dump_request")
     def dump_request(self, filename:str, data:dict|Any, infer_extension:bool = True):
+        if self.dump and self.dump_writer and isinstance(data, dict):
+            # Queued, written by the dump thread
+            self.dump_writer.put(filename, data)
+            return
         if self.dump:
             file_ext = ""
             if infer_extension:
@@ -115,6 +131,16 @@ class YoquRPAChat(YoquResource):
         self.sleep_range: list[int] = self.resource_config.get("sleep_range", [1, 5])
         self.is_local: bool = True # TODO
         self.chats: list[RPAChat] = []
+        self.chat_index: dict[str, RPAChat] = {} # chat_id -> RPAChat, same chats as self.chats
+        self.chats_loaded: float = None
+        self.chats_ttl: float = self.resource_config.get("chats_ttl", 60)
+        self.last_message_ids: dict[str, str] = {} # chat_id -> last data-message-id extracted
+        self.cache: YoquCompletionCache = None
+        cache_config = self.config.get("cache", {})
+        if cache_config.get("enabled", False):
+            self.cache = YoquCompletionCache(cache_config.get("filename", "cache/completions.db"),
+                                             cache_config.get("ttl", 86400),
+                                             cache_config.get("max_size", 10000))
 
     def is_blocked(self):
         return False
@@ -132,7 +158,7 @@ class YoquRPAChat(YoquResource):
 
         if self.is_blocked():
             logger.warning(f"Being blocked")
-        if not self.browser.is_alive():
+        if not self.browser.is_alive(deep=True):
             return False
 
     def stop(self, **kwargs):
@@ -144,31 +170,105 @@ class YoquRPAChat(YoquResource):
             self.browser.driver.get(self.browser.driver.current_url)
             self.browser.driver.refresh()
 
-    def is_ok(self) -> bool:
+    def is_ok(self, deep: bool = False) -> bool:
         if self.browser:
-            return self.browser.is_alive()
+            return self.browser.is_alive(deep)
         else:
             return False
 
-    def create(self, message: str, chat_name: str = None, delete_after=False) -> RPAChat:
-        if not self.is_ok():
-            raise YoquException(f"RPA '{self.name}' not running")
-        return self.invoke(operation="create", name=chat_name, message=message, delete_after=delete_after)
+    def cacheable(self, message: str, chat_name: str = None, delete_after=False, use_cache=True) -> bool:
+        # Only one-shot chats are cached, a named or kept chat must exist in the resource
+        return self.cache is not None and use_cache and delete_after and not chat_name and bool(message)
 
-    def send(self, chat_id: str, message: str) -> RPAChat:
+    def cached(self, message: str, chat_name: str = None, delete_after=False, use_cache=True) -> RPAChat | None:
+        """Cached chat for message (see create()), None if not cacheable or not found"""
+        if not self.cacheable(message, chat_name, delete_after, use_cache):
+            return None
+        if chat := self.cache.get(self.type, message):
+            self.stats.cache.hits += 1
+            logger.debug(f"Cache hit {chat}")
+            return chat
+        return None
+
+    def create(self, message: str, chat_name: str = None, delete_after=False, use_cache=True) -> RPAChat:
+        cacheable = self.cacheable(message, chat_name, delete_after, use_cache)
+        if cacheable and (chat := self.cached(message, chat_name, delete_after, use_cache)):
+            return chat
+        if not self.is_ok():
+            raise YoquBrowserException(f"RPA '{self.name}' not running")
+        chat = self.invoke(operation="create", name=chat_name, message=message, delete_after=delete_after)
+        if cacheable and chat:
+            self.stats.cache.misses += 1
+            self.stats.cache.evictions += self.cache.put(self.type, message, chat)
+        return chat
+
+    def send(self, chat_id: str, message: str, since_message_id: str = None, incremental: bool = False) -> RPAChat:
         if not self.is_ok():
-            raise YoquException(f"RPA '{self.name}' not running")
-        return self.invoke(operation="chat", chat_id=chat_id, message=message)
+            raise YoquBrowserException(f"RPA '{self.name}' not running")
+        return self.invoke(operation="chat", chat_id=chat_id, message=message,
+                           since_message_id=since_message_id, incremental=incremental)
 
-    def list_chats(self) -> list[str]:
+    def list_chats(self, fresh: bool = False) -> list[str]:
         if not self.is_ok():
-            raise YoquException(f"RPA '{self.name}' not running")
-        return self.invoke(operation="list")
+            raise YoquBrowserException(f"RPA '{self.name}' not running")
+        return self.invoke(operation="list", fresh=fresh)
 
-    def get_chat(self, chat_id: str) -> RPAChat:
+    def get_chat(self, chat_id: str, since_message_id: str = None, incremental: bool = False) -> RPAChat:
         if not self.is_ok():
-            raise YoquException(f"RPA not running")
-        return self.invoke(operation="get", chat_id=chat_id)
+            raise YoquBrowserException(f"RPA not running")
+        return self.invoke(operation="get", chat_id=chat_id,
+                           since_message_id=since_message_id, incremental=incremental)
+
+    def stream(self, message: str, chat_id: str = None, delete_after=False,
+               since_message_id: str = None, incremental: bool = False) -> Iterator[dict]:
+        """
+        Send message to chat_id (new chat if None) yielding {"delta": text} while the response is generated
+        ({"replace": text}, whole response so far, when the page changed text already sent) and {"chat": RPAChat}
+        when it's completed
+        """
+        if not self.is_ok():
+            raise YoquBrowserException(f"RPA '{self.name}' not running")
+        if not message:
+            raise YoquException(f"Missing message parameter")
+        with operation("stream"), metrics.timer("request", self.name):
+            yield from self._stream(message, chat_id, delete_after, since_message_id, incremental)
+
+    def _stream(self, message: str, chat_id: str = None, delete_after=False,
+                since_message_id: str = None, incremental: bool = False) -> Iterator[dict]:
+        try:
+            since_message_id = self._since_message_id(chat_id, since_message_id, incremental) if chat_id else None
+            if chat_id:
+                self._goto_chat(chat_id)
+            elif not self._new_chat():
+                raise YoquBrowserException(f"Cannot create a new chat")
+            for delta in self._send_stream(message):
+                yield {"delta": delta} if isinstance(delta, str) else delta
+            messages = self._get_responses(since_message_id)
+            if not chat_id:
+                chat_id = self.extract_id(self.browser.current_url())
+                self.invalidate_chats()
+            chat = RPAChat(name=self._chat_name(chat_id),
+                           messages=messages,
+                           type=self.type,
+                           resource=self.name,
+                           chat_id=chat_id,
+                           since_message_id=since_message_id)
+            if delete_after:
+                self._delete_chat(chat_id)
+                self._forget_chat(chat_id)
+            else:
+                self._track_messages(chat_id, messages)
+            self.update_stats(ok=True)
+            self.dump_request(f"{self.type}_{chat_id}", dataclasses.asdict(chat))
+            logger.debug(f"Message streamed to {chat}")
+            yield {"chat": chat}
+        except YoquException:
+            self.update_stats(ko=True)
+            raise
+        except Exception as e:
+            logger.error(f"Got exception {type(e)}", e)
+            self.update_stats(ko=True)
+            raise self._exception(e)
 
     def extract_id(self, url) -> str:
         # ChatGPT: https://chat.openai.com/c/48662ada-d46a-4abe-ae51-1bf892f22548
@@ -184,6 +284,8 @@ class YoquRPAChat(YoquResource):
         return id_
         #return id_.split("___")
 
+    @abstractmethod
+    def _new_chat(self) -> bool: pass
     @abstractmethod
     def _create_chat(self, message:str, chat_name:str=None) -> RPAChat: pass
     @abstractmethod
@@ -193,14 +295,66 @@ class YoquRPAChat(YoquResource):
     @abstractmethod
     def _chat_exist(self, chat_name: str) -> bool: pass
     @abstractmethod
-    def _get_responses(self) -> list[RPAMessage]: pass
+    def _get_responses(self, since_message_id:str = None) -> list[RPAMessage]: pass
     @abstractmethod
     def _select_chat(self, chat_name: str): pass
     @abstractmethod
-    def _send(self, message:str ) -> list[RPAMessage]: pass
+    def _send(self, message:str, since_message_id:str = None) -> list[RPAMessage]: pass
+    @abstractmethod
+    def _send_stream(self, message:str) -> Iterator[str]: pass
     @abstractmethod
     def _delete_chat(self, chat_id: str): pass
 
+    def _get_chats(self, fresh:bool = False) -> list[RPAChat]:
+        """Chats from the index, loaded again (_load_chats) if fresh or older than chats_ttl secs"""
+        if fresh or self.chats_loaded is None or (time.time() - self.chats_loaded) > self.chats_ttl:
+            self._load_chats()
+            self.chat_index = {chat.chat_id: chat for chat in self.chats}
+            self.chats_loaded = time.time()
+        return self.chats
+
+    def cached_chats(self) -> list[RPAChat] | None:
+        """Chats in the index if not expired (no browser access), None otherwise"""
+        if self.chats_loaded is None or (time.time() - self.chats_loaded) > self.chats_ttl:
+            return None
+        return list(self.chats)
+
+    def invalidate_chats(self):
+        self.chats_loaded = None
+
+    def _forget_chat(self, chat_id:str):
+        self.chats = [chat for chat in self.chats if chat.chat_id != chat_id]
+        self.chat_index.pop(chat_id, None)
+        self.last_message_ids.pop(chat_id, None)
+
+    def _chat_name(self, chat_id:str) -> str:
+        """Chat name from the index, chat not indexed yet (selected with its url) is added using page title"""
+        chat = self.chat_index.get(chat_id, None)
+        if chat is None:
+            chat = RPAChat(chat_id=chat_id, name=self.browser.driver.title, type=self.type, resource=self.name)
+            self.chats.insert(0, chat)
+            self.chat_index[chat_id] = chat
+        return chat.name
+
+    def _goto_chat(self, chat_id:str):
+        if not self._chat_exist(chat_id):
+            logger.debug(f"Chat '{chat_id}' not in index, going to its url")
+        if not self._select_chat(chat_id):
+            self.update_stats(ko=True)
+            raise YoquNotFoundException(f"Cannot locate chat '{chat_id}'")
+
+    def _since_message_id(self, chat_id:str, since_message_id:str = None, incremental:bool = False) -> str:
+        """Messages newer than since_message_id or, if incremental, than the last message extracted for chat_id"""
+        if since_message_id:
+            return since_message_id
+        if incremental:
+            return self.last_message_ids.get(chat_id, None)
+        return None
+
+    def _track_messages(self, chat_id:str, messages:list[RPAMessage]):
+        if chat_id and messages:
+            self.last_message_ids[chat_id] = messages[-1].id
+
     def invoke(self, **kwargs) -> Any:
         cmd = kwargs.get("operation", None)
         if not cmd or cmd not in self.VALID_OPERATIONS:
@@ -210,6 +364,18 @@ class YoquRPAChat(YoquResource):
         chat_id = kwargs.get("chat_id", None)
         message = kwargs.get("message", None)
         delete_after = kwargs.get("delete_after", False)
+        since_message_id = self._since_message_id(chat_id,
+                                                  kwargs.get("since_message_id", None),
+                                                  kwargs.get("incremental", False))
+        with operation(cmd), metrics.timer("request", self.name):
+            t0 = time.time()
+            try:
+                return self._invoke(cmd, kwargs, chat_name, chat_id, message, delete_after, since_message_id)
+            finally:
+                self.stats.elapsed = time.time() - t0
+
+    def _invoke(self, cmd:str, kwargs:dict, chat_name:str, chat_id:str, message:str, delete_after:bool,
+                since_message_id:str) -> Any:
         try:
             match cmd:
                 case "create":
@@ -217,9 +383,11 @@ class YoquRPAChat(YoquResource):
                     logger.debug(f"Created {chat}")
                     if delete_after:
                         self._delete_chat(chat.chat_id)
-                        _ = self.chats.pop(0)
+                        self._forget_chat(chat.chat_id)
                         logger.info(f"Removing {chat}")
                         #self._load_chats() # Refreh
+                    else:
+                        self._track_messages(chat.chat_id, chat.messages)
                     self.update_stats(ok=True)
                     return chat
                 case "chat":
@@ -227,61 +395,59 @@ class YoquRPAChat(YoquResource):
                         raise YoquException(f"Missing chat_id parameter")
                     if not message:
                         raise YoquException(f"Missing message parameter")
-                    self._load_chats()
-                    if not self._chat_exist(chat_id):
-                        self.update_stats(ko=True)
-                        raise YoquException(f"Unknown chat '{chat_id}'")
-                    if not self._select_chat(chat_id):
-                        self.update_stats(ko=True)
-                        raise YoquNotFoundException(f"Cannot locate chat '{chat_id}'")
-                    messages = self._send(message)
+                    self._goto_chat(chat_id)
+                    messages = self._send(message, since_message_id)
+                    self._track_messages(chat_id, messages)
                     #self.dump_request(chat_id, {"chat": chat_name, "chat_id": chat_id,"messages":[d.asdict() for d in messages]})
 
                     self.update_stats(ok=True)
-                    chat_name = [chat.name for chat in self.chats if chat.chat_id == chat_id][0]
-                    chat = RPAChat(name=chat_name,
+                    chat = RPAChat(name=self._chat_name(chat_id),
                                    messages=messages,
                                    type=self.type,
                                    resource=self.name,
-                                   chat_id=self.extract_id(self.browser.current_url()))
-                    self.dump_request(f"{self.type}_{chat_id}", chat.asdict())
+                                   chat_id=self.extract_id(self.browser.current_url()),
+                                   since_message_id=since_message_id)
+                    self.dump_request(f"{self.type}_{chat_id}", dataclasses.asdict(chat))
                     logger.debug(f"Message sent to {chat}")
                     return chat
                 case "rename":
                     # @TODO
+                    self.invalidate_chats()
                     return self._rename_chat(chat_id, chat_name)
                 case "list":
-                    return self._load_chats()
+                    return self._get_chats(kwargs.get("fresh", False))
                 case "get":
-                    if not self._chat_exist(chat_id):
-                        raise YoquNotFoundException(f"Unknown chat '{chat_id}'")
-                    if not self._select_chat(chat_id):
-                        raise YoquNotFoundException(f"Cannot locate chat '{chat_id}'")
-                    messages = self._get_responses()
-                    chat_name = [chat.name for chat in self.chats if chat.chat_id == chat_id][0]
-                    chat = RPAChat(name=chat_name,
+                    self._goto_chat(chat_id)
+                    messages = self._get_responses(since_message_id)
+                    self._track_messages(chat_id, messages)
+                    chat = RPAChat(name=self._chat_name(chat_id),
                                    chat_id=chat_id,
                                    messages=messages,
                                    type=self.type,
-                                   resource=self.name )
+                                   resource=self.name,
+                                   since_message_id=since_message_id)
                     logger.debug(f"Chat {chat}")
                     self.dump_request(chat_id, dataclasses.asdict(chat))
                     self.update_stats(ok=True)
                     return chat
                 case "delete":
-                    if not self._chat_exist(chat_id):
-                        raise YoquNotFoundException(f"Unknown chat '{chat_id}'")
-                    if not self._select_chat(chat_id):
-                        raise YoquNotFoundException(f"Cannot locate chat '{chat_id}'")
+                    self._goto_chat(chat_id)
                     self._delete_chat(chat_id)
+                    self._forget_chat(chat_id)
                 case _:
                         logger.warning(f"Unknown command '{cmd}'")
                         return None
-        except YoquNotFoundException:
+        except YoquException:
             raise
         except Exception as e:
             logger.error(f"Got exception {type(e)}", e)
-            raise YoquException(str(e))
+            raise self._exception(e)
+
+    def _exception(self, e: Exception) -> YoquException:
+        # WebDriver errors (timeouts included) are browser failures, anything else is not
+        if isinstance(e, WebDriverException):
+            return YoquBrowserException(str(e))
+        return YoquException(str(e))
 
     def _rename_chat(self, chat_id:str, chat_name: str, new_chat_name:str):
         pass
@@ -289,9 +455,12 @@ class YoquRPAChat(YoquResource):
     def info(self) -> dict:
         return {"name": self.name,
                 "type": self.type,
-                "alive": self.browser.is_alive(),
+                "member": self.member,
+                # Last liveness check, info() can be called outside the browser thread (no WebDriver calls)
+                "alive": self.browser.alive,
                 "pid": self.browser.process_pid,
-                "stats": self.stats.asdict()
+                "stats": self.stats.asdict(),
+                "dump": self.dump_writer.info() if self.dump_writer else None
                 }
 
     def dump_chat(self, chat: RPAChat):
@@ -0,0 +1,248 @@
+#
+# Batches of prompts scheduled across all healthy resources
+#
+import asyncio
+import copy
+import dataclasses
+from datetime import datetime
+import json
+import logging
+import os
+from typing import AsyncIterator
+import uuid
+
+from ktxo.yoqu.common.exceptions import YoquException, YoquNotFoundException, YoquBrowserException
+from ktxo.yoqu.common.helper import build_folders
+from ktxo.yoqu.rpa_manager import RPAManager
+
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquBatch():
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    ERROR = "ERROR"
+
+    def __init__(self, prompts: list[str], resources: list[str] = None, delete_after: bool = True,
+                 name: str = None, batch_id: str = None):
+        self.batch_id = batch_id or str(uuid.uuid4())
+        self.name = name
+        self.prompts = prompts
+        self.resources = resources or []
+        self.delete_after = delete_after
+        self.status = self.PENDING
+        # One item per prompt (same order): {"status", "resource", "chat", "error", "elapsed", "attempts"}
+        self.items: list[dict] = [{"status": self.PENDING} for _ in prompts]
+        self.created = datetime.utcnow()
+        self.updated = self.created
+        self.changed = asyncio.Condition()
+
+    @property
+    def done(self) -> int:
+        return len([item for item in self.items if item["status"] in [self.DONE, self.ERROR]])
+
+    @property
+    def finished(self) -> bool:
+        return self.done == len(self.items)
+
+    def pending(self) -> list[int]:
+        return [i for i, item in enumerate(self.items) if item["status"] not in [self.DONE, self.ERROR]]
+
+    async def update(self, index: int, **kwargs):
+        async with self.changed:
+            self.items[index].update(kwargs)
+            self.updated = datetime.utcnow()
+            if self.finished:
+                self.status = self.DONE
+            self.changed.notify_all()
+
+    async def results(self) -> AsyncIterator[tuple[int, dict]]:
+        """(index, item) as soon as each prompt is completed (not in order)"""
+        sent = set()
+        while True:
+            async with self.changed:
+                ready = [i for i, item in enumerate(self.items)
+                         if i not in sent and item["status"] in [self.DONE, self.ERROR]]
+                if not ready and not self.finished:
+                    await self.changed.wait()
+                    continue
+            for i in ready:
+                sent.add(i)
+                yield i, self.items[i]
+            if self.finished and len(sent) == len(self.items):
+                return
+
+    def info(self, items: bool = False) -> dict:
+        info = {"batch_id": self.batch_id,
+                "name": self.name,
+                "status": self.status,
+                "resources": self.resources,
+                "delete_after": self.delete_after,
+                "total": len(self.items),
+                "done": self.done,
+                "errors": len([item for item in self.items if item["status"] == self.ERROR]),
+                "created": str(self.created),
+                "updated": str(self.updated)}
+        if items:
+            info["prompts"] = self.prompts
+            info["items"] = self.items
+        return info
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "YoquBatch":
+        batch = cls(data["prompts"], data["resources"], data["delete_after"], data["name"], data["batch_id"])
+        batch.items = data["items"]
+        batch.status = data["status"]
+        batch.created = datetime.fromisoformat(data["created"])
+        batch.updated = datetime.fromisoformat(data["updated"])
+        return batch
+
+
+class YoquBatchManager():
+    """
+    Run batches: one worker per pool member (max_size) of each selected resource, workers take the next pending prompt,
+    so throughput grows with the number of browsers. Progress is saved to folder (one json file per batch, replaced
+    atomically, at most once every save_interval secs while the batch runs) and unfinished batches are resumed by
+    start().
+    A prompt failed by a broken resource (browser errors, circuits open) goes back to the queue for the other resources,
+    up to max_attempts times, and the worker of that resource stops (see _worker()).
+    """
+
+    def __init__(self, manager: RPAManager, folder: str = "batches", save_interval: float = 1, max_attempts: int = 3):
+        self.manager = manager
+        self.folder = build_folders(folder)
+        self.save_interval = save_interval
+        self.max_attempts = max_attempts
+        self.batches: dict[str, YoquBatch] = {}
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.dirty: set[str] = set()                # Batches changed since their last save
+        self.locks: dict[str, asyncio.Lock] = {}    # One write at a time per batch
+        for filename in sorted(os.listdir(self.folder)):
+            if filename.endswith(".json"):
+                try:
+                    with open(os.path.join(self.folder, filename), "r", encoding="utf-8") as fd:
+                        batch = YoquBatch.from_dict(json.load(fd))
+                    self.batches[batch.batch_id] = batch
+                except Exception as e:
+                    logger.error(f"Cannot load batch '{filename}' ({e})")
+
+    def start(self):
+        for batch in self.batches.values():
+            if not batch.finished:
+                logger.info(f"Resuming batch {batch.batch_id}, {len(batch.pending())} prompts pending")
+                self._schedule(batch)
+
+    def _write(self, data: dict):
+        # Temp file + rename, a crash never leaves a half written batch
+        filename = os.path.join(self.folder, f"{data['batch_id']}.json")
+        with open(f"{filename}.tmp", "w", encoding="utf-8") as fd:
+            json.dump(data, fd, ensure_ascii=False, default=str)
+        os.replace(f"{filename}.tmp", filename)
+
+    def save(self, batch: YoquBatch):
+        self._write(batch.info(items=True))
+
+    async def save_async(self, batch: YoquBatch, changed: bool = True):
+        """Changes made while another save of the batch is running are written by the next one"""
+        if changed:
+            self.dirty.add(batch.batch_id)
+        async with self.locks.setdefault(batch.batch_id, asyncio.Lock()):
+            if batch.batch_id not in self.dirty:
+                return
+            self.dirty.discard(batch.batch_id)
+            # Snapshot in the event loop, write in a thread
+            await asyncio.to_thread(self._write, copy.deepcopy(batch.info(items=True)))
+
+    async def _autosave(self, batch: YoquBatch, stopped: asyncio.Event):
+        """Save batch (if changed) every save_interval secs and once more after stopped"""
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), self.save_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.save_async(batch, changed=False)
+
+    def get(self, batch_id: str) -> YoquBatch:
+        if batch_id not in self.batches:
+            raise YoquNotFoundException(f"Batch '{batch_id}' not found")
+        return self.batches[batch_id]
+
+    def submit(self, prompts: list[str], resources: list[str] = None, delete_after: bool = True,
+               name: str = None) -> YoquBatch:
+        if not prompts:
+            raise YoquException(f"Batch without prompts")
+        for resource in resources or []:
+            if resource not in self.manager.pools:
+                raise YoquNotFoundException(f"Resource '{resource}' not found")
+        batch = YoquBatch(prompts, resources, delete_after, name)
+        self.batches[batch.batch_id] = batch
+        self.save(batch)
+        self._schedule(batch)
+        return batch
+
+    def _schedule(self, batch: YoquBatch):
+        self.tasks[batch.batch_id] = asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: YoquBatch):
+        queue = asyncio.Queue()
+        for i in batch.pending():
+            queue.put_nowait(i)
+        stopped = asyncio.Event()
+        saver = asyncio.create_task(self._autosave(batch, stopped))
+        try:
+            # Prompts requeued by stopped workers are taken by a new round of workers on the resources still healthy
+            while not queue.empty():
+                resources = [name for name in batch.resources or self.manager.pools.keys()
+                             if self.manager.status(name)]
+                if not resources:
+                    logger.error(f"Batch {batch.batch_id}: no healthy resources")
+                    while not queue.empty():
+                        i = queue.get_nowait()
+                        await batch.update(i, status=YoquBatch.ERROR,
+                                           error=batch.items[i].get("error", None) or "No healthy resources")
+                    batch.status = YoquBatch.ERROR
+                    self.dirty.add(batch.batch_id)
+                    break
+                batch.status = YoquBatch.RUNNING
+                workers = [self._worker(batch, queue, name)
+                           for name in resources for _ in range(self.manager.pools[name].max_size)]
+                logger.info(f"Batch {batch.batch_id}: {queue.qsize()} prompts, {len(workers)} workers on {resources}")
+                await asyncio.gather(*workers)
+        finally:
+            stopped.set()
+            await saver
+        self.tasks.pop(batch.batch_id, None)
+        self.locks.pop(batch.batch_id, None)
+        logger.info(f"Batch {batch.batch_id}: {batch.status} ({batch.info()['errors']} errors)")
+
+    async def _worker(self, batch: YoquBatch, queue: asyncio.Queue, resource: str):
+        while not queue.empty():
+            i = queue.get_nowait()
+            t0 = datetime.utcnow()
+            try:
+                await batch.update(i, status=YoquBatch.RUNNING, resource=resource)
+                async with self.manager.get_resource(resource) as rpa:
+                    chat = await self.manager.run(rpa, rpa.create, batch.prompts[i], None, batch.delete_after)
+                if chat is None:
+                    raise YoquException(f"Cannot create chat")
+                batch.items[i].pop("error", None)  # Previous attempt
+                await batch.update(i, status=YoquBatch.DONE, chat=dataclasses.asdict(chat),
+                                   elapsed=(datetime.utcnow() - t0).total_seconds())
+            except Exception as e:
+                attempts = batch.items[i].get("attempts", 0) + 1
+                if isinstance(e, (YoquBrowserException, WebDriverException)) and attempts < self.max_attempts:
+                    # The resource is broken, not the prompt: leave it to the other workers
+                    logger.warning(f"Batch {batch.batch_id}: prompt #{i} failed on {resource} ({e}), requeued "
+                                   f"(attempt {attempts}), stopping worker")
+                    await batch.update(i, status=YoquBatch.PENDING, error=str(e), attempts=attempts)
+                    queue.put_nowait(i)
+                    self.dirty.add(batch.batch_id)
+                    return
+                logger.error(f"Batch {batch.batch_id}: prompt #{i} failed on {resource} ({e})")
+                await batch.update(i, status=YoquBatch.ERROR, error=str(e), attempts=attempts,
+                                   elapsed=(datetime.utcnow() - t0).total_seconds())
+            # Written by _autosave()
+            self.dirty.add(batch.batch_id)
@@ -0,0 +1,49 @@
+#
+# Compare message extraction: one injected script (extraction="script") vs find_elements per message ("elements")
+#
+# PYTHONPATH=$PWD python ktxo/yoqu/benchmark/bench_extraction.py yoqu_rpa_chatgpt2.json <chat_id> [repeat]
+#
+import json
+import logging
+import sys
+import time
+
+from ktxo.yoqu.resource.rpa_chatgpt import RPAChatGPTResource
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+def bench_extraction(rpa: RPAChatGPTResource, repeat: int = 5) -> dict:
+    """Run both extraction paths over the chat already opened in the browser"""
+    results = {}
+    for name, fn in [("script", rpa._extract_messages), ("elements", rpa._extract_messages_elements)]:
+        roundtrips0 = rpa.browser.roundtrips
+        t0 = time.time()
+        for _ in range(repeat):
+            messages = fn()
+        results[name] = {"messages": len(messages),
+                         "code_blocks": sum(len(m.code_text) for m in messages),
+                         "roundtrips": (rpa.browser.roundtrips - roundtrips0) / repeat,
+                         "elapsed": round((time.time() - t0) / repeat, 3),
+                         "ids": [m.id for m in messages]}
+    results["same_messages"] = results["script"].pop("ids") == results["elements"].pop("ids")
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <resource_config.json> <chat_id> [repeat]")
+        sys.exit(1)
+    with open(sys.argv[1], "r", encoding="utf-8") as fd:
+        config = json.load(fd)
+    rpa = RPAChatGPTResource(config["name"], config)
+    rpa.start()
+    try:
+        rpa.browser.go2url(rpa.chat_id_url(sys.argv[2]))
+        rpa._wait_response()
+        print(json.dumps(bench_extraction(rpa, int(sys.argv[3]) if len(sys.argv) > 3 else 5), indent=4))
+    finally:
+        rpa.stop()
@@ -0,0 +1,144 @@
+#
+# Yoqu overhead without chat.openai.com: RPAChatGPTResource (through RPAManager: pool, executor) against FakeChatGPT
+#
+# PYTHONPATH=$PWD python ktxo/yoqu/benchmark/bench_offline.py yoqu_rpa_bench.json [--requests 10] [--concurrency 1]
+#        [--words 200] [--delay 20] [--save results.json] [--baseline results.json] [--tolerance 0.2]
+#
+# The resource file only needs the browser options (uc_options, options...), url/url_title/sleep_range are replaced.
+# Exit code 1 if any operation is slower than baseline * (1 + tolerance)
+#
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import sys
+import time
+
+from ktxo.yoqu.benchmark.fake_chatgpt import FakeChatGPT, FakeConfig
+from ktxo.yoqu.metrics import metrics
+from ktxo.yoqu.rpa_manager import RPAManager
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+def bench_config(config: dict, url: str) -> dict:
+    config = copy.deepcopy(config)
+    config["dump"] = False
+    config.pop("cache", None)
+    config["resource"].update({"url": url, "url_title": "ChatGPT", "sleep_range": [0, 0]})
+    config["resource"].pop("jitter", None)
+    return config
+
+
+def roundtrips(manager: RPAManager, name: str) -> int:
+    return sum(member.rpa.browser.roundtrips for member in manager.pools[name].members)
+
+
+async def bench_operation(manager: RPAManager, name: str, operation: str, args: list[tuple], concurrency: int) -> dict:
+    """Run operation (RPAChat method) once per args, concurrency requests at the same time"""
+    queue = list(args)
+    elapsed = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        while queue:
+            args_ = queue.pop(0)
+            t0 = time.perf_counter()
+            try:
+                async with manager.get_resource(name) as rpa:
+                    await manager.run(rpa, getattr(rpa, operation), *args_)
+            except Exception as e:
+                errors += 1
+                logger.error(f"{operation} failed ({e})")
+            elapsed.append(time.perf_counter() - t0)
+
+    roundtrips0 = roundtrips(manager, name)
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    total = time.perf_counter() - t0
+    return {"requests": len(args),
+            "errors": errors,
+            "throughput": round(len(args) / total, 3) if total else 0,
+            "avg": round(sum(elapsed) / len(elapsed), 3) if elapsed else 0,
+            "max": round(max(elapsed), 3) if elapsed else 0,
+            "roundtrips": round((roundtrips(manager, name) - roundtrips0) / len(args), 1) if args else 0}
+
+
+async def bench(config: dict, requests: int = 10, concurrency: int = 1, fake_config: FakeConfig = None) -> dict:
+    fake = FakeChatGPT(fake_config).start()
+    config = bench_config(config, fake.url)
+    name = config["name"]
+    manager = RPAManager({"rpas": [config]}, name)
+    if name not in manager.pools:
+        fake.stop()
+        raise Exception(f"Cannot start resource '{name}'")
+    try:
+        chat_ids = list(fake.chats.keys())
+        # Warm up (first page load, chats index)
+        await bench_operation(manager, name, "list_chats", [(True,)], 1)
+        metrics.reset()
+        results = {"list": await bench_operation(manager, name, "list_chats", [(True,)] * requests, concurrency),
+                   "get": await bench_operation(manager, name, "get_chat",
+                                                [(chat_ids[i % len(chat_ids)],) for i in range(requests)],
+                                                concurrency),
+                   "create": await bench_operation(manager, name, "create",
+                                                   [(f"Benchmark prompt {i}",) for i in range(requests)],
+                                                   concurrency),
+                   "chat": await bench_operation(manager, name, "send",
+                                                 [(chat_ids[i % len(chat_ids)], f"Benchmark message {i}")
+                                                  for i in range(requests)],
+                                                 concurrency)}
+        return {"config": {"requests": requests, "concurrency": concurrency, **fake.config.__dict__},
+                "operations": results,
+                "stages": metrics.summary(name)}
+    finally:
+        for pool in manager.pools.values():
+            pool.stop()
+        fake.stop()
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    found = []
+    for operation, result in results["operations"].items():
+        previous = baseline.get("operations", {}).get(operation, None)
+        if previous and previous["avg"] and result["avg"] > previous["avg"] * (1 + tolerance):
+            found.append(f"{operation}: {result['avg']} secs, baseline {previous['avg']} secs")
+        if previous and result["roundtrips"] > previous["roundtrips"] * (1 + tolerance):
+            found.append(f"{operation}: {result['roundtrips']} roundtrips, baseline {previous['roundtrips']}")
+    return found
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser(description="Offline benchmark with a fake ChatGPT page")
+    parser.add_argument("resource_config")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--delay", type=int, default=20, help="ms between streaming steps")
+    parser.add_argument("--save", help="Write results to this file")
+    parser.add_argument("--baseline", help="Compare with results from a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.resource_config, "r", encoding="utf-8") as fd:
+        resource_config = json.load(fd)
+    results = asyncio.run(bench(resource_config, args.requests, args.concurrency,
+                                FakeConfig(chats=args.chats, messages=args.messages, words=args.words,
+                                           delay=args.delay)))
+    print(json.dumps(results, indent=4))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fd:
+            json.dump(results, fd, indent=4)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fd:
+            found = regressions(results, json.load(fd), args.tolerance)
+        for regression in found:
+            logger.error(f"Regression {regression}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,254 @@
+#
+# Local stand-in for the ChatGPT UI (same selectors used by RPAChatGPTResource) with simulated streaming latency
+#
+# PYTHONPATH=$PWD python ktxo/yoqu/benchmark/fake_chatgpt.py [port] [chats] [messages] [words] [delay_ms]
+#
+from dataclasses import dataclass
+import html
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import re
+import sys
+import threading
+import uuid
+
+from ktxo.yoqu.resource.rpa_chatgpt import RPAChatGPTResource
+
+logger = logging.getLogger("ktxo.yoqu")
+
+# Path shown instead of the send button while the response is generated
+STOP_BUTTON_SVG = "M0 0h24v24H0z"
+NEW_CHAT_CLASS = ("h-10 rounded-lg px-2 text-token-text-secondary focus-visible:outline-0 "
+                  "hover:bg-token-sidebar-surface-secondary focus-visible:bg-token-sidebar-surface-secondary")
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+         "magna aliqua").split()
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>ChatGPT</title></head>
+<body>
+<nav aria-label="Chat history">
+  <button class="{new_chat_class}">ChatGPT</button>
+  <button class="{new_chat_class}" onclick="location.href='/'">New chat</button>
+  <ol id="chats">{sidebar}</ol>
+</nav>
+<div id="menu" role="menu" style="display:none">
+  <div role="menuitem">Share</div><div role="menuitem">Rename</div><div role="menuitem" id="menu-delete">Delete</div>
+</div>
+<div id="dialog" style="display:none"><button class="btn relative btn-danger" id="confirm-delete">Delete</button></div>
+<main><div role="presentation" id="messages">{messages}</div></main>
+<textarea id="prompt-textarea"></textarea>
+<button id="send"><svg><path d="{send_svg}"></path></svg></button>
+<script>
+var CFG = {config};
+var chatId = CFG.chatId, deleteId = null;
+function el(tag, attrs, text) {{
+    var e = document.createElement(tag);
+    for (var k in attrs) e.setAttribute(k, attrs[k]);
+    if (text) e.innerText = text;
+    return e;
+}}
+function codeBlock(c) {{
+    var pre = el("pre", {{}});
+    pre.appendChild(el("div", {{}})).appendChild(el("span", {{}}, c.type));
+    pre.appendChild(el("code", {{}}, c.lines.join("\\n")));
+    return pre;
+}}
+function addMessage(m, response) {{
+    var turn = el("div", {{"class": "w-full text-token-text-primary"}});
+    if (response) turn.appendChild(el("div", {{"class": "gizmo-bot-avatar"}}));
+    var body = turn.appendChild(el("div", {{"data-message-id": m.id}}));
+    var text = body.appendChild(el("div", {{"class": "markdown"}}, m.text));
+    (m.code || []).forEach(function(c) {{ body.appendChild(codeBlock(c)); }});
+    document.getElementById("messages").appendChild(turn);
+    return {{text: text, body: body}};
+}}
+function addChat(id, title) {{
+    var li = el("li", {{}});
+    li.appendChild(el("a", {{"href": "/c/" + id}}, title));
+    li.appendChild(el("button", {{"data-state": "closed", "data-chat-id": id}}));
+    var ol = document.getElementById("chats");
+    ol.insertBefore(li, ol.firstChild);
+}}
+function stream(node, m, done) {{
+    var words = m.text.split(" "), i = 0;
+    function next() {{
+        if (i >= words.length) {{
+            (m.code || []).forEach(function(c) {{ node.body.appendChild(codeBlock(c)); }});
+            return done();
+        }}
+        node.text.innerText = words.slice(0, i + CFG.chunk).join(" ");
+        i += CFG.chunk;
+        setTimeout(next, CFG.delay);
+    }}
+    setTimeout(next, CFG.firstToken);
+}}
+document.getElementById("send").addEventListener("click", function() {{
+    var prompt = document.getElementById("prompt-textarea"), text = prompt.value;
+    var path = document.querySelector("#send path");
+    if (!text) return;
+    prompt.value = "";
+    path.setAttribute("d", CFG.stopSvg);
+    fetch("/api/chats/" + (chatId || "new") + "/messages",
+          {{method: "POST", headers: {{"Content-Type": "application/json"}}, body: JSON.stringify({{text: text}})}})
+        .then(function(r) {{ return r.json(); }})
+        .then(function(rc) {{
+            if (!chatId) {{
+                chatId = rc.chat_id;
+                history.replaceState(null, "", "/c/" + chatId);
+                addChat(rc.chat_id, rc.title);
+            }}
+            addMessage(rc.request, false);
+            stream(addMessage({{id: rc.response.id, text: ""}}, true), rc.response,
+                   function() {{ path.setAttribute("d", CFG.sendSvg); }});
+        }});
+}});
+document.addEventListener("click", function(e) {{
+    if (e.target.getAttribute("data-state") === "closed") {{
+        deleteId = e.target.getAttribute("data-chat-id");
+        document.getElementById("menu").style.display = "block";
+    }} else if (e.target.id === "menu-delete") {{
+        document.getElementById("menu").style.display = "none";
+        document.getElementById("dialog").style.display = "block";
+    }} else if (e.target.id === "confirm-delete") {{
+        document.getElementById("dialog").style.display = "none";
+        fetch("/api/chats/" + deleteId + "/delete", {{method: "POST"}}).then(function() {{
+            var a = document.querySelector("a[href='/c/" + deleteId + "']");
+            if (a) a.parentNode.remove();
+            if (deleteId === chatId) location.href = "/";
+        }});
+    }}
+}});
+</script>
+</body>
+</html>
+"""
+
+
+@dataclass
+class FakeConfig():
+    chats: int = 20             # Chats in the sidebar at start
+    messages: int = 10          # Messages (request + response) in each of them
+    words: int = 200            # Words per response
+    code: int = 1               # Code blocks per response
+    chunk: int = 5              # Words rendered per streaming step
+    delay: int = 20             # ms between streaming steps
+    first_token: int = 200      # ms before the first streaming step
+
+
+class FakeChatGPT():
+    """In-memory chats served as ChatGPT-like pages, responses are rendered word by word in the browser"""
+
+    def __init__(self, config: FakeConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeConfig()
+        self.lock = threading.Lock()
+        self.chats: dict[str, dict] = {}
+        for i in range(self.config.chats):
+            chat_id = str(uuid.uuid4())
+            self.chats[chat_id] = {"title": f"Chat {i}", "messages": []}
+            for j in range(self.config.messages // 2):
+                self.chats[chat_id]["messages"] += self._turn(f"Prompt {j} of chat {i}")
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def _response(self) -> dict:
+        text = " ".join(WORDS[i % len(WORDS)] for i in range(self.config.words))
+        code = [{"type": "python", "lines": [f"def f{i}(x):", f"    return x * {i}"]} for i in range(self.config.code)]
+        return {"id": str(uuid.uuid4()), "text": text, "code": code}
+
+    def _turn(self, prompt: str) -> list[dict]:
+        return [{"id": str(uuid.uuid4()), "text": prompt, "code": [], "type": "REQUEST"},
+                {**self._response(), "type": "RESPONSE"}]
+
+    def _message_html(self, m: dict) -> str:
+        avatar = '<div class="gizmo-bot-avatar"></div>' if m["type"] == "RESPONSE" else ""
+        code = "".join(f'<pre><div><span>{html.escape(c["type"])}</span></div>'
+                       f'<code>{html.escape(chr(10).join(c["lines"]))}</code></pre>' for c in m["code"])
+        return (f'<div class="w-full text-token-text-primary">{avatar}<div data-message-id="{m["id"]}">'
+                f'<div class="markdown">{html.escape(m["text"])}</div>{code}</div></div>')
+
+    def page(self, chat_id: str = None) -> str:
+        with self.lock:
+            chats = list(self.chats.items())
+            messages = self.chats[chat_id]["messages"] if chat_id in self.chats else []
+            sidebar = "".join(f'<li><a href="/c/{id_}">{html.escape(chat["title"])}</a>'
+                              f'<button data-state="closed" data-chat-id="{id_}"></button></li>'
+                              for id_, chat in reversed(chats))
+            messages = "".join(self._message_html(m) for m in messages)
+        config = {"chatId": chat_id, "chunk": self.config.chunk, "delay": self.config.delay,
+                  "firstToken": self.config.first_token,
+                  "sendSvg": RPAChatGPTResource.SEND_BUTTON_SVG, "stopSvg": STOP_BUTTON_SVG}
+        return PAGE.format(new_chat_class=NEW_CHAT_CLASS, sidebar=sidebar, messages=messages,
+                           send_svg=RPAChatGPTResource.SEND_BUTTON_SVG, config=json.dumps(config))
+
+    def send(self, chat_id: str, text: str) -> dict:
+        with self.lock:
+            if chat_id == "new" or chat_id not in self.chats:
+                chat_id = str(uuid.uuid4())
+                self.chats[chat_id] = {"title": " ".join(text.split()[:4]), "messages": []}
+            request, response = self._turn(text)
+            self.chats[chat_id]["messages"] += [request, response]
+            return {"chat_id": chat_id, "title": self.chats[chat_id]["title"], "request": request, "response": response}
+
+    def delete(self, chat_id: str):
+        with self.lock:
+            self.chats.pop(chat_id, None)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body: str, content_type: str = "text/html"):
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                groups = re.match(r"^/c/([^/?]+)", self.path)
+                self._reply(fake.page(groups.group(1) if groups else None))
+
+            def do_POST(self):
+                groups = re.match(r"^/api/chats/([^/]+)/(messages|delete)$", self.path)
+                if not groups:
+                    self.send_error(404)
+                    return
+                if groups.group(2) == "delete":
+                    fake.delete(groups.group(1))
+                    self._reply("{}", "application/json")
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                self._reply(json.dumps(fake.send(groups.group(1), body.get("text", ""))), "application/json")
+
+            def log_message(self, format, *args):
+                logger.debug(f"Fake ChatGPT: {format % args}")
+
+        return Handler
+
+    def start(self) -> "FakeChatGPT":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-chatgpt", daemon=True)
+        self.thread.start()
+        logger.info(f"Fake ChatGPT on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = [int(a) for a in sys.argv[1:6]]
+    config = FakeConfig(**dict(zip(["chats", "messages", "words", "delay"], args[1:])))
+    fake = FakeChatGPT(config, port=args[0] if args else 8090)
+    logger.info(f"Fake ChatGPT on {fake.url} ({config})")
+    fake.server.serve_forever()
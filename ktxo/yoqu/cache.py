@@ -0,0 +1,89 @@
+#
+# Completion cache for one-shot chats (create(..., delete_after=True)), SQLite file with TTL and LRU eviction
+#
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from ktxo.yoqu.common.helper import build_folders
+from ktxo.yoqu.common.model import RPAChat
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt.strip())
+
+
+class YoquCompletionCache():
+    """
+    Key: resource type + normalized prompt (same prompt, same response). Configuration (resource file):
+        "cache": {"enabled": false, "filename": "cache/completions.db", "ttl": 86400, "max_size": 10000}
+    """
+
+    def __init__(self, filename: str = "cache/completions.db", ttl: float = 86400, max_size: int = 10000):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_size = max_size
+        if filename != ":memory:":
+            build_folders(os.path.dirname(os.path.abspath(filename)))
+        # Used from the worker thread of each browser
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS completions "
+                          "(key TEXT PRIMARY KEY, chat TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(type_: str, prompt: str) -> str:
+        return hashlib.sha256(f"{type_}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, type_: str, prompt: str) -> RPAChat | None:
+        key = self.key(type_, prompt)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT chat, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return RPAChat(**json.loads(row[0]))
+
+    def put(self, type_: str, prompt: str, chat: RPAChat) -> int:
+        """Add chat, returns number of evicted entries"""
+        now = time.time()
+        data = json.dumps(dataclasses.asdict(chat), ensure_ascii=False, default=str)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO completions (key, chat, created, accessed) VALUES (?, ?, ?, ?)",
+                              (self.key(type_, prompt), data, now, now))
+            evicted = 0
+            if self.ttl:
+                evicted += self.conn.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,)).rowcount
+            size = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            if size > self.max_size:
+                evicted += self.conn.execute("DELETE FROM completions WHERE key IN "
+                                             "(SELECT key FROM completions ORDER BY accessed LIMIT ?)",
+                                             (size - self.max_size,)).rowcount
+            self.conn.commit()
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM completions")
+            self.conn.commit()
+
+    def info(self) -> dict:
+        with self.lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {"filename": self.filename, "ttl": self.ttl, "max_size": self.max_size, "size": size}
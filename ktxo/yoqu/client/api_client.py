@@ -1,40 +1,92 @@
+import asyncio
+import json
 import logging
 import logging.config
+from typing import AsyncIterator, Iterator
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger("ktxo.yoqu")
 
+# Completions can take several minutes (RPA waits up to 600 secs for a response)
+TIMEOUT = 900
+CONNECT_TIMEOUT = 5
+RETRY_STATUS = (502, 503, 504)
+
+
+def parse_event(line: str, event: str = None) -> tuple[str | None, dict | None]:
+    """One line of Server-Sent Events (/yoqu/completions/stream/) -> (current event, {event: data} or None)"""
+    if line.startswith("event:"):
+        return line[len("event:"):].strip(), None
+    if line.startswith("data:") and event:
+        return None, {event: json.loads(line[len("data:"):].strip())}
+    return event, None
+
 
 class APIWrapper():
-    def __init__(self, host: str = "127.0.0.1", port: int = 8000):
+    def __init__(self, host: str = "127.0.0.1", port: int = 8000,
+                 timeout: float = TIMEOUT, retries: int = 3, backoff: float = 0.5, pool_size: int = 10):
         self.host = host
         self.port = port
         self.base_url = f"http://{host}:{port}"
+        self.timeout = (CONNECT_TIMEOUT, timeout)
+        # Session (and its connections) is kept alive between requests. Retries: connection errors (any method,
+        # request not sent) and 502/503/504 for GET only (POST/PUT could send the same prompt twice)
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=0,
+                      status=retries,
+                      backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUS,
+                      allowed_methods=["GET"],
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
         self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
 
     def _do_request(self, method: str, url, params: dict = None, data: dict = None):
-        with self.session as s:
-            res = s.request(method, url, params=params, json=data)
-            if res.status_code != 200:
-                logger.error(f"OPS: {url} {res}")
-                logger.error(res.json())
-                return res.json()
+        res = self.session.request(method, url, params=params, json=data, timeout=self.timeout)
+        if res.status_code != 200:
+            logger.error(f"OPS: {url} {res}")
+            logger.error(res.json())
             return res.json()
+        return res.json()
 
     def get_chats(self, resource: str = "chatgpt1") -> list[dict[str, str]]:
         return self._do_request("get",
                                 f"{self.base_url}/yoqu/completions/",
                                 params={"resource_name": resource})
 
-    def get_chat(self, chat_id, resource: str = "chatgpt1") -> dict:
+    def get_chat(self, chat_id, resource: str = "chatgpt1", since_message_id: str = None, incremental=False) -> dict:
+        params = {"resource_name": resource, "incremental": incremental}
+        if since_message_id:
+            params["since_message_id"] = since_message_id
         return self._do_request("get",
                                 f"{self.base_url}/yoqu/completions/{chat_id}",
-                                params={"resource_name": resource})
+                                params=params)
 
-    def update_chat(self, chat_id, prompt: str, resource: str = "chatgpt1") -> dict:
-        data = {"chat_id": chat_id, "prompt": prompt, "resource_name": resource}
+    def update_chat(self, chat_id, prompt: str, resource: str = "chatgpt1",
+                    since_message_id: str = None, incremental=False) -> dict:
+        data = {"chat_id": chat_id,
+                "prompt": prompt,
+                "resource_name": resource,
+                "since_message_id": since_message_id,
+                "incremental": incremental}
         return self._do_request("put",
-                                f"{self.base_url}/yoqu/completions",
+                                f"{self.base_url}/yoqu/completions/",
                                 data=data)
 
     def new_chat(self, prompt: str, resource: str = "chatgpt1", delete_after=False) -> dict:
@@ -42,9 +94,46 @@ class APIWrapper():
                 "resource_name": resource,
                 "delete_after": delete_after}
         return self._do_request("post",
-                                f"{self.base_url}/yoqu/completions",
+                                f"{self.base_url}/yoqu/completions/",
                                 data=data)
 
+    def stream_chat(self, prompt: str, chat_id: str = None, resource: str = "chatgpt1", delete_after=False,
+                    since_message_id: str = None, incremental=False) -> Iterator[dict]:
+        """
+        New chat (chat_id None) or update chat_id, yields {"delta": text} while the response is generated
+        ({"replace": text} with the whole response so far when the page rendered it again) and {"chat": dict} at
+        the end
+        """
+        data = {"prompt": prompt,
+                "chat_id": chat_id,
+                "resource_name": resource,
+                "delete_after": delete_after,
+                "since_message_id": since_message_id,
+                "incremental": incremental}
+        with self.session.post(f"{self.base_url}/yoqu/completions/stream/", json=data, stream=True,
+                               timeout=self.timeout) as res:
+            if res.status_code != 200:
+                logger.error(f"OPS: {res.url} {res}")
+                logger.error(res.json())
+                raise Exception(res.json())
+            event = None
+            for line in res.iter_lines(decode_unicode=True):
+                event, item = parse_event(line, event)
+                if item:
+                    yield item
+
+    def new_batch(self, prompts: list[str], resources: list[str] = None, delete_after=True, name: str = None,
+                  wait=False) -> dict:
+        data = {"prompts": prompts, "resources": resources, "delete_after": delete_after, "name": name}
+        return self._do_request("post",
+                                f"{self.base_url}/yoqu/batches/",
+                                params={"wait": wait},
+                                data=data)
+
+    def get_batch(self, batch_id: str) -> dict:
+        return self._do_request("get",
+                                f"{self.base_url}/yoqu/batches/{batch_id}")
+
     def start_resource(self, resource: str = "chatgpt1") -> dict:
         return self._do_request("post",
                                 f"{self.base_url}/admin/start/{resource}")
@@ -63,7 +152,141 @@ class APIWrapper():
 
     def list_resources(self) -> list[str]:
         return self._do_request("get",
-                                f"{self.base_url}/admin")
+                                f"{self.base_url}/admin/")
+
+
+class AsyncAPIWrapper():
+    """
+    asyncio version of APIWrapper (httpx), one client with keep-alive connections for all requests, e.g.:
+        async with AsyncAPIWrapper() as api:
+            chats = await asyncio.gather(*[api.new_chat(prompt, resource, True) for prompt in prompts])
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8000,
+                 timeout: float = TIMEOUT, retries: int = 3, backoff: float = 0.5, pool_size: int = 10):
+        self.host = host
+        self.port = port
+        self.base_url = f"http://{host}:{port}"
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+                                        limits=httpx.Limits(max_connections=pool_size,
+                                                            max_keepalive_connections=pool_size))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _do_request(self, method: str, url, params: dict = None, data: dict = None):
+        # Same retries as APIWrapper: connection errors (any method) and 502/503/504 for GET only
+        attempt = 0
+        while True:
+            try:
+                res = await self.client.request(method, url, params=params, json=data)
+                if not (method == "get" and res.status_code in RETRY_STATUS and attempt < self.retries):
+                    break
+                logger.warning(f"Retrying {url} ({res.status_code})")
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"Retrying {url} ({e})")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+        if res.status_code != 200:
+            logger.error(f"OPS: {url} {res}")
+            logger.error(res.json())
+            return res.json()
+        return res.json()
+
+    async def get_chats(self, resource: str = "chatgpt1") -> list[dict[str, str]]:
+        return await self._do_request("get",
+                                      f"{self.base_url}/yoqu/completions/",
+                                      params={"resource_name": resource})
+
+    async def get_chat(self, chat_id, resource: str = "chatgpt1", since_message_id: str = None,
+                       incremental=False) -> dict:
+        params = {"resource_name": resource, "incremental": incremental}
+        if since_message_id:
+            params["since_message_id"] = since_message_id
+        return await self._do_request("get",
+                                      f"{self.base_url}/yoqu/completions/{chat_id}",
+                                      params=params)
+
+    async def update_chat(self, chat_id, prompt: str, resource: str = "chatgpt1",
+                          since_message_id: str = None, incremental=False) -> dict:
+        data = {"chat_id": chat_id,
+                "prompt": prompt,
+                "resource_name": resource,
+                "since_message_id": since_message_id,
+                "incremental": incremental}
+        return await self._do_request("put",
+                                      f"{self.base_url}/yoqu/completions/",
+                                      data=data)
+
+    async def new_chat(self, prompt: str, resource: str = "chatgpt1", delete_after=False) -> dict:
+        data = {"prompt": prompt,
+                "resource_name": resource,
+                "delete_after": delete_after}
+        return await self._do_request("post",
+                                      f"{self.base_url}/yoqu/completions/",
+                                      data=data)
+
+    async def stream_chat(self, prompt: str, chat_id: str = None, resource: str = "chatgpt1", delete_after=False,
+                          since_message_id: str = None, incremental=False) -> AsyncIterator[dict]:
+        data = {"prompt": prompt,
+                "chat_id": chat_id,
+                "resource_name": resource,
+                "delete_after": delete_after,
+                "since_message_id": since_message_id,
+                "incremental": incremental}
+        async with self.client.stream("post", f"{self.base_url}/yoqu/completions/stream/", json=data) as res:
+            if res.status_code != 200:
+                await res.aread()
+                logger.error(f"OPS: {res.url} {res}")
+                logger.error(res.json())
+                raise Exception(res.json())
+            event = None
+            async for line in res.aiter_lines():
+                event, item = parse_event(line, event)
+                if item:
+                    yield item
+
+    async def new_batch(self, prompts: list[str], resources: list[str] = None, delete_after=True, name: str = None,
+                        wait=False) -> dict:
+        data = {"prompts": prompts, "resources": resources, "delete_after": delete_after, "name": name}
+        return await self._do_request("post",
+                                      f"{self.base_url}/yoqu/batches/",
+                                      params={"wait": wait},
+                                      data=data)
+
+    async def get_batch(self, batch_id: str) -> dict:
+        return await self._do_request("get",
+                                      f"{self.base_url}/yoqu/batches/{batch_id}")
+
+    async def start_resource(self, resource: str = "chatgpt1") -> dict:
+        return await self._do_request("post",
+                                      f"{self.base_url}/admin/start/{resource}")
+
+    async def refresh_resource(self, resource: str = "chatgpt1") -> dict:
+        return await self._do_request("post",
+                                      f"{self.base_url}/admin/refresh/{resource}")
+
+    async def stop_resource(self, resource: str = "chatgpt1") -> dict:
+        return await self._do_request("post",
+                                      f"{self.base_url}/admin/stop/{resource}")
+
+    async def info_resource(self, resource: str = "chatgpt1"):
+        return await self._do_request("get",
+                                      f"{self.base_url}/admin/stats/{resource}")
+
+    async def list_resources(self) -> list[str]:
+        return await self._do_request("get",
+                                      f"{self.base_url}/admin/")
 
 
 if __name__ == '__main__':
@@ -7,3 +7,6 @@ class YoquNotFoundException(YoquException):
 
 class YoquBlockedException(YoquException):
     """"""
+
+class YoquBrowserException(YoquException):
+    """Browser not running or page not responding as expected (counts for the circuit breaker, see pool.py)"""
@@ -7,6 +7,7 @@ import logging
 import os
 import psutil
 import re
+import threading
 from typing import Any
 import uuid
 
@@ -69,50 +70,86 @@ def write_binary(data: Any, filename: str, folder: str = None, unique: bool = Fa
 
 
 class ProcessHelper():
+    """
+    Lookups read only the target process when its pid is known: pids of processes started by yoqu (start_process,
+    browsers and chromedrivers, see RPAChrome) are kept in a registry, all processes are scanned only as last resort.
+    """
+    registry: dict[int, list[str]] = {}
+    registry_lock = threading.Lock()
+
     @staticmethod
-    def start_process(command: list[str] | str) -> int:
+    def _command_line(command: list[str] | str) -> list[str]:
         if isinstance(command, str):
-            command = command.split()
+            return [c.strip() for c in command.split()]
+        return command
+
+    @classmethod
+    def register(cls, pid: int, command: list[str] | str = None):
+        if pid is None or pid <= 0:
+            return
+        with cls.registry_lock:
+            cls.registry[pid] = cls._command_line(command) if command else None
+
+    @classmethod
+    def unregister(cls, pid: int):
+        with cls.registry_lock:
+            cls.registry.pop(pid, None)
+
+    @staticmethod
+    def is_running(pid: int) -> bool:
+        """Only reads process pid (no scan of all processes), zombies are not running"""
+        if pid is None or pid <= 0:
+            return False
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return False
+
+    @classmethod
+    def start_process(cls, command: list[str] | str) -> int:
+        command = cls._command_line(command)
         logger.debug(f"Starting process with '{command}'")
-        return psutil.Popen(command).pid
+        pid = psutil.Popen(command).pid
+        cls.register(pid, command)
+        return pid
 
     @staticmethod
-    def get_process(command: list[str] | str) -> psutil.Process:
-        command_line = command
-        if isinstance(command, str):
-            command_line = [c.strip() for c in command.split()]
-        for process_ in psutil.process_iter():
-            if process_.cmdline() == command_line:
+    def _by_pid(pid: int, command_line: list[str]) -> psutil.Process | None:
+        try:
+            process = psutil.Process(pid)
+            if process.cmdline() == command_line:
+                return process
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+        return None
+
+    @classmethod
+    def get_process(cls, command: list[str] | str, pid: int = None) -> psutil.Process:
+        command_line = cls._command_line(command)
+        # pid, then registered pids, then all processes (cmdline read once per process)
+        with cls.registry_lock:
+            pids = [pid_ for pid_, command_ in cls.registry.items() if command_ in [None, command_line]]
+        for pid_ in ([pid] if pid and pid > 0 else []) + pids:
+            if process := cls._by_pid(pid_, command_line):
+                return process
+        for process_ in psutil.process_iter(["cmdline"]):
+            if process_.info["cmdline"] == command_line:
                 return process_
         return None
 
-    @staticmethod
-    def process_exist(command: list[str] | str, pid:int) -> int:
-        command_line = command
-        if isinstance(command, str):
-            command_line = [c.strip() for c in command.split()]
+    @classmethod
+    def process_exist(cls, command: list[str] | str, pid:int) -> int:
+        command_line = cls._command_line(command)
         try:
             logger.debug(f"Checking '{' '.join(command_line)}'")
-            processes = psutil.process_iter()
-            process = None
-            for process_ in processes:
-                try:
-                    if process_.pid == pid and process_.status() == psutil.STATUS_ZOMBIE:
-                        logger.warning(f"Process pid={process_.pid} zombie, waiting 1 sec, rc={process_.wait(1)}")
-                    if process_.cmdline() == command_line:
-                        process = process_
-                        break
-                except psutil.NoSuchProcess:
-                    try:
-                        logger.warning(f"Process pid={process_.pid} zombie, waiting 1 sec, rc={process_.wait(1)}")
-                    except:
-                        pass
+            if pid and pid > 0 and cls.reap_zombies([pid]):
+                return -1
+            process = cls.get_process(command_line, pid)
             if process is None:
                 return -1
-
             if process.status() == psutil.STATUS_ZOMBIE:
-                logger.warning(f"Process pid={process.pid} zombie, waiting 1 sec")
-                process.wait(1)
+                logger.warning(f"Process pid={process.pid} zombie")
+                cls.reap_zombies([process.pid])
                 return -1
             logger.debug(f"Process pid={process.pid} {process.status()}")
             return process.pid
@@ -123,3 +160,27 @@ class ProcessHelper():
             logger.error(e)
             return -1
 
+    @classmethod
+    def reap_zombies(cls, pids: list[int] = None) -> int:
+        """Reap zombies among pids (default: registered ones) in one call without waiting, returns how many"""
+        if pids is None:
+            with cls.registry_lock:
+                pids = list(cls.registry.keys())
+        zombies = []
+        for pid in pids:
+            try:
+                process = psutil.Process(pid)
+                if process.status() == psutil.STATUS_ZOMBIE:
+                    zombies.append(process)
+            except psutil.NoSuchProcess:
+                cls.unregister(pid)
+            except psutil.AccessDenied:
+                pass
+        if not zombies:
+            return 0
+        # Only children can be reaped, others are reaped by their parent
+        gone, _ = psutil.wait_procs(zombies, timeout=0)
+        for process in gone:
+            cls.unregister(process.pid)
+        logger.info(f"{len(gone)}/{len(zombies)} zombie processes reaped")
+        return len(gone)
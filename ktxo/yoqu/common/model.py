@@ -1,4 +1,5 @@
 import dataclasses
+import json
 from dataclasses import field
 from datetime import datetime
 from enum import Enum
@@ -6,6 +7,7 @@ from pydantic import BaseModel
 from pydantic.dataclasses import dataclass
 from typing import Literal, Optional
 import uuid
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -25,12 +27,20 @@ class YoquStatRequests(YoquBase):
     ko_last: datetime = None
 
 
+@dataclass
+class YoquStatCache(YoquBase):
+    hits:int = 0
+    misses:int = 0
+    evictions:int = 0
+
+
 @dataclass
 class YoquStats(YoquBase):
     status: str = ""
     elapsed: float = 0
     context:dict = field(default_factory=dict)
     requests:YoquStatRequests = field(default_factory=YoquStatRequests)
+    cache:YoquStatCache = field(default_factory=YoquStatCache)
     dt: datetime = datetime.utcnow()
 
 
@@ -81,12 +91,13 @@ class RPAMessage(YoquBase):
 class RPAChat(YoquBase):
     name: str
     messages: list[RPAMessage]|list[list[RPAMessage]] = field(default_factory=list)
-    type:str = None
-    resource:str = None
+    type:Optional[str] = None
+    resource:Optional[str] = None
     #messages: list[RPAChatMessage] = dataclasses.field(default_factory=list)
     chat_id: str = str(uuid.uuid4())
     online:bool = False
-    dt: datetime = datetime.utcnow()
+    dt: datetime = field(default_factory=datetime.utcnow)
+    since_message_id: Optional[str] = None # Only messages after this one (incremental), None: full chat
 
     def __str__(self) -> str:
         return f"RPAChat(name='{self.name}' chat_id={self.chat_id} num_messages={len(self.messages)})"
@@ -108,6 +119,9 @@ class RPAChat(YoquBase):
 #
 class Messages(SQLModel, table=True):
     __tablename__ = "messages"
+    # Keyset pagination by resource (see db.get_messages), full-text search in messages_fts (db.init_db)
+    __table_args__ = (Index("ix_messages_resource_created", "resource", "created", "id"),
+                      Index("ix_messages_created", "created", "id"))
     id: Optional[str] = Field(default=str(uuid.uuid4()), primary_key=True)
     message_id: str
     name:Optional[str] = None
@@ -123,10 +137,49 @@ class Messages(SQLModel, table=True):
         return {k: str(v) for k, v in dataclasses.asdict(self).items()}
 
 
+class Jobs(SQLModel, table=True):
+    """Completion requests queued by the API and executed by worker processes (see ktxo/yoqu/worker.py)"""
+    __tablename__ = "jobs"
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    operation:str = "create"                            # create | chat
+    resource:Optional[str] = Field(default=None, index=True)  # None: any worker
+    request:str                                         # CompletionRequest (json)
+    status:str = Field(default="PENDING", index=True)   # PENDING | RUNNING | DONE | ERROR
+    worker:Optional[str] = None
+    attempts:int = 0
+    result:Optional[str] = None                         # RPAChat (json)
+    error:Optional[str] = None
+    created:datetime = Field(default_factory=datetime.utcnow, index=True)
+    updated:datetime = Field(default_factory=datetime.utcnow)
+    heartbeat:Optional[datetime] = None
+
+    def asdict(self) -> dict:
+        return {"job_id": self.id,
+                "operation": self.operation,
+                "resource": self.resource,
+                "status": self.status,
+                "worker": self.worker,
+                "attempts": self.attempts,
+                "result": json.loads(self.result) if self.result else None,
+                "error": self.error,
+                "created": str(self.created),
+                "updated": str(self.updated)}
+
+
 # API
 class CompletionRequest(BaseModel):
     chat_id:Optional[str] = None
     prompt:Optional[str] = None
     name:Optional[str] = None
     resource_name:Optional[str] = None
-    delete_after:Optional[bool] = False
\ No newline at end of file
+    delete_after:Optional[bool] = False
+    since_message_id:Optional[str] = None
+    incremental:Optional[bool] = False
+    use_cache:Optional[bool] = True
+
+
+class BatchRequest(BaseModel):
+    prompts:list[str]
+    name:Optional[str] = None
+    resources:Optional[list[str]] = None
+    delete_after:Optional[bool] = True
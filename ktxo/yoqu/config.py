@@ -7,9 +7,16 @@ class Settings(BaseSettings):
     rpa_config_file:str
     rpa_default_name: str
     db_url:str
+    db_write_behind:bool = True     # Persist every chat in Messages
+    db_flush_interval:float = 1     # Secs between writes
     api_address:str
     api_port:int
     api_template_folder:str
+    batch_folder:str = "batches"
+    archive_folder:str = "archive"  # Compressed chats (ktxo/yoqu/archive.py)
+    supervisor_interval:float = 30  # Secs between health probes of the browsers, 0 disables the supervisor
+    supervisor_backoff:float = 30   # Secs before restarting again a browser that cannot be started (doubled each time)
+    supervisor_backoff_max:float = 600
     model_config = SettingsConfigDict()
 
 
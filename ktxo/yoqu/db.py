@@ -1,29 +1,102 @@
 import asyncio
+from datetime import datetime, timedelta
 import json
 import logging
 import os
 
-from sqlmodel import select, and_
+import dataclasses
+
+from sqlmodel import SQLModel, select, update, and_, or_, text
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
 from ktxo.yoqu.config import settings
-from ktxo.yoqu.common.model import Messages
+from ktxo.yoqu.common.model import Messages, Jobs, RPAChat, RPAMessage
 
 logger = logging.getLogger("ktxo.yoqu")
 
-connect_args = {"check_same_thread": False}
+# timeout: API and worker processes share the SQLite file, wait for locks instead of failing
+connect_args = {"check_same_thread": False, "timeout": 30}
 engine = create_async_engine(settings.db_url, echo=False, connect_args=connect_args)
 
 
+# Full-text search over chat names and message texts, kept in sync with messages by triggers
+FTS_TEXT = ("CASE WHEN json_valid(new.messages) "
+            "THEN (SELECT group_concat(json_extract(value, '$.text'), char(10)) FROM json_each(new.messages)) "
+            "ELSE new.messages END")
+FTS_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(name, text)",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    f"INSERT INTO messages_fts(rowid, name, text) VALUES (new.rowid, new.name, {FTS_TEXT}); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN "
+    "DELETE FROM messages_fts WHERE rowid = old.rowid; "
+    f"INSERT INTO messages_fts(rowid, name, text) VALUES (new.rowid, new.name, {FTS_TEXT}); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "DELETE FROM messages_fts WHERE rowid = old.rowid; END",
+]
+fts_enabled = False
+
+MESSAGES_COLUMNS = [Messages.id, Messages.message_id, Messages.name, Messages.resource, Messages.type,
+                    Messages.online, Messages.tags, Messages.created, Messages.updated]
+
+
+def _init_fts(conn) -> bool:
+    exists = conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE name = 'messages_fts'").first()
+    try:
+        for sql in FTS_SQL:
+            conn.exec_driver_sql(sql)
+    except Exception as e:
+        logger.warning(f"Full-text search not available, using LIKE. ({e})")
+        return False
+    if not exists:
+        # Rows stored before the index existed
+        conn.exec_driver_sql("INSERT INTO messages_fts(rowid, name, text) "
+                             f"SELECT rowid, name, {FTS_TEXT.replace('new.', '')} FROM messages")
+    return True
+
+
+async def init_db():
+    global fts_enabled
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        # create_all skips indexes of existing tables
+        for index in Messages.__table__.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+        if settings.db_url.startswith("sqlite"):
+            fts_enabled = await conn.run_sync(_init_fts)
+
+
 async def get_session() -> AsyncSession:
     async with AsyncSession(engine) as session:
         yield session
 
 
+def _fts_query(query: str) -> str:
+    # Each word as a phrase (no FTS5 syntax errors), all words required
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+def encode_cursor(row: dict) -> str:
+    return f"{row['created']}|{row['id']}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    created, id_ = cursor.split("|", 1)
+    return datetime.fromisoformat(created), id_
+
+
 async def get_messages(session:AsyncSession,
                        id_: str = None,
                        resource_name: str = None,
-                       name: str = None):
+                       name: str = None,
+                       query: str = None,
+                       limit: int = 50,
+                       cursor: str = None,
+                       with_messages: bool = False) -> dict:
+    """
+    Page of chats, newest first: {"items": [...], "next": cursor of the next page or None}.
+    query: full-text search in names and message texts, messages column only loaded if with_messages
+    """
     async with session:
         filter_ = []
         if id_:
@@ -32,19 +105,54 @@ async def get_messages(session:AsyncSession,
             filter_.append(Messages.resource == resource_name)
         if name:
             filter_.append(Messages.name.like(f"%{name}%"))
+        if query:
+            if fts_enabled:
+                filter_.append(text("messages.rowid IN "
+                                    "(SELECT rowid FROM messages_fts WHERE messages_fts MATCH :query)")
+                               .bindparams(query=_fts_query(query)))
+            else:
+                filter_.append(or_(Messages.name.like(f"%{query}%"), Messages.messages.like(f"%{query}%")))
+        if cursor:
+            created, last_id = decode_cursor(cursor)
+            filter_.append(or_(Messages.created < created,
+                               and_(Messages.created == created, Messages.id < last_id)))
 
+        columns = MESSAGES_COLUMNS + ([Messages.messages] if with_messages else [])
+        statement = (select(*columns)
+                     .order_by(Messages.created.desc(), Messages.id.desc())
+                     .limit(limit + 1))
         if filter_:
-            messages = await session.execute(select(Messages).filter(and_(*filter_)))
-        else:
-            messages = await session.execute(select(Messages))
-        rows = messages.fetchall()
-        # :-((((
-        rows = [row._asdict() for row in rows]
-        for row in rows:
-            row["created"] = str(row["Messages"].created)
-            row["updated"] = str(row["Messages"].updated)
-            row["messages"] = json.loads(row["Messages"].messages)
-        return rows
+            statement = statement.filter(and_(*filter_))
+        result = (await session.execute(statement)).mappings().all()
+        rows = []
+        for m in result[:limit]:
+            row = dict(m)
+            row["created"] = str(m["created"])
+            row["updated"] = str(m["updated"])
+            if with_messages:
+                row["messages"] = json.loads(m["messages"])
+            rows.append(row)
+        return {"items": rows, "next": encode_cursor(rows[-1]) if len(result) > limit else None}
+
+
+async def get_chat(session:AsyncSession, chat_id: str) -> RPAChat | None:
+    """Chat stored in Messages (see YoquChatWriter)"""
+    async with session:
+        m = (await session.execute(select(Messages).filter(Messages.id == chat_id))).scalars().first()
+        if m is None:
+            return None
+        return RPAChat(name=m.name,
+                       chat_id=m.id,
+                       messages=[RPAMessage(**message) for message in json.loads(m.messages)],
+                       type=m.type,
+                       resource=m.resource,
+                       dt=m.updated)
+
+
+async def get_chat_resource(session:AsyncSession, chat_id: str) -> str | None:
+    """Resource that has chat_id (last one that returned it, see YoquChatWriter)"""
+    async with session:
+        return (await session.execute(select(Messages.resource).filter(Messages.id == chat_id))).scalars().first()
 
 
 async def add_message(session:AsyncSession,
@@ -60,7 +168,6 @@ async def add_message(session:AsyncSession,
         logger.error(f"Encountered an error while accessing the DB. ({e})")
         return None
 
-from ktxo.yoqu.common.model import RPAChat
 async def add_message2(session:AsyncSession,
                       chat: RPAChat) -> Messages:
     #async with AsyncSession(engine, expire_on_commit=False) as session:
@@ -82,23 +189,219 @@ async def update_message(session:AsyncSession,
                          deleted: bool = None) -> Messages:
     try:
         async with session:
-            m: Messages = (await session.execute(select(Messages).filter(Messages.id == id_))).fetchone()
-            if not m:
-                return None
-            m = m[0]
-            if resource_name: m.resource = resource_name
+            values = {"updated": datetime.utcnow()}
+            if resource_name:
+                values["resource"] = resource_name
             if type_:
-                m.type = type_
+                values["type"] = type_
             if messages:
-                m.messages = messages
+                values["messages"] = messages
             if deleted is not None:
-                m.deleted = deleted
-            session.add(m)
+                values["online"] = not deleted
+            # One statement, no select/refresh roundtrips: the returned row (not an ORM instance, expired by commit)
+            row = (await session.execute(update(Messages)
+                                         .where(Messages.id == id_)
+                                         .values(**values)
+                                         .returning(*Messages.__table__.columns))).mappings().first()
             await session.commit()
-            await session.refresh(m)
-            return m
+            return Messages(**row) if row else None
     except Exception as e:
         logger.error(f"Encountered an error while accessing the DB. ({e})")
         return None
 
 
+def chat_to_row(chat: RPAChat) -> dict:
+    now = datetime.utcnow()
+    return {"id": chat.chat_id,
+            "message_id": chat.messages[-1].id if chat.messages else "",
+            "name": chat.name,
+            "resource": chat.resource or "default",
+            "type": chat.type or "chatgpt",
+            "messages": json.dumps([dataclasses.asdict(m) for m in chat.messages], ensure_ascii=False, default=str),
+            "online": True,
+            "created": now,
+            "updated": now}
+
+
+async def upsert_chats(session:AsyncSession, chats: list[RPAChat]) -> int:
+    """Insert or update chats in one transaction, incremental chats (since_message_id) are appended to the stored ones"""
+    rows = {}
+    for chat in chats:
+        if not chat.chat_id:
+            continue
+        row = chat_to_row(chat)
+        if chat.since_message_id and chat.chat_id in rows:
+            previous = json.loads(rows[chat.chat_id]["messages"])
+            row["messages"] = json.dumps(previous + json.loads(row["messages"]), ensure_ascii=False)
+        row["partial"] = bool(chat.since_message_id)
+        rows[chat.chat_id] = row
+    if not rows:
+        return 0
+    async with session:
+        partial = [id_ for id_, row in rows.items() if row["partial"]]
+        if partial:
+            stored = await session.execute(select(Messages.id, Messages.messages).filter(Messages.id.in_(partial)))
+            for id_, messages in stored.all():
+                new = json.loads(rows[id_]["messages"])
+                ids = {m["id"] for m in new}
+                rows[id_]["messages"] = json.dumps([m for m in json.loads(messages) if m["id"] not in ids] + new,
+                                                   ensure_ascii=False)
+        values = [{k: v for k, v in row.items() if k != "partial"} for row in rows.values()]
+        statement = insert(Messages).values(values)
+        statement = statement.on_conflict_do_update(index_elements=[Messages.id],
+                                                    set_={c: statement.excluded[c]
+                                                          for c in ["message_id", "name", "resource", "type",
+                                                                    "messages", "online", "updated"]})
+        await session.execute(statement)
+        await session.commit()
+    return len(values)
+
+
+class YoquChatWriter():
+    """
+    Write-behind persistence of chats in Messages: put() only queues the chat (no latency for the request),
+    run() writes all queued chats every flush_interval secs (or batch_size chats) in one transaction.
+    Chats are dropped (and counted) when the queue is full.
+    """
+
+    def __init__(self, flush_interval: float = 1, batch_size: int = 100, queue_size: int = 10000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.task: asyncio.Task = None
+        self.stopped: asyncio.Event = None
+
+    def put(self, chat: RPAChat):
+        try:
+            self.queue.put_nowait(chat)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Write-behind queue full, dropping {chat}")
+
+    async def _flush(self, chats: list[RPAChat]):
+        try:
+            self.written += await upsert_chats(AsyncSession(engine), chats)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Cannot write {len(chats)} chats. ({e})")
+
+    async def run(self):
+        while not (self.stopped.is_set() and self.queue.empty()):
+            if self.queue.empty():
+                # Woken up by put() or stop()
+                getter = asyncio.ensure_future(self.queue.get())
+                stopper = asyncio.ensure_future(self.stopped.wait())
+                await asyncio.wait([getter, stopper], return_when=asyncio.FIRST_COMPLETED)
+                stopper.cancel()
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                chats = [getter.result()]
+            else:
+                chats = [self.queue.get_nowait()]
+            if not self.stopped.is_set():
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            while not self.queue.empty() and len(chats) < self.batch_size:
+                chats.append(self.queue.get_nowait())
+            await self._flush(chats)
+
+    def start(self):
+        self.stopped = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Write queued chats (including the ones taken by run()) and stop"""
+        if self.task:
+            self.stopped.set()
+            await self.task
+            return
+        chats = []
+        while not self.queue.empty():
+            chats.append(self.queue.get_nowait())
+        if chats:
+            await self._flush(chats)
+
+    def info(self) -> dict:
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped, "errors": self.errors}
+
+
+async def add_job(session:AsyncSession, job: Jobs) -> Jobs:
+    async with session:
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+
+async def get_job(session:AsyncSession, id_: str) -> Jobs:
+    async with session:
+        return (await session.execute(select(Jobs).filter(Jobs.id == id_))).scalars().first()
+
+
+async def get_jobs(session:AsyncSession, status: str = None, limit: int = 100) -> list[Jobs]:
+    async with session:
+        query = select(Jobs).order_by(Jobs.created.desc()).limit(limit)
+        if status:
+            query = query.filter(Jobs.status == status)
+        return list((await session.execute(query)).scalars().all())
+
+
+async def claim_job(session:AsyncSession, worker: str, resources: list[str]) -> Jobs:
+    """Oldest PENDING job for resources (or any resource) moved to RUNNING for worker, None if there is no job"""
+    async with session:
+        while True:
+            job = (await session.execute(select(Jobs)
+                                         .filter(and_(Jobs.status == "PENDING",
+                                                      or_(Jobs.resource.is_(None), Jobs.resource.in_(resources))))
+                                         .order_by(Jobs.created)
+                                         .limit(1))).scalars().first()
+            if job is None:
+                return None
+            now = datetime.utcnow()
+            # Only one worker wins the update (status is still PENDING)
+            rc = await session.execute(update(Jobs)
+                                       .where(and_(Jobs.id == job.id, Jobs.status == "PENDING"))
+                                       .values(status="RUNNING", worker=worker, attempts=Jobs.attempts + 1,
+                                               updated=now, heartbeat=now))
+            await session.commit()
+            if rc.rowcount == 1:
+                await session.refresh(job)
+                return job
+
+
+async def heartbeat_job(session:AsyncSession, id_: str):
+    async with session:
+        await session.execute(update(Jobs).where(Jobs.id == id_).values(heartbeat=datetime.utcnow()))
+        await session.commit()
+
+
+async def finish_job(session:AsyncSession, id_: str, result: str = None, error: str = None):
+    async with session:
+        await session.execute(update(Jobs)
+                              .where(Jobs.id == id_)
+                              .values(status="ERROR" if error else "DONE",
+                                      result=result,
+                                      error=error,
+                                      updated=datetime.utcnow()))
+        await session.commit()
+
+
+async def requeue_stale_jobs(session:AsyncSession, stale_secs: float, max_attempts: int = 3) -> int:
+    """RUNNING jobs without heartbeat in stale_secs (crashed worker) back to PENDING, or ERROR after max_attempts"""
+    async with session:
+        limit = datetime.utcnow() - timedelta(seconds=stale_secs)
+        stale = and_(Jobs.status == "RUNNING", Jobs.heartbeat < limit)
+        await session.execute(update(Jobs)
+                              .where(and_(stale, Jobs.attempts >= max_attempts))
+                              .values(status="ERROR", error="Too many attempts", updated=datetime.utcnow()))
+        rc = await session.execute(update(Jobs)
+                                   .where(stale)
+                                   .values(status="PENDING", worker=None, updated=datetime.utcnow()))
+        await session.commit()
+        return rc.rowcount
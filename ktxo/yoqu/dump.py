@@ -0,0 +1,133 @@
+#
+# Background dump writer (dump_request): requests are queued and appended to rolling files by one thread per folder
+#
+from datetime import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+
+from ktxo.yoqu.archive import YoquArchive
+from ktxo.yoqu.common.helper import build_folders
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquDumpWriter():
+    """
+    put() never blocks the caller (browser thread): above high_watermark of the queue only a sample of the dumps is
+    queued, dumps are dropped (and counted) when the queue is full. Formats:
+        jsonl: <folder>/dump-<YYYYMMDD>-<pid>-<n>.jsonl, {"dump": name, "dt": ..., "data": {...}} per line
+        archive: compressed chats, see YoquArchive (<folder>/<resource>/<YYYY-MM-DD>/...)
+    Configuration (resource file):
+        "dump_writer": {"format": "jsonl", "queue_size": 1000, "high_watermark": 0.8, "sample": 0.1,
+                        "batch_size": 100, "flush_interval": 1, "segment_size": 67108864}
+    """
+    JSONL = "jsonl"
+    ARCHIVE = "archive"
+
+    writers: dict[str, "YoquDumpWriter"] = {}
+    writers_lock = threading.Lock()
+
+    def __init__(self, folder: str, format: str = JSONL, queue_size: int = 1000, high_watermark: float = 0.8,
+                 sample: float = 0.1, batch_size: int = 100, flush_interval: float = 1,
+                 segment_size: int = 64 * 1024 * 1024):
+        self.folder = build_folders(folder)
+        self.format = format
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.high_watermark = int(queue_size * high_watermark)
+        self.sample = sample
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        self.archive = YoquArchive(folder, segment_size=segment_size) if format == self.ARCHIVE else None
+        self.filename: str = None
+        self.day: str = None
+        self.segment = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"dump-{os.path.basename(self.folder)}", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls, folder: str, config: dict = None) -> "YoquDumpWriter":
+        """One writer (thread) per folder, shared by all members of a pool"""
+        folder = os.path.abspath(folder)
+        with cls.writers_lock:
+            if folder not in cls.writers:
+                cls.writers[folder] = YoquDumpWriter(folder, **(config or {}))
+            return cls.writers[folder]
+
+    @classmethod
+    def stop_all(cls):
+        with cls.writers_lock:
+            for writer in cls.writers.values():
+                writer.stop()
+            cls.writers.clear()
+
+    def put(self, name: str, data: dict) -> bool:
+        if self.queue.qsize() >= self.high_watermark and random.random() >= self.sample:
+            self.sampled_out += 1
+            return False
+        try:
+            self.queue.put_nowait((name, datetime.utcnow(), data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Dump queue full ({self.folder}), dropping '{name}'")
+            return False
+
+    def _jsonl_file(self, dt: datetime) -> str:
+        day = dt.strftime("%Y%m%d")
+        if day != self.day or (os.path.exists(self.filename) and os.path.getsize(self.filename) >= self.segment_size):
+            self.segment = self.segment + 1 if day == self.day else 0
+            self.day = day
+            self.filename = os.path.join(self.folder, f"dump-{day}-{os.getpid()}-{self.segment}.jsonl")
+        return self.filename
+
+    def _write(self, items: list[tuple[str, datetime, dict]]):
+        if self.archive:
+            # Partitioned by the chat dt, dump time if missing
+            self.archive.write([{**data, "dt": data.get("dt", None) or dt} for _, dt, data in items])
+        else:
+            with open(self._jsonl_file(items[-1][1]), "a", encoding="utf-8") as fd:
+                for name, dt, data in items:
+                    fd.write(json.dumps({"dump": name, "dt": str(dt), "data": data}, ensure_ascii=False, default=str))
+                    fd.write("\n")
+        self.written += len(items)
+
+    def run(self):
+        while not (self.stopped.is_set() and self.queue.empty()):
+            try:
+                items = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Cannot dump {len(items)} requests to {self.folder}. ({e})")
+
+    def stop(self, timeout: float = 10):
+        """Write queued dumps and stop the thread"""
+        self.stopped.set()
+        self.thread.join(timeout)
+
+    def info(self) -> dict:
+        return {"folder": self.folder,
+                "format": self.format,
+                "queued": self.queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "errors": self.errors}
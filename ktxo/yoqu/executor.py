@@ -0,0 +1,103 @@
+#
+# Run blocking RPA (Selenium) calls outside the asyncio event loop, one worker thread per browser
+#
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Callable
+
+from ktxo.yoqu.common.exceptions import YoquException
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquExecutor():
+    """
+    Single worker thread with a bounded queue. A browser (webdriver) is not thread safe, so all calls for the same
+    browser are serialized in its own worker, while the event loop keeps serving other requests.
+    """
+
+    def __init__(self, name: str, queue_size: int = 100):
+        self.name = name
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"yoqu-{name}")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.wait_last = 0.0
+        self.wait_max = 0.0
+        self.wait_total = 0.0
+        self.run_last = 0.0
+        self.run_total = 0.0
+
+    def _call(self, t0: float, fn: Callable, *args, **kwargs) -> Any:
+        t1 = time.time()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+        finally:
+            t2 = time.time()
+            with self.lock:
+                self.completed += 1
+                self.wait_last = t1 - t0
+                self.wait_max = max(self.wait_max, self.wait_last)
+                self.wait_total += self.wait_last
+                self.run_last = t2 - t1
+                self.run_total += self.run_last
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        with self.lock:
+            if self.pending >= self.queue_size:
+                self.rejected += 1
+                raise YoquException(f"Resource '{self.name}' busy, queue full ({self.pending} pending)")
+            self.pending += 1
+            self.submitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(self._call, time.time(), fn, *args, **kwargs))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    async def stream(self, fn: Callable, *args, **kwargs) -> AsyncIterator[Any]:
+        """Iterate the (blocking) generator fn in the worker thread, yielding its items in the event loop"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        end = object()
+
+        def _produce():
+            for item in fn(*args, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        # Items are queued before the task is done, end (or the error) is always the last one
+        task = asyncio.ensure_future(self.run(_produce))
+        task.add_done_callback(lambda _: queue.put_nowait(end))
+        while (item := await queue.get()) is not end:
+            yield item
+        await task
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def info(self) -> dict:
+        with self.lock:
+            return {"queue_size": self.queue_size,
+                    "queue_depth": self.pending,
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "rejected": self.rejected,
+                    "errors": self.errors,
+                    "wait_last": round(self.wait_last, 3),
+                    "wait_max": round(self.wait_max, 3),
+                    "wait_avg": round(self.wait_total / self.completed, 3) if self.completed else 0,
+                    "run_last": round(self.run_last, 3),
+                    "run_avg": round(self.run_total / self.completed, 3) if self.completed else 0}
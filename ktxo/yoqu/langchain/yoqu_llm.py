@@ -2,11 +2,12 @@ import json
 import logging
 import os.path
 
-from typing import Any, List, Mapping, Optional
+from typing import Any, Iterator, List, Mapping, Optional
 
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 from langchain.llms.base import LLM
 from langchain.prompts import PromptTemplate, ChatPromptTemplate, load_prompt
+from langchain.schema.output import GenerationChunk
 from ktxo.yoqu.client.api_client import APIWrapper
 from ktxo.yoqu.common.exceptions import YoquException
 
@@ -63,7 +64,8 @@ class YoquChatGPTLLM(LLM):
             chat_id = self.chat["chat_id"]
 
         if chat_id:
-            self.chat = self.client.update_chat(chat_id, prompt, resource)
+            # Only new messages, last one is the response
+            self.chat = self.client.update_chat(chat_id, prompt, resource, incremental=True)
         else:
             self.chat = self.client.new_chat(prompt, resource, True)
         logger.debug(f"{self.chat}")
@@ -86,6 +88,38 @@ class YoquChatGPTLLM(LLM):
             logger.error(f"Current chat {self.chat}")
             raise YoquException(f"Error getting response from API")
 
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        if stop is not None:
+            raise ValueError("stop kwargs are not permitted.")
+        resource = kwargs.get("resource", self.resource)
+        chat_id = None
+        if self.chat:
+            chat_id = self.chat["chat_id"]
+        # Same as _call: new chats are deleted after getting the response
+        emitted = 0
+        for event in self.client.stream_chat(prompt, chat_id, resource, delete_after=chat_id is None, incremental=True):
+            if "delta" in event or "replace" in event:
+                # Tokens cannot be taken back, after a replace only text beyond the emitted length is sent
+                text = event["delta"] if "delta" in event else event["replace"][emitted:]
+                if not text:
+                    continue
+                emitted += len(text)
+                chunk = GenerationChunk(text=text)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+            elif "chat" in event:
+                self.chat = event["chat"]
+                logger.debug(f"Current chat {self.chat}")
+            else:
+                raise YoquException(f"Error getting response from API ({event.get('error', event)})")
+
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
         """Get the identifying parameters."""
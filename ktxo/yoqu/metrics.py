@@ -0,0 +1,133 @@
+#
+# Latency of each stage of a request by resource and operation, Prometheus text format for /metrics
+#
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+# Secs
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Operation (invoke) running in the current thread, one thread per browser (see YoquExecutor)
+_context = threading.local()
+
+
+class YoquHistogram():
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value: float):
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def info(self) -> dict:
+        return {"count": self.count,
+                "avg": self.sum / self.count if self.count else 0,
+                "max": self.max,
+                "last": self.last}
+
+
+class YoquMetrics():
+    """
+    Stages: lock_wait (pool checkout), load_chats, select_chat, send_keys, wait_response, get_responses (extraction),
+    dump_request and request (whole invoke)
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS, alpha: float = 0.3):
+        self.buckets = buckets
+        self.alpha = alpha
+        self.histograms: dict[tuple[str, str, str], YoquHistogram] = {}
+        self.ewmas: dict[tuple[str, str], float] = {} # (resource, stage), all operations (see YoquRouter)
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, resource: str, operation: str, value: float):
+        key = (resource, operation or "none", stage)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = YoquHistogram(self.buckets)
+            self.histograms[key].observe(value)
+            previous = self.ewmas.get((resource, stage), None)
+            self.ewmas[(resource, stage)] = value if previous is None else (
+                    self.alpha * value + (1 - self.alpha) * previous)
+
+    def ewma(self, stage: str, resource: str) -> float | None:
+        """Exponentially weighted moving average of stage for resource, None without observations"""
+        return self.ewmas.get((resource, stage), None)
+
+    @contextmanager
+    def timer(self, stage: str, resource: str, operation: str = None):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, resource, operation or current_operation(), time.perf_counter() - t0)
+
+    def summary(self, resource: str = None) -> dict:
+        """{operation: {stage: {count, avg, max, last}}}"""
+        summary = {}
+        with self.lock:
+            for (resource_, operation, stage), histogram in sorted(self.histograms.items()):
+                if resource and resource_ != resource:
+                    continue
+                summary.setdefault(operation, {})[stage] = histogram.info()
+        return summary
+
+    def prometheus(self) -> str:
+        lines = ["# HELP yoqu_stage_seconds Time spent in each stage of a request",
+                 "# TYPE yoqu_stage_seconds histogram"]
+        with self.lock:
+            for (resource, operation, stage), histogram in sorted(self.histograms.items()):
+                labels = f'resource="{resource}",operation="{operation}",stage="{stage}"'
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'yoqu_stage_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+                lines.append(f'yoqu_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"yoqu_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"yoqu_stage_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.ewmas.clear()
+
+
+metrics = YoquMetrics()
+
+
+def current_operation() -> str:
+    return getattr(_context, "operation", None)
+
+
+@contextmanager
+def operation(name: str):
+    previous = current_operation()
+    _context.operation = name
+    try:
+        yield
+    finally:
+        _context.operation = previous
+
+
+def timed(stage: str):
+    """Decorator for resource methods (self.name is the resource)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with metrics.timer(stage, self.name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
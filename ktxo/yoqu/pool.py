@@ -0,0 +1,442 @@
+#
+# Pool of YoquRPAChat instances (one browser per member) behind a logical resource name
+#
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import copy
+from datetime import datetime
+import logging
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Callable
+
+from ktxo.yoqu.base import YoquRPAChat
+from ktxo.yoqu.common.exceptions import YoquException, YoquBrowserException
+from ktxo.yoqu.executor import YoquExecutor
+from ktxo.yoqu.metrics import metrics
+
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+def build_member_config(config: dict, index: int) -> dict:
+    """
+    Build the configuration for pool member `index` from the resource configuration.
+    Member 0 uses the configuration as is, other members get their own debugging port and user-data-dir
+    (port + index, folder + "_index") unless "pool.members[index]" overrides "resource" options.
+    """
+    config = copy.deepcopy(config)
+    config["member"] = index
+    if index == 0:
+        return config
+    resource = config.get("resource", {})
+    members = config.get("pool", {}).get("members", [])
+    if index < len(members):
+        resource.update(copy.deepcopy(members[index]))
+        config["resource"] = resource
+        return config
+
+    def _port(match) -> str:
+        return f"{match.group(1)}{int(match.group(2)) + index}"
+
+    command = []
+    for c in resource.get("command", []):
+        if c.startswith("--remote-debugging-port="):
+            c = re.sub(r"^(--remote-debugging-port=)(\d+)$", _port, c)
+        elif c.startswith("--user-data-dir="):
+            c = f"{c}_{index}"
+        command.append(c)
+    resource["command"] = command
+    options_experimental = []
+    for o in resource.get("options_experimental", []):
+        if isinstance(o, list) and len(o) == 2 and o[0] == "debuggerAddress":
+            o = [o[0], re.sub(r"^(.*:)(\d+)$", _port, o[1])]
+        options_experimental.append(o)
+    resource["options_experimental"] = options_experimental
+    uc_options = resource.get("uc_options", {})
+    if uc_options.get("user_data_dir"):
+        uc_options["user_data_dir"] = f"{uc_options['user_data_dir']}_{index}"
+    config["resource"] = resource
+    return config
+
+
+def member_profiles(config: dict) -> list[str]:
+    """Chrome profile folders (user-data-dir) of a member configuration, see build_member_config()"""
+    resource = config.get("resource", {})
+    profiles = [c.split("=", 1)[1] for c in resource.get("command", []) if c.startswith("--user-data-dir=")]
+    if resource.get("uc_options", {}).get("user_data_dir"):
+        profiles.append(resource["uc_options"]["user_data_dir"])
+    return profiles
+
+
+class YoquPoolMember():
+    """
+    Circuit breaker: after "failures" consecutive browser errors (YoquBrowserException, WebDriver errors; not caller
+    errors) or a blocked/dead browser (see YoquSupervisor) the member is out of rotation (open) for "open_secs", then
+    one request is allowed (half_open) to close it again or reopen it. Requests wait up to "max_wait" secs for a
+    member to be half_open when all of them are open.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, index: int, rpa: YoquRPAChat, queue_size: int = 100, breaker: dict = None):
+        self.index = index
+        self.rpa = rpa
+        self.executor = YoquExecutor(f"{rpa.name}#{index}", queue_size)
+        self.busy = False
+        self.healthy = False
+        self.failures = 0
+        self.checkouts = 0
+        self.last_used: datetime = None
+        self.breaker = {"failures": 3, "open_secs": 60, "max_wait": 60}
+        self.breaker.update(breaker or {})
+        self.circuit = self.CLOSED
+        self.circuit_reason: str = None
+        self.consecutive_failures = 0
+        self.opened_at: float = None
+        self.open_secs: float = self.breaker["open_secs"]
+        self.restarts = 0
+        self.backoff: float = 0  # Secs before the next restart of a dead browser (see YoquSupervisor)
+        self.next_restart: float = 0
+        self.last_probe: datetime = None
+
+    def available(self) -> bool:
+        """In rotation (closed), or open for more than open_secs (moved to half_open for one trial)"""
+        if self.circuit == self.OPEN and time.time() - self.opened_at >= self.open_secs:
+            self.circuit = self.HALF_OPEN
+            logger.info(f"Member {self.rpa.name}#{self.index}: circuit half open")
+        return self.circuit != self.OPEN
+
+    def retry_in(self) -> float:
+        """Secs until the member is available again (half_open), 0 if it's available"""
+        if self.circuit != self.OPEN:
+            return 0
+        return max(0.0, self.opened_at + self.open_secs - time.time())
+
+    def open(self, reason: str, secs: float = None):
+        if self.circuit != self.OPEN:
+            logger.warning(f"Member {self.rpa.name}#{self.index}: circuit open ({reason})")
+        self.circuit = self.OPEN
+        self.circuit_reason = reason
+        self.opened_at = time.time()
+        self.open_secs = secs if secs is not None else self.breaker["open_secs"]
+
+    def close(self):
+        if self.circuit != self.CLOSED:
+            logger.info(f"Member {self.rpa.name}#{self.index}: circuit closed")
+        self.circuit = self.CLOSED
+        self.circuit_reason = None
+        self.consecutive_failures = 0
+
+    def success(self):
+        self.consecutive_failures = 0
+        if self.circuit == self.HALF_OPEN:
+            self.close()
+
+    def failure(self, reason: str):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.circuit == self.HALF_OPEN or self.consecutive_failures >= self.breaker["failures"]:
+            self.open(reason)
+
+    def info(self) -> dict:
+        return {"member": self.index,
+                "busy": self.busy,
+                "healthy": self.healthy,
+                "failures": self.failures,
+                "checkouts": self.checkouts,
+                "last_used": str(self.last_used),
+                "circuit": self.circuit,
+                "circuit_reason": self.circuit_reason,
+                "restarts": self.restarts,
+                "next_restart": round(max(0.0, self.next_restart - time.time()), 1),
+                "last_probe": str(self.last_probe),
+                "executor": self.executor.info()}
+
+
+class YoquResourcePool():
+    """
+    N YoquRPAChat instances (each one with its own browser) serving a logical resource.
+    Requests check out any idle and healthy member, the pool grows from "min_size" up to "max_size" when all members
+    are busy. Configuration (resource file):
+        "pool": {"min_size": 1, "max_size": 1, "queue_size": 100, "lazy": false,
+                 "members": [{...resource options for member i...}]}
+    Blocking calls for a member run in its own YoquExecutor (see run()).
+    """
+    CREATED = "created"
+    LAZY = "lazy"
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, name: str, config: dict, factory: Callable[[str, dict], YoquRPAChat]):
+        self.name = name
+        self.config = copy.deepcopy(config)
+        self.factory = factory
+        pool_config = self.config.get("pool", {})
+        self.min_size: int = max(1, pool_config.get("min_size", 1))
+        self.max_size: int = max(self.min_size, pool_config.get("max_size", self.min_size))
+        self.queue_size: int = pool_config.get("queue_size", 100)
+        self.breaker_wait: float = self.config.get("breaker", {}).get("max_wait", 60)
+        # lazy: browsers are started on first use instead of start()
+        self.lazy: bool = pool_config.get("lazy", False)
+        self.state = self.CREATED
+        self.started_in: float = None # Secs to start (warm up)
+        self.members: list[YoquPoolMember] = []
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_last = 0.0
+        self.wait_max = 0.0
+        self.wait_total = 0.0
+        self.condition = asyncio.Condition()
+        self._check_profiles()
+        # Member 0 always exists, it's the resource returned by RPAManager.rpas[name]
+        self._new_member()
+
+    @property
+    def primary(self) -> YoquRPAChat:
+        return self.members[0].rpa
+
+    def _check_profiles(self):
+        """
+        Members 1..max_size-1 need a signed-in Chrome profile too (default "<user-data-dir>_i", see
+        build_member_config()), a missing one would be a new, logged out, profile: fail at startup instead
+        """
+        members = self.config.get("pool", {}).get("members", [])
+        missing = []
+        for index in range(1, self.max_size):
+            if index < len(members):
+                continue
+            missing.extend(p for p in member_profiles(build_member_config(self.config, index)) if not os.path.isdir(p))
+        if missing:
+            raise YoquException(f"Pool '{self.name}': Chrome profiles not found {missing}, sign in each member with "
+                                f"'./yoqu_configure.sh <config_file.json> <member>' or set pool.members")
+
+    def _new_member(self) -> YoquPoolMember:
+        index = len(self.members)
+        rpa = self.factory(self.name, build_member_config(self.config, index))
+        member = YoquPoolMember(index, rpa, self.queue_size, self.config.get("breaker", {}))
+        self.members.append(member)
+        logger.info(f"Pool '{self.name}': added member #{index}")
+        return member
+
+    def _start_member(self, member: YoquPoolMember) -> bool:
+        try:
+            member.rpa.init_resource()
+            member.rpa.start()
+            member.healthy = member.rpa.is_ok()
+        except Exception as e:
+            logger.error(f"Pool '{self.name}': cannot start member #{member.index} ({e})")
+            member.healthy = False
+        if not member.healthy:
+            member.failure("cannot start")
+            if self.state == self.LAZY and self.size_healthy() == 0:
+                # First use of a lazy pool, don't route more requests to it (see YoquSupervisor)
+                self.state = self.FAILED
+        elif self.state in [self.LAZY, self.FAILED]:
+            self.state = self.READY
+        return member.healthy
+
+    def start(self, lazy: bool = None) -> bool:
+        """Warm up: start first "min_size" members at the same time (nothing if lazy)"""
+        if self.lazy if lazy is None else lazy:
+            self.state = self.LAZY
+            logger.info(f"Pool '{self.name}': lazy, members are started on first use")
+            return True
+        self.state = self.STARTING
+        t0 = time.time()
+        while len(self.members) < self.min_size:
+            self._new_member()
+        members = self.members[0:self.min_size]
+        if len(members) == 1:
+            self._start_member(members[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(members), thread_name_prefix=f"start-{self.name}") as executor:
+                list(executor.map(self._start_member, members))
+        self.started_in = round(time.time() - t0, 3)
+        self.state = self.READY if self.size_healthy() > 0 else self.FAILED
+        logger.info(f"Pool '{self.name}': {self.size_healthy()}/{len(self.members)} members ready "
+                    f"in {self.started_in} secs")
+        return self.is_ok()
+
+    def stop(self):
+        for member in self.members:
+            member.rpa.stop()
+            member.healthy = False
+
+    def is_ok(self) -> bool:
+        # Lazy pools can serve requests (first one starts a browser), members with circuit open cannot
+        # No state changes (see available()), it's used by status/routing
+        return self.state == self.LAZY or any(member.healthy and member.retry_in() == 0 for member in self.members)
+
+    def size_healthy(self) -> int:
+        return len([member for member in self.members if member.healthy])
+
+    def probe(self, member: YoquPoolMember) -> str:
+        """Run in the member thread: "ok", "dead" (browser not running) or "blocked" (challenge page)"""
+        if not member.rpa.is_ok(deep=True):
+            member.healthy = False
+            return "dead"
+        member.healthy = True
+        return "blocked" if member.rpa.is_blocked() else "ok"
+
+    def restart_member(self, member: YoquPoolMember) -> bool:
+        """Run in the member thread"""
+        logger.warning(f"Pool '{self.name}': restarting member #{member.index}")
+        try:
+            member.rpa.stop()
+        except Exception as e:
+            logger.warning(f"Pool '{self.name}': cannot stop member #{member.index} ({e})")
+        member.restarts += 1
+        if self._start_member(member):
+            member.close()
+            return True
+        return False
+
+    async def restart(self, timeout: float = 300) -> dict[int, bool]:
+        """Restart all members, waiting (up to timeout secs each) for requests in progress"""
+        rc = {}
+        for member in list(self.members):
+            t0 = time.time()
+            while not await self.try_reserve(member):
+                if time.time() - t0 > timeout:
+                    raise YoquException(f"Resource '{self.name}': member #{member.index} busy, cannot restart")
+                await asyncio.sleep(1)
+            try:
+                rc[member.index] = await member.executor.run(self.restart_member, member)
+            finally:
+                await self._release(member)
+        return rc
+
+    def _check_member(self, member: YoquPoolMember) -> bool:
+        if member.rpa.is_ok():
+            member.healthy = True
+            return True
+        logger.warning(f"Pool '{self.name}': member #{member.index} not running, starting it")
+        return self._start_member(member)
+
+    def _reserve(self) -> YoquPoolMember | None:
+        idle = [member for member in self.members if not member.busy and member.available()]
+        # Healthy first, then try to recover an existing one before adding a new browser
+        idle.sort(key=lambda m: not m.healthy)
+        if idle:
+            return idle[0]
+        if len(self.members) < self.max_size:
+            return self._new_member()
+        return None
+
+    async def _acquire(self) -> YoquPoolMember:
+        t0 = time.time()
+        attempts = 0
+        while True:
+            async with self.condition:
+                if self.waiting >= self.queue_size:
+                    raise YoquException(f"Resource '{self.name}' busy, queue full ({self.waiting} waiting)")
+                self.waiting += 1
+                try:
+                    while (member := self._reserve()) is None:
+                        if any(m.busy for m in self.members):
+                            await self.condition.wait()
+                            continue
+                        # All circuits open, nobody will release a member: wait for the first one to be half_open
+                        retry_in = min(m.retry_in() for m in self.members)
+                        if retry_in > self.breaker_wait:
+                            raise YoquBrowserException(f"Resource '{self.name}' unavailable (circuits open, "
+                                                f"retry in {round(retry_in)} secs)")
+                        try:
+                            await asyncio.wait_for(self.condition.wait(), retry_in)
+                        except asyncio.TimeoutError:
+                            pass
+                    member.busy = True
+                finally:
+                    self.waiting -= 1
+            try:
+                ok = await member.executor.run(self._check_member, member)
+            except Exception:
+                await self._release(member)
+                raise
+            if ok:
+                member.checkouts += 1
+                member.last_used = datetime.utcnow()
+                self.checkouts += 1
+                self.wait_last = time.time() - t0
+                self.wait_max = max(self.wait_max, self.wait_last)
+                self.wait_total += self.wait_last
+                metrics.observe("lock_wait", self.name, "checkout", self.wait_last)
+                return member
+            await self._release(member)
+            attempts += 1
+            if attempts >= self.max_size:
+                raise YoquBrowserException(f"Resource '{self.name}' has no healthy members")
+
+    async def _release(self, member: YoquPoolMember):
+        async with self.condition:
+            member.busy = False
+            self.condition.notify()
+
+    @asynccontextmanager
+    async def checkout(self) -> YoquRPAChat:
+        member = await self._acquire()
+        logger.info(f"Locking {self.name}#{member.index}")
+        try:
+            yield member.rpa
+        finally:
+            logger.info(f"Releasing {self.name}#{member.index}")
+            await self._release(member)
+
+    async def try_reserve(self, member: YoquPoolMember) -> bool:
+        """Reserve member if it's idle (see YoquSupervisor), release it with _release()"""
+        async with self.condition:
+            if member.busy:
+                return False
+            member.busy = True
+            return True
+
+    def _result(self, member: YoquPoolMember, error: Exception = None):
+        # Caller errors (missing parameters, chat not found, queue full...) say nothing about the browser
+        if error is None:
+            member.success()
+        elif isinstance(error, (YoquBrowserException, WebDriverException)):
+            member.failure(str(error))
+
+    async def run(self, rpa: YoquRPAChat, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn (blocking) in the worker thread of the member owning rpa"""
+        member = self.members[rpa.member]
+        try:
+            result = await member.executor.run(fn, *args, **kwargs)
+        except Exception as e:
+            self._result(member, e)
+            raise
+        self._result(member)
+        return result
+
+    async def stream(self, rpa: YoquRPAChat, fn: Callable, *args, **kwargs) -> AsyncIterator[Any]:
+        """Iterate generator fn (blocking) in the worker thread of the member owning rpa"""
+        member = self.members[rpa.member]
+        try:
+            async for item in member.executor.stream(fn, *args, **kwargs):
+                yield item
+        except Exception as e:
+            self._result(member, e)
+            raise
+        self._result(member)
+
+    def info(self) -> dict:
+        return {"name": self.name,
+                "state": self.state,
+                "started_in": self.started_in,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": len(self.members),
+                "healthy": self.size_healthy(),
+                "busy": len([member for member in self.members if member.busy]),
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "wait_last": round(self.wait_last, 3),
+                "wait_max": round(self.wait_max, 3),
+                "wait_avg": round(self.wait_total / self.checkouts, 3) if self.checkouts else 0,
+                "members": [member.info() for member in self.members]}
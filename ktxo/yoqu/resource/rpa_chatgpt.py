@@ -1,24 +1,109 @@
 import logging
-from typing import Any
+from typing import Any, Iterator
 import time
 
 from retry import retry
 
-from ktxo.yoqu.common.exceptions import YoquException
+from ktxo.yoqu.common.exceptions import YoquException, YoquBrowserException
 from ktxo.yoqu.common.model import RPAChat, RPAMessage, RPAMessageCode
 from ktxo.yoqu.base import YoquRPAChat
+from ktxo.yoqu.metrics import metrics, timed
 
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 
 logger = logging.getLogger("ktxo.yoqu.gpt")
 
+# Resolves when the send button (svg path arguments[0]) is back, i.e. response completed. The button must disappear
+# first (arguments[1]: already seen gone), unless it's still there after arguments[2] ms (nothing generated).
+# Resolves {done: false} after arguments[3] ms, the caller loops until its own timeout.
+JS_WAIT_SEND_BUTTON = """
+var svgD = arguments[0], seenGone = arguments[1], graceMs = arguments[2], chunkMs = arguments[3];
+var done = arguments[arguments.length - 1];
+var t0 = Date.now(), finished = false, observer = null, timers = [];
+function present() {
+    return document.querySelector('path[d="' + svgD + '"]') !== null;
+}
+function finish(result) {
+    if (finished) return;
+    finished = true;
+    if (observer) observer.disconnect();
+    timers.forEach(clearTimeout);
+    done({done: result, seenGone: seenGone});
+}
+function check() {
+    if (!present()) {
+        seenGone = true;
+    } else if (seenGone || Date.now() - t0 >= graceMs) {
+        finish(true);
+    }
+}
+observer = new MutationObserver(check);
+observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['d']});
+timers.push(setTimeout(check, graceMs));
+timers.push(setTimeout(function() { finish(false); }, chunkMs));
+check();
+"""
+
+# All messages in one roundtrip: [{id, type, text, code: [{type, lines}]}]
+# Only messages after data-message-id arguments[0] if it's found in the page, all otherwise
+JS_GET_MESSAGES = """
+var since = arguments[0], messages = [], items = [], start = 0;
+var nodes = document.evaluate("//div[contains(@class, 'w-full text-token-text-primary')]", document, null,
+                              XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+for (var i = 0; i < nodes.snapshotLength; i++) {
+    var m = nodes.snapshotItem(i);
+    var idNode = m.querySelector("div[data-message-id]");
+    if (!idNode) continue;
+    var id = idNode.getAttribute("data-message-id");
+    items.push([id, m]);
+    if (since && id === since) start = items.length;
+}
+for (var i = start; i < items.length; i++) {
+    var id = items[i][0], m = items[i][1];
+    var code = [];
+    m.querySelectorAll("pre").forEach(function(block) {
+        var span = block.querySelector("span"), lines = block.querySelector("code");
+        code.push({type: span ? span.innerText : "", lines: lines ? lines.innerText.split("\\n") : []});
+    });
+    messages.push({id: id,
+                   type: m.querySelector("div[class*='gizmo-bot-avatar']") ? "RESPONSE" : "REQUEST",
+                   text: m.innerText,
+                   code: code});
+}
+return messages;
+"""
+
+# Last response (assistant message) being generated: {count, text, button}, text is "" until there are more than
+# arguments[1] responses (the new one is in the page)
+JS_LAST_RESPONSE = """
+var svgD = arguments[0], count = arguments[1];
+var responses = document.querySelectorAll("div[class*='gizmo-bot-avatar']");
+var text = "";
+if (responses.length > count) {
+    var m = responses[responses.length - 1].closest("div[class*='w-full text-token-text-primary']");
+    text = m ? m.innerText : "";
+}
+return {count: responses.length,
+        text: text,
+        button: document.querySelector('path[d="' + svgD + '"]') !== null};
+"""
+
 
 class RPAChatGPTResource(YoquRPAChat):
     URL = "https://chat.openai.com"
     TITLE = "ChatGPT"
 
+    SEND_BUTTON_SVG = "M15.192 8.906a1.143 1.143 0 0 1 1.616 0l5.143 5.143a1.143 1.143 0 0 1-1.616 1.616l-3.192-3.192v9.813a1.143 1.143 0 0 1-2.286 0v-9.813l-3.192 3.192a1.143 1.143 0 1 1-1.616-1.616z"
+
     def __init__(self, name: str, config: dict):
         super(RPAChatGPTResource, self).__init__(name, config)
+        # mode: observer (MutationObserver in the page) | polling
+        self.wait_response: dict = {"mode": "observer", "timeout": 600, "grace": 3, "chunk": 30}
+        self.wait_response.update(self.resource_config.get("wait_response", {}))
+        # script (one roundtrip) | elements (find_elements per message)
+        self.extraction: str = self.resource_config.get("extraction", "script")
+        self.stream_interval: float = self.resource_config.get("stream_interval", 0.3)
         logger.debug(f"{self.config}")
 
     def init_resource(self, **kwargs) -> Any:
@@ -27,7 +112,7 @@ class RPAChatGPTResource(YoquRPAChat):
     def is_blocked(self):
         return len(self.browser.find_elements(By.CSS_SELECTOR, "div[id='challenge-stage']")) > 0
 
-    def _create_chat(self, message: str, chat_name: str = None) -> RPAChat:
+    def _new_chat(self) -> bool:
         #elem = self.browser.find_elements(By.XPATH, "//div[text()='New chat']")
         # ChatGPT must be opened with sidebar expanded
         p = "button[class='h-10 rounded-lg px-2 text-token-text-secondary focus-visible:outline-0 hover:bg-token-sidebar-surface-secondary focus-visible:bg-token-sidebar-surface-secondary']"
@@ -37,9 +122,15 @@ class RPAChatGPTResource(YoquRPAChat):
         if len(elem) > 0:
             #elem[0].click() # New Chat
             elem[1].click()  # New Chat
+            return True
+        return False
+
+    def _create_chat(self, message: str, chat_name: str = None) -> RPAChat:
+        if self._new_chat():
             messages = self._send(message)
-            self._load_chats() # Refresh current list
-            chat = RPAChat(name=self.chats[0].name, messages=messages, chat_id=self.chats[0].chat_id)
+            self._get_chats(fresh=True) # Refresh current list
+            chat = RPAChat(name=self.chats[0].name, messages=messages, chat_id=self.chats[0].chat_id,
+                           type=self.type, resource=self.name)
             if chat_name:
                 self.chats[0].name = self._rename_chat(chat.chat_id, chat.name, chat_name)
             return chat
@@ -86,21 +177,35 @@ class RPAChatGPTResource(YoquRPAChat):
         logger.debug(f"Found {len(chats)} chats")
         return self.chats
 
+    @timed("load_chats")
     def _load_chats(self) -> list[RPAChat]:
         return self._load_chatsBS()
         self.chats: list[RPAChat] = []
 
     def _chat_exist(self, chat_id: str) -> bool:
-        for chat in self.chats:
-            if chat_id == chat.chat_id:
-                return True
-        return False
+        return chat_id in self.chat_index
 
-    def _get_responses(self) -> list[RPAMessage]:
+    def _get_responses(self, since_message_id:str = None) -> list[RPAMessage]:
         self._wait_response()
+        self.browser.jitter()
+        with metrics.timer("get_responses", self.name):
+            if self.extraction == "elements":
+                return self._extract_messages_elements(since_message_id)
+            return self._extract_messages(since_message_id)
+
+    def _extract_messages(self, since_message_id:str = None) -> list[RPAMessage]:
+        results = []
+        for m in self.browser.driver.execute_script(JS_GET_MESSAGES, since_message_id):
+            results.append(RPAMessage(id=m["id"],
+                                      text="\n".join(m["text"].split("\n")),
+                                      type=m["type"],
+                                      raw_text="",
+                                      code_text=[RPAMessageCode(type_=c["type"], lines=c["lines"]) for c in m["code"]]))
+        return results
+
+    def _extract_messages_elements(self, since_message_id:str = None) -> list[RPAMessage]:
         obj = self.browser.find_element(By.CSS_SELECTOR, "div[role='presentation']")
         results = []
-        self.browser.sleep()
         messages = obj.find_elements(By.XPATH, "//div[contains(@class, 'w-full text-token-text-primary')]")
         for m in messages:
             message_id = m.find_element(By.XPATH, ".//div[@data-message-id]").get_attribute("data-message-id")
@@ -117,86 +222,147 @@ class RPAChatGPTResource(YoquRPAChat):
                                       type=type_,
                                       raw_text=raw_text,
                                       code_text= code_text))
+        ids = [m.id for m in results]
+        if since_message_id in ids:
+            results = results[ids.index(since_message_id) + 1:]
         return results
 
+    @timed("wait_response")
     def _wait_response(self):
-        stop = False
-        counter = 0
-        self.browser.sleep()
+        if self.wait_response["mode"] == "observer":
+            try:
+                return self._wait_response_observer()
+            except YoquException:
+                raise
+            except Exception as e:
+                logger.warning(f"Cannot wait response with observer, using polling ({e})")
+        return self._wait_response_polling()
+
+    def _wait_response_observer(self):
+        timeout = self.wait_response["timeout"]
+        chunk = min(self.wait_response["chunk"], timeout)
+        self.browser.driver.set_script_timeout(chunk + 5)
+        seen_gone = False
         t0 = time.time()
-        while not stop:
-            # if self._continue_generating_regenerate():
-            #     continue
-            send_button = self._get_send_button()
-
-            if send_button:
-                print(send_button.text)
-                stop = True
-            else:
-                self.browser.sleep()
-                if (time.time() - t0) > 600:
-                    raise YoquException(f"Timeout waiting response")
+        while (time.time() - t0) < timeout:
+            rc = self.browser.driver.execute_async_script(JS_WAIT_SEND_BUTTON,
+                                                          self.SEND_BUTTON_SVG,
+                                                          seen_gone,
+                                                          int(self.wait_response["grace"] * 1000),
+                                                          int(chunk * 1000))
+            if rc["done"]:
+                logger.debug(f"Response completed in {time.time() - t0:.2f} secs")
+                return
+            seen_gone = rc["seenGone"]
+        raise YoquBrowserException(f"Timeout waiting response")
+
+    def _wait_response_polling(self):
+        # Send button disappears while the response is generated (maybe too fast to see it), then it's back
+        try:
+            self.browser.wait(lambda driver: self._get_send_button() is None, timeout=self.wait_response["grace"])
+        except TimeoutException:
+            pass
+        try:
+            self.browser.wait(lambda driver: self._get_send_button() is not None,
+                              timeout=self.wait_response["timeout"])
+        except TimeoutException:
+            raise YoquBrowserException(f"Timeout waiting response")
 
     def chat_id_url(self, chat_id:str):
-        return f"https://chat.openai.com/c/{chat_id}"
+        # Same host as resource.url (e.g. benchmark/fake_chatgpt.py)
+        return f"{self.browser.url.rstrip('/')}/c/{chat_id}"
 
+    @timed("select_chat")
     def _select_chat(self, chat_id: str):
-        chats = self.browser.find_elements(By.TAG_NAME, "li")
-        found = False
-        for chat in chats:
-            # if chat.get_attribute("data-projection-id"):
-            chat_id_element = chat.find_element(By.TAG_NAME, "a").get_attribute("href")
-            #
-            if chat_id in chat_id_element:
-                # @TODO: is not working
-                # Scrol to element
-                #self.browser.driver.execute_script("arguments[0].scrollIntoView();", chat)
-                self.browser.driver.get(self.chat_id_url(chat_id))
-                #chat.click()
-                found = True
-                break
+        # Go directly to the chat url instead of looking for it in the sidebar (not all chats are loaded there)
+        if self.extract_id(self.browser.current_url()) != chat_id:
+            self.browser.go2url(self.chat_id_url(chat_id))
         # @ TODO wait for responses
         #self.browser.sleep()
-        return found
+        return self.extract_id(self.browser.current_url()) == chat_id
 
     def _get_send_button(self):
         """ChatGPT changed "send button"""
-        # SVG data
-        svg_d = "M15.192 8.906a1.143 1.143 0 0 1 1.616 0l5.143 5.143a1.143 1.143 0 0 1-1.616 1.616l-3.192-3.192v9.813a1.143 1.143 0 0 1-2.286 0v-9.813l-3.192 3.192a1.143 1.143 0 1 1-1.616-1.616z"
-        e = self.browser.find_elements(By.XPATH, f"//*[name()='path' and @d='{svg_d}']")
+        e = self.browser.find_elements(By.XPATH, f"//*[name()='path' and @d='{self.SEND_BUTTON_SVG}']")
         if len(e) > 0:
             return e[0]
         else:
             return None
 
 
-    def _send(self, message: str) -> list[RPAMessage]:
+    def _submit(self, message: str):
         # Chat must be selected before execute this function
-        self.browser.sleep()
-        if not self.browser.send_keys(By.CSS_SELECTOR, "textarea[id='prompt-textarea']", message):
-            raise YoquException(f"Cannot send message")
+        if self.browser.wait_for(By.CSS_SELECTOR, "textarea[id='prompt-textarea']") is None:
+            raise YoquBrowserException(f"Cannot send message (prompt not found)")
+        self.browser.jitter()
+        with metrics.timer("send_keys", self.name):
+            sent = self.browser.send_keys(By.CSS_SELECTOR, "textarea[id='prompt-textarea']", message)
+        if not sent:
+            raise YoquBrowserException(f"Cannot send message")
 
-        b = self._get_send_button()
-        if b is None:
-            raise YoquException("Cannot send message (send button not found)")
+        try:
+            b = self.browser.wait(lambda driver: self._get_send_button(), "element")
+        except TimeoutException:
+            raise YoquBrowserException("Cannot send message (send button not found)")
         b.click()
-        responses = self._get_responses()
+
+    def _send_stream(self, message: str) -> Iterator[str | dict]:
+        """
+        Send message and yield the response text (deltas) while it's generated, until the send button is back.
+        {"replace": text} when the page renders again text already sent (e.g. markdown to html, code blocks)
+        """
+        count = self.browser.driver.execute_script(JS_LAST_RESPONSE, self.SEND_BUTTON_SVG, 0)["count"]
+        self._submit(message)
+        previous, seen_gone = "", False
+        t0 = time.time()
+        while True:
+            rc = self.browser.driver.execute_script(JS_LAST_RESPONSE, self.SEND_BUTTON_SVG, count)
+            text = rc["text"]
+            # Page can render again the whole message (e.g. markdown to html), only forward new text
+            if text.startswith(previous):
+                if len(text) > len(previous):
+                    yield text[len(previous):]
+                    previous = text
+            elif text:
+                yield {"replace": text}
+                previous = text
+            if not rc["button"]:
+                seen_gone = True
+            elif seen_gone or (time.time() - t0) > self.wait_response["grace"]:
+                return
+            if (time.time() - t0) > self.wait_response["timeout"]:
+                raise YoquBrowserException(f"Timeout waiting response")
+            time.sleep(self.stream_interval)
+
+    def _send(self, message: str, since_message_id:str = None) -> list[RPAMessage]:
+        self._submit(message)
+        responses = self._get_responses(since_message_id)
         logger.debug(f"{len(responses)} messages. Last: '{responses[-1].text[0:30]}...'")
         return responses
 
+    def _menu_items(self, driver):
+        items = driver.find_elements(By.CSS_SELECTOR, "div[role='menuitem']")
+        return items if len(items) > 2 else False
+
     def _delete_chat(self, chat_id: str):
         #chat = self._select_chat(chat_id)
         if chat_id:
             logger.debug(f"Deleting {chat_id}")
             # Restriction: only first item
-            self.browser.sleep([0.5, 2])
-            elem = self.browser.find_elements(By.CSS_SELECTOR, "button[data-state='closed']")
-            if len(elem) > 0:
-                self.browser.sleep([1.2, 2])
-                elem[0].click()
+            self.browser.jitter([0.5, 2])
+            elem = self.browser.wait_for(By.CSS_SELECTOR, "button[data-state='closed']", "menu", clickable=True)
+            if elem is not None:
+                self.browser.jitter([1.2, 2])
+                elem.click()
                 # Share, Rename, Delete
-                self.browser.find_elements(By.CSS_SELECTOR, "div[role='menuitem']")[2].click()
-                elem = self.browser.find_elements(By.CSS_SELECTOR, "button[class='btn relative btn-danger']")
-                if len(elem) > 0:
-                    self.browser.sleep([1, 2])
-                    elem[0].click()
+                try:
+                    items = self.browser.wait(self._menu_items, "menu")
+                except TimeoutException:
+                    logger.warning(f"Cannot delete {chat_id} (menu not found)")
+                    return
+                items[2].click()
+                elem = self.browser.wait_for(By.CSS_SELECTOR, "button[class='btn relative btn-danger']", "menu",
+                                             clickable=True)
+                if elem is not None:
+                    self.browser.jitter([1, 2])
+                    elem.click()
@@ -0,0 +1,78 @@
+#
+# Resource selection for requests without resource_name (new chats), see RPAManager.route()
+#
+import itertools
+import logging
+import random
+
+from ktxo.yoqu.common.exceptions import YoquException
+from ktxo.yoqu.metrics import metrics
+from ktxo.yoqu.pool import YoquResourcePool
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquRouter():
+    """
+    Policies, only resources that can serve requests are candidates (pool.is_ok(): not failed, some browser with its
+    circuit closed, see YoquSupervisor):
+        default: always the default resource (previous behavior)
+        least_outstanding: lowest (busy members + waiting requests) / max_size
+        latency: lowest EWMA of wait_response * (outstanding + 1), resources without samples first
+        round_robin: next resource
+        weighted: random, proportional to "weights" by resource name or desc (account), 1 if missing
+    Configuration (rpa_manager.json):
+        "routing": {"policy": "least_outstanding", "weights": {"chatgpt1": 2, "Some description": 1}}
+    """
+    DEFAULT = "default"
+    LEAST_OUTSTANDING = "least_outstanding"
+    LATENCY = "latency"
+    ROUND_ROBIN = "round_robin"
+    WEIGHTED = "weighted"
+    POLICIES = [DEFAULT, LEAST_OUTSTANDING, LATENCY, ROUND_ROBIN, WEIGHTED]
+
+    def __init__(self, policy: str = LEAST_OUTSTANDING, weights: dict[str, float] = None):
+        if policy not in self.POLICIES:
+            raise YoquException(f"Routing policy '{policy}' unknown ({', '.join(self.POLICIES)})")
+        self.policy = policy
+        self.weights = weights or {}
+        self.counter = itertools.count()
+        self.routed: dict[str, int] = {}
+
+    @staticmethod
+    def outstanding(pool: YoquResourcePool) -> int:
+        return len([member for member in pool.members if member.busy]) + pool.waiting
+
+    def weight(self, pool: YoquResourcePool) -> float:
+        return self.weights.get(pool.name, self.weights.get(pool.primary.desc, 1))
+
+    def _load(self, pool: YoquResourcePool) -> float:
+        return self.outstanding(pool) / pool.max_size
+
+    def _latency(self, pool: YoquResourcePool) -> float:
+        ewma = metrics.ewma("wait_response", pool.name)
+        return 0 if ewma is None else ewma * (self.outstanding(pool) + 1)
+
+    def choose(self, pools: dict[str, YoquResourcePool], default: str = None) -> str:
+        candidates = [pool for pool in pools.values() if pool.is_ok()]
+        if self.policy == self.DEFAULT or not candidates:
+            return default
+        if len(candidates) == 1:
+            name = candidates[0].name
+        elif self.policy == self.LEAST_OUTSTANDING:
+            # Ties: default resource, then configuration order
+            name = min(candidates, key=lambda pool: (self._load(pool), pool.name != default)).name
+        elif self.policy == self.LATENCY:
+            name = min(candidates, key=lambda pool: (self._latency(pool), self._load(pool))).name
+        elif self.policy == self.ROUND_ROBIN:
+            name = candidates[next(self.counter) % len(candidates)].name
+        else:
+            weights = [self.weight(pool) for pool in candidates]
+            if sum(weights) <= 0:
+                return default
+            name = random.choices(candidates, weights=weights)[0].name
+        self.routed[name] = self.routed.get(name, 0) + 1
+        return name
+
+    def info(self) -> dict:
+        return {"policy": self.policy, "weights": self.weights, "routed": self.routed}
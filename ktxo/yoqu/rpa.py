@@ -19,16 +19,38 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 # message.Keys.chord(Keys.SHIFT, Keys.ENTER)
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 import undetected_chromedriver as uc
 
-from ktxo.yoqu.common.exceptions import YoquException
+from ktxo.yoqu.common.exceptions import YoquException, YoquBrowserException
 from ktxo.yoqu.common.helper import ProcessHelper, build_filename, normalize_url
 
 
 logger = logging.getLogger("ktxo.yoqu")
 
+# Focus and clear the input (textarea or contenteditable)
+JS_CLEAR_INPUT = """
+var el = arguments[0];
+el.focus();
+if ('value' in el) { el.value = ''; } else { el.innerHTML = ''; }
+"""
+
+# Set the whole text with the native setter (React tracks it) and dispatch the input event, returns the page value
+JS_INSERT_TEXT = """
+var el = arguments[0], text = arguments[1];
+el.focus();
+if ('value' in el) {
+    Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value').set.call(el, text);
+} else if (!document.execCommand('insertText', false, text)) {
+    el.innerText = text;
+}
+el.dispatchEvent(new Event('input', {bubbles: true}));
+return 'value' in el ? el.value : el.innerText;
+"""
+
+JS_INPUT_VALUE = "var el = arguments[0]; return 'value' in el ? el.value : el.innerText;"
+
 # Dummy copy to avoid reference to Selenium
 class BY(object):
     """
@@ -65,39 +87,98 @@ class RPAChrome():
                 self.options.add_experimental_option(o)
         # self.options.add_experimental_option('excludeSwitches', ['enable-logging'])
         self.driver = None  #
+        self.roundtrips = 0 # WebDriver commands (HTTP requests to chromedriver)
+        # send_keys: cdp (Input.insertText) | script (JS_INSERT_TEXT) | keys (key by key, slow for long texts)
+        self.input_mode = self.config.get("input", "cdp")
+        # Max secs per step (WebDriverWait), each wait returns as soon as its condition is met
+        self.waits: dict = {"default": 10, "page": 30, "element": 10, "menu": 5, "poll": 0.1}
+        self.waits.update(self.config.get("waits", {}))
+        # Optional human-like delays [min, max] secs added by jitter(), None: disabled
+        self.jitter_range: list[float] = self.config.get("jitter", None)
+        # is_alive(): cheap check (chromedriver and browser pids) cached for "ttl" secs, deep check (WebDriver
+        # roundtrip) every "deep_interval" secs or when asked (see YoquSupervisor)
+        self.liveness: dict = {"ttl": 2, "deep_interval": 60}
+        self.liveness.update(self.config.get("liveness", {}))
+        self.alive: bool = None
+        self.alive_checked = 0.0
+        self.deep_checked = 0.0
 
-    def sleep(self, t:int|list[int] = None):
+    def sleep(self, t:int|float|list[float] = None):
         if not t:
             time.sleep(random.randint(*self.sleep_range))
-        elif isinstance(t, int):
+        elif isinstance(t, (int, float)):
             time.sleep(t)
-        elif isinstance(t, list):
-            time.sleep(random.randint(*self.sleep_range))
         else:
-            time.sleep(random.randint(*self.sleep_range))
+            time.sleep(random.uniform(*t))
+
+    def jitter(self, t:list[float] = None):
+        """Human-like delay, only if "jitter" is configured (t: [min, max] for this step)"""
+        if self.jitter_range:
+            time.sleep(random.uniform(*(t or self.jitter_range)))
+
+    def wait(self, condition, step:str = "default", timeout:float = None, message:str = ""):
+        """WebDriverWait(condition) with the timeout of step, raises TimeoutException"""
+        timeout = timeout if timeout is not None else self.waits.get(step, self.waits["default"])
+        return WebDriverWait(self.driver, timeout, poll_frequency=self.waits["poll"]).until(condition, message)
+
+    def wait_for(self, by, value, step:str = "element", clickable:bool = False):
+        """Element (visible or clickable) or None after the timeout of step"""
+        condition = EC.element_to_be_clickable((by, value)) if clickable else EC.visibility_of_element_located((by, value))
+        try:
+            return self.wait(condition, step)
+        except TimeoutException:
+            logger.warning(f"Timeout ({step}) waiting for {value}")
+            return None
+
+    def wait_ready(self, step:str = "page") -> bool:
+        try:
+            self.wait(lambda driver: driver.execute_script("return document.readyState") == "complete", step)
+            return True
+        except TimeoutException:
+            logger.warning(f"Timeout ({step}) waiting for {self.driver.current_url}")
+            return False
 
     def _connect(self):
         try:
             if not self.is_alive():
                 self.driver = uc.Chrome(options=self.options, **self.config["uc_options"])
                 self.process_pid = self.driver.browser_pid
+                ProcessHelper.register(self.process_pid)
+                ProcessHelper.register(self.driver.service.process.pid)
+                self._count_roundtrips()
+                self.alive = None
             else:
                 logger.info(f"Browser pid={self.process_pid} already started, ignoring")
         except WebDriverException as we:
             logger.error(f"Cannot connect to process")
-            raise YoquException(we.msg)
+            raise YoquBrowserException(we.msg)
         return self.driver
 
+    def _count_roundtrips(self):
+        # WebElement commands are executed by its parent driver too, so all commands go through driver.execute
+        execute = self.driver.execute
+
+        def _execute(driver_command, params=None):
+            self.roundtrips += 1
+            return execute(driver_command, params)
+        self.driver.execute = _execute
+
     def start(self):
         self.driver = self._connect()
         self.go2url(self.config["url"])
-        self.sleep()
+        self.wait_ready()
+        if self.url_title:
+            try:
+                self.wait(lambda driver: driver.title == self.url_title, "page")
+            except TimeoutException:
+                pass
+        self.jitter()
 
         if self.url_title and self.driver.title != self.url_title:
             logger.error(f"Cannot go to {self.url}, current is '{self.driver.current_url}' ({self.driver.title})")
             if self.debug:
                 self.save_screenshot()
-            raise YoquException(f"Cannot go to {self.url}")
+            raise YoquBrowserException(f"Cannot go to {self.url}")
         logger.info(f"Browser started, pid={self.process_pid}")
 
     def go2url(self, url:str):
@@ -112,8 +193,14 @@ class RPAChrome():
     def _quit(self):
         try:
             if self.driver:
+                pids = [self.process_pid, self.driver.service.process.pid]
                 self.driver.quit()
                 self.process_pid = -1
+                self.alive = None
+                # Browser/chromedriver can be left as zombies (children of this process)
+                ProcessHelper.reap_zombies(pids)
+                for pid in pids:
+                    ProcessHelper.unregister(pid)
         except Exception as e:
             logger.warning(f"Ignoring {e}")
 
@@ -130,12 +217,27 @@ class RPAChrome():
         self.start()
         return self.process
 
-    def is_alive(self):
+    def _deep_alive(self) -> bool:
+        try:
+            return self.driver.window_handles != []
+        except Exception as e:
+            logger.warning(f"Browser pid={self.process_pid} not responding ({e})")
+            return False
+
+    def is_alive(self, deep:bool = False) -> bool:
         if not self.driver:
             return False
-        if self.driver.service.process.poll() is None and self.driver.window_handles != []:
-            return True
-        return False
+        now = time.time()
+        deep = deep or now - self.deep_checked >= self.liveness["deep_interval"]
+        if not deep and self.alive is not None and now - self.alive_checked < self.liveness["ttl"]:
+            return self.alive
+        alive = self.driver.service.process.poll() is None and ProcessHelper.is_running(self.process_pid)
+        if alive and deep:
+            alive = self._deep_alive()
+            self.deep_checked = now
+        self.alive = alive
+        self.alive_checked = now
+        return alive
 
     def status(self):
         return {"pid": self.process_pid, "command": self.command, "alive": self.is_alive()}
@@ -145,7 +247,8 @@ class RPAChrome():
             self.driver.refresh()
 
     def info(self) -> dict:
-        return {"pid": self.process_pid, "command": self.command, "alive": self.is_alive()}
+        return {"pid": self.process_pid, "command": self.command, "alive": self.alive,
+                "alive_checked": self.alive_checked, "roundtrips": self.roundtrips}
 
     @retry()
     def find_element(self, by, value):
@@ -160,8 +263,31 @@ class RPAChrome():
         elem.click()
         return elem
 
+    @staticmethod
+    def _same_text(value: str, text: str) -> bool:
+        return (value or "").replace("\r\n", "\n").strip() == text.replace("\r\n", "\n").strip()
+
+    def _insert_text(self, elem, text: str, mode: str) -> bool:
+        """Whole text in one call (constant time), True if the page has the text"""
+        try:
+            if mode == "cdp":
+                self.driver.execute_script(JS_CLEAR_INPUT, elem)
+                self.driver.execute_cdp_cmd("Input.insertText", {"text": text})
+                value = self.driver.execute_script(JS_INPUT_VALUE, elem)
+            else:
+                value = self.driver.execute_script(JS_INSERT_TEXT, elem, text)
+        except Exception as e:
+            logger.warning(f"Cannot insert text with {mode} ({e})")
+            return False
+        return self._same_text(value, text)
+
     def send_keys(self, by, value, text):
         elem = self.driver.find_element(by, value)
+        modes = {"cdp": ["cdp", "script"], "script": ["script"]}.get(self.input_mode, [])
+        for mode in modes:
+            if self._insert_text(elem, text, mode):
+                return elem
+            logger.warning(f"Text not set with {mode}, trying next input mode")
         for part in text.split('\n'):
             elem.send_keys(part)
             (ActionChains(self.driver)
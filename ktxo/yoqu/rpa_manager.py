@@ -1,6 +1,10 @@
 import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 import copy
+from datetime import datetime
+import inspect
 import json
 import logging
 
@@ -13,12 +17,17 @@ import psutil
 # # ----------------------------------------------------------------------------
 logger = logging.getLogger("ktxo.yoqu")
 
-from ktxo.yoqu.base import YoquRPAChat, YoquStatus, YoquStats, YoquException, YoquNotFoundException
+from ktxo.yoqu.base import YoquRPAChat, YoquStatus, YoquStats, YoquException, YoquNotFoundException, RPAChat
+from ktxo.yoqu.metrics import metrics
+from ktxo.yoqu.pool import YoquResourcePool
 from ktxo.yoqu.resource.rpa_chatgpt import RPAChatGPTResource
+from ktxo.yoqu.router import YoquRouter
 
 
 
 class RPAManager():
+    RESOURCE_TYPES = {"chatgpt": RPAChatGPTResource}
+
     def __init__(self, config: dict|str, default_resource:str = None):
         if isinstance(config, str):
             with open(config, "r", encoding="utf-8") as fd:
@@ -27,18 +36,24 @@ class RPAManager():
             self.config = copy.deepcopy(config)
         self.default_resource = default_resource
         self.rpas:dict[str, YoquRPAChat] = {}
-        self.locks = {}
+        self.pools:dict[str, YoquResourcePool] = {}
+        self.writer = None # YoquChatWriter (db), chats returned by run()/stream() are persisted
+        self.supervisor = None # YoquSupervisor, health probes and recovery of browsers
+        self.recent: OrderedDict[str, RPAChat] = OrderedDict() # Last complete chats returned by run()/stream()
+        self.recent_size = self.config.get("recent_size", 1000)
+        routing = self.config.get("routing", {})
+        self.router = YoquRouter(routing.get("policy", YoquRouter.LEAST_OUTSTANDING), routing.get("weights", {}))
         logger.info(f"Starting....")
 
+        names = []
         for filename in self.config.get("rpas", []):
             try:
                 if name:= self.add(filename):
-                    logger.info(f"Added resource {name}, starting...")
-                    self.rpas[name].init_resource()
-                    self.rpas[name].start()
+                    logger.info(f"Added resource {name}")
+                    names.append(name)
             except Exception as e:
-                del self.rpas[name]
-                logger.error(f"Cannot add resource from  {filename}", e)
+                logger.error(f"Cannot add resource from  {filename} ({e})")
+        self.start(names)
         self.rpa_default = ""
         if self.rpas:
             self.rpa_default = list(self.rpas.keys())[0]
@@ -53,29 +68,94 @@ class RPAManager():
             except Exception as e:
                 logger.error(f"Ops, cannot open/reading configuration file '{config}' ({e})")
                 return None
-        if config["name"] in config:
+        if config["name"] in self.rpas:
             logger.warning(f"Resource {config['name']} already exists, ignoring")
             return None
-        if config.get("type", None) == "chatgpt":
-            self.rpas[config["name"]] = RPAChatGPTResource(config["name"], config)
-            self.locks[config["name"]] = asyncio.Lock()
-        else:
+        resource_class = self.RESOURCE_TYPES.get(config.get("type", None), None)
+        if resource_class is None:
             logger.error(f"Resource type {config.get('type', '')} unknown, ignoring")
+            return None
+        pool = YoquResourcePool(config["name"], config, resource_class)
+        self.pools[config["name"]] = pool
+        self.rpas[config["name"]] = pool.primary
         return config["name"]
 
+    def start(self, names:list[str] = None) -> dict[str, bool]:
+        """
+        Start resources at the same time (startup takes the time of the slowest browser), "lazy" in rpa_manager.json
+        (or pool.lazy in a resource) starts browsers on first use. Resources raising errors are removed, resources
+        whose browsers cannot be started are kept as "failed" (not ok, skipped by routing and batches) so the
+        supervisor or /admin/restart/ can recover them.
+        """
+        names = names if names is not None else list(self.pools.keys())
+        lazy = self.config.get("lazy", None)
+        rc = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(names)), thread_name_prefix="start") as executor:
+            futures = {name: executor.submit(self.pools[name].start, lazy) for name in names}
+        for name, future in futures.items():
+            try:
+                rc[name] = future.result()
+            except Exception as e:
+                logger.error(f"Cannot start resource {name} ({e})")
+                self.remove(name)
+                rc[name] = False
+        logger.info(f"Resources started: {rc}")
+        return rc
+
+    def readiness(self) -> dict[str, dict]:
+        return {name: {"state": pool.state,
+                       "ok": pool.is_ok(),
+                       "healthy": pool.size_healthy(),
+                       "size": len(pool.members),
+                       "started_in": pool.started_in}
+                for name, pool in self.pools.items()}
+
+    def remove(self, name:str):
+        self.rpas.pop(name, None)
+        self.pools.pop(name, None)
+
     def status(self, name:str) -> bool:
-        rpa = self.rpas.get(name, None)
-        if rpa is None:
+        pool = self.pools.get(name, None)
+        if pool is None:
             logger.warning(f"Resource {name} unknown, ignoring")
             return False
-        return rpa.is_ok()
+        return pool.is_ok()
+
+    def health(self, name:str) -> dict:
+        """
+        Status with circuit breaker state of each member (see YoquSupervisor). Only last known state: no browser
+        checks (they run in the member thread, by requests and the supervisor) and no circuit changes
+        """
+        pool = self.pools.get(name, None)
+        if pool is None:
+            raise YoquException(f"Resource '{name}' not found")
+        return {"ok": pool.is_ok(),
+                "state": pool.state,
+                "available": len([member for member in pool.members if member.circuit != member.OPEN]),
+                "members": [{**{key: value for key, value in member.info().items() if key != "executor"},
+                             **self._liveness(member.rpa)}
+                            for member in pool.members]}
+
+    @staticmethod
+    def _liveness(rpa:YoquRPAChat) -> dict:
+        browser = getattr(rpa, "browser", None)
+        if browser is None:
+            return {"alive": None, "alive_checked": None}
+        return {"alive": browser.alive,
+                "alive_checked": str(datetime.utcfromtimestamp(browser.alive_checked)) if browser.alive_checked else None}
+
+    async def restart(self, name:str) -> dict[int, bool]:
+        pool = self.pools.get(name, None)
+        if pool is None:
+            raise YoquException(f"Resource '{name}' not found")
+        return await pool.restart()
 
     def stats(self, name:str) -> dict:
-        rpa = self.rpas.get(name, None)
-        if rpa is None:
+        pool = self.pools.get(name, None)
+        if pool is None:
             logger.warning(f"Resource {name} unknown, ignoring")
             raise YoquException(f"Resource '{name}' not found")
-        return rpa.info()
+        return {**pool.primary.info(), "pool": pool.info(), "latency": metrics.summary(name)}
 
     async def get_manager(self, name) -> YoquRPAChat:
         async with self.concurrency_limit:
@@ -87,16 +167,104 @@ class RPAManager():
                 logger.info(f"Returning {rpa.name}")
                 return rpa
 
+    async def route(self, chat_id:str = None) -> str:
+        """
+        Resource for a request without resource_name: new chats are routed by policy (YoquRouter), existing ones
+        (chat_id) go to the resource that has them (see chat_resource()), default resource if unknown
+        """
+        if chat_id:
+            return await self.chat_resource(chat_id) or self.default_resource
+        return self.router.choose(self.pools, self.default_resource)
+
+    async def chat_resource(self, chat_id:str) -> str:
+        """Resource of chat_id: last chats returned by run()/stream(), then Messages (db), None if unknown"""
+        chat = self.recent.get(chat_id, None)
+        if chat and chat.resource in self.pools:
+            return chat.resource
+        try:
+            from ktxo.yoqu.db import engine, get_chat_resource
+            from sqlalchemy.ext.asyncio import AsyncSession
+            resource = await get_chat_resource(AsyncSession(engine), chat_id)
+        except Exception as e:
+            logger.warning(f"Cannot get resource of chat {chat_id} from DB ({e})")
+            return None
+        return resource if resource in self.pools else None
+
     @asynccontextmanager
     async def get_resource(self, name:str = None) -> YoquRPAChat:
         if not name:
             name = self.default_resource
-        if name not in self.locks:
+        if name not in self.pools:
             raise YoquException(f"Resource '{name}' not found")
-        async with self.locks[name]:
-            logger.info(f"Locking {name}")
-            yield self.rpas[name]
-            logger.info(f"Releasing {name}")
+        async with self.pools[name].checkout() as rpa:
+            yield rpa
+
+    async def run(self, rpa:YoquRPAChat, fn, *args, **kwargs):
+        """Run a blocking call for rpa (e.g. rpa.send) in the worker thread of its browser"""
+        result = await self.pools[rpa.name].run(rpa, fn, *args, **kwargs)
+        if isinstance(result, RPAChat):
+            self._chat_done(result, self._delete_after(fn, *args, **kwargs))
+        return result
+
+    async def stream(self, rpa:YoquRPAChat, fn, *args, **kwargs):
+        """Iterate a blocking generator for rpa (e.g. rpa.stream) in the worker thread of its browser"""
+        async for item in self.pools[rpa.name].stream(rpa, fn, *args, **kwargs):
+            if isinstance(item, dict) and isinstance(item.get("chat", None), RPAChat):
+                self._chat_done(item["chat"], self._delete_after(fn, *args, **kwargs))
+            yield item
+
+    @staticmethod
+    def _delete_after(fn, *args, **kwargs) -> bool:
+        """delete_after argument of fn (create/stream), the chat doesn't exist anymore in the resource"""
+        try:
+            return bool(inspect.signature(fn).bind(*args, **kwargs).arguments.get("delete_after", False))
+        except (TypeError, ValueError):
+            return False
+
+    def _chat_done(self, chat:RPAChat, deleted:bool = False):
+        if deleted:
+            # One-shot chat: not persisted and no follow-ups (see chat_resource())
+            self.recent.pop(chat.chat_id, None)
+            return
+        if self.writer:
+            self.writer.put(chat)
+        if not chat.chat_id:
+            return
+        if chat.since_message_id:
+            # Partial chat, the stored one is outdated
+            self.recent.pop(chat.chat_id, None)
+            return
+        self.recent[chat.chat_id] = chat
+        self.recent.move_to_end(chat.chat_id)
+        while len(self.recent) > self.recent_size:
+            self.recent.popitem(last=False)
+
+    def recent_chat(self, chat_id:str) -> RPAChat:
+        return self.recent.get(chat_id, None)
+
+    def cached_chats(self, name:str = None) -> list[RPAChat]:
+        """Chats (sidebar) already loaded by any member of the resource and not expired, None otherwise"""
+        pool = self.pools.get(name or self.default_resource, None)
+        if pool is None:
+            return None
+        for member in pool.members:
+            if (chats := member.rpa.cached_chats()) is not None:
+                return chats
+        return None
+
+    async def cached(self, name:str, message:str, chat_name:str = None, delete_after=False, use_cache=True) -> RPAChat:
+        """Completion cache lookup without locking the resource (SQLite file, read in a thread)"""
+        pool = self.pools.get(name or self.default_resource, None)
+        if pool is None or not pool.primary.cacheable(message, chat_name, delete_after, use_cache):
+            return None
+        return await asyncio.to_thread(pool.primary.cached, message, chat_name, delete_after, use_cache)
+
+    def queues(self) -> dict:
+        return {name: {"outstanding": self.router.outstanding(pool),
+                       "waiting": pool.waiting,
+                       "wait_avg": pool.info()["wait_avg"],
+                       "members": [member.executor.info() for member in pool.members]}
+                for name, pool in self.pools.items()}
 
 
 if __name__ == '__main__':
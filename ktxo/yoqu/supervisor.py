@@ -0,0 +1,102 @@
+#
+# Health supervisor: probes pool members in the background, restarts dead browsers and opens circuits of blocked ones
+#
+import asyncio
+from datetime import datetime
+import logging
+import time
+
+from ktxo.yoqu.pool import YoquPoolMember, YoquResourcePool
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquSupervisor():
+    """
+    Every interval secs each idle member of started pools is probed in its own thread (members serving a request are
+    skipped, a request is a probe too, see YoquResourcePool.run):
+        dead: browser restarted, after a failed restart the next one waits backoff secs (doubled up to backoff_max)
+              and the member is out of rotation (circuit open) meanwhile
+        blocked (challenge page): circuit open until a probe finds the page unblocked
+        ok: circuit opened by the supervisor closed again
+    """
+    DEAD = "dead"
+    BLOCKED = "blocked"
+    OK = "ok"
+
+    def __init__(self, manager, interval: float = 30, backoff: float = 30, backoff_max: float = 600):
+        self.manager = manager
+        self.interval = interval
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.probes = 0
+        self.restarts = 0
+        self.last_run: datetime = None
+        self.task: asyncio.Task = None
+
+    async def _restart(self, pool: YoquResourcePool, member: YoquPoolMember):
+        if time.time() < member.next_restart:
+            return
+        self.restarts += 1
+        if await member.executor.run(pool.restart_member, member):
+            member.backoff = 0
+            member.next_restart = 0
+            return
+        member.backoff = min(self.backoff_max, member.backoff * 2 if member.backoff else self.backoff)
+        member.next_restart = time.time() + member.backoff
+        member.open(self.DEAD, member.backoff)
+        logger.error(f"Supervisor: cannot restart {pool.name}#{member.index}, next try in {member.backoff} secs")
+
+    async def check(self, pool: YoquResourcePool, member: YoquPoolMember) -> str:
+        if not await pool.try_reserve(member):
+            return None
+        try:
+            rc = await member.executor.run(pool.probe, member)
+            self.probes += 1
+            member.last_probe = datetime.utcnow()
+            if rc == self.DEAD:
+                await self._restart(pool, member)
+            elif rc == self.BLOCKED:
+                member.open(self.BLOCKED, self.interval)
+            elif member.circuit_reason in [self.BLOCKED, self.DEAD]:
+                member.close()
+            return rc
+        except Exception as e:
+            logger.error(f"Supervisor: cannot check {pool.name}#{member.index} ({e})")
+            return None
+        finally:
+            await pool._release(member)
+
+    async def check_all(self) -> dict[str, list[str]]:
+        rc = {}
+        for name, pool in list(self.manager.pools.items()):
+            # Lazy pools are started by their first request
+            if pool.state not in [pool.READY, pool.FAILED]:
+                continue
+            rc[name] = await asyncio.gather(*[self.check(pool, member) for member in pool.members])
+        self.last_run = datetime.utcnow()
+        return rc
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                rc = await self.check_all()
+                logger.debug(f"Supervisor: {rc}")
+            except Exception as e:
+                logger.error(f"Supervisor: check failed ({e})")
+
+    def start(self):
+        if self.interval > 0:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def info(self) -> dict:
+        return {"running": self.task is not None and not self.task.done(),
+                "interval": self.interval,
+                "probes": self.probes,
+                "restarts": self.restarts,
+                "last_run": str(self.last_run)}
@@ -0,0 +1,120 @@
+#
+# Worker process: executes completion jobs queued in the DB (POST /yoqu/jobs/) with its own browsers
+#
+# PYTHONPATH=$PWD python ktxo/yoqu/worker.py <rpa_manager.json> [worker_name]
+#
+import asyncio
+import dataclasses
+import json
+import logging
+import logging.config
+import os
+import socket
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ktxo.yoqu.common.model import CompletionRequest, Jobs
+from ktxo.yoqu.config import settings
+from ktxo.yoqu.db import engine, init_db, claim_job, heartbeat_job, finish_job, requeue_stale_jobs, YoquChatWriter
+from ktxo.yoqu.rpa_manager import RPAManager
+from ktxo.yoqu.supervisor import YoquSupervisor
+
+logger = logging.getLogger("ktxo.yoqu")
+
+
+class YoquWorker():
+    """
+    Each worker process owns the browsers from its configuration file (they must be different from the ones used by
+    the API or other workers) and runs one job per pool member at the same time. RUNNING jobs without heartbeat
+    (crashed/restarted worker) are queued again.
+    """
+
+    def __init__(self, config: dict | str, name: str = None,
+                 poll_interval: float = 1, heartbeat_secs: float = 30, stale_secs: float = 120, max_attempts: int = 3):
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.heartbeat_secs = heartbeat_secs
+        self.stale_secs = stale_secs
+        self.max_attempts = max_attempts
+        self.manager = RPAManager(config)
+        # Jobs without resource go to the first one
+        self.manager.default_resource = self.manager.rpa_default
+        self.resources = list(self.manager.rpas.keys())
+
+    async def _heartbeat(self, job_id: str):
+        # A failed heartbeat (e.g. DB locked) doesn't stop the next ones, the job is requeued after stale_secs without any
+        while True:
+            await asyncio.sleep(self.heartbeat_secs)
+            try:
+                await heartbeat_job(AsyncSession(engine), job_id)
+            except Exception as e:
+                logger.error(f"Worker {self.name}: heartbeat of job {job_id} failed ({e})")
+
+    async def run_job(self, job: Jobs):
+        logger.info(f"Worker {self.name}: running job {job.id} ({job.operation}, attempt {job.attempts})")
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            request = CompletionRequest(**json.loads(job.request))
+            resource = job.resource or await self.manager.route(request.chat_id if job.operation == "chat" else None)
+            async with self.manager.get_resource(resource) as rpa:
+                if job.operation == "chat":
+                    chat = await self.manager.run(rpa, rpa.send, request.chat_id, request.prompt,
+                                                  request.since_message_id, request.incremental)
+                else:
+                    chat = await self.manager.run(rpa, rpa.create, request.prompt, request.name,
+                                                  request.delete_after, request.use_cache)
+            await finish_job(AsyncSession(engine), job.id, result=json.dumps(dataclasses.asdict(chat), default=str))
+            logger.info(f"Worker {self.name}: job {job.id} done")
+        except Exception as e:
+            logger.error(f"Worker {self.name}: job {job.id} failed ({e})")
+            try:
+                await finish_job(AsyncSession(engine), job.id, error=str(e))
+            except Exception as e:
+                # RUNNING until requeue_stale_jobs()
+                logger.error(f"Worker {self.name}: cannot finish job {job.id} ({e})")
+        finally:
+            heartbeat.cancel()
+
+    async def _loop(self):
+        while True:
+            try:
+                job = await claim_job(AsyncSession(engine), self.name, self.resources)
+            except Exception as e:
+                logger.error(f"Worker {self.name}: cannot claim a job ({e})")
+                job = None
+            if job:
+                await self.run_job(job)
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _requeue(self):
+        while True:
+            try:
+                if n := await requeue_stale_jobs(AsyncSession(engine), self.stale_secs, self.max_attempts):
+                    logger.warning(f"Worker {self.name}: {n} stale jobs queued again")
+            except Exception as e:
+                logger.error(f"Worker {self.name}: cannot requeue stale jobs ({e})")
+            await asyncio.sleep(self.stale_secs / 2)
+
+    async def run(self):
+        await init_db()
+        if settings.db_write_behind:
+            self.manager.writer = YoquChatWriter(settings.db_flush_interval)
+            self.manager.writer.start()
+        self.manager.supervisor = YoquSupervisor(self.manager, settings.supervisor_interval,
+                                                 settings.supervisor_backoff, settings.supervisor_backoff_max)
+        self.manager.supervisor.start()
+        loops = sum(pool.max_size for pool in self.manager.pools.values())
+        logger.info(f"Worker {self.name}: {loops} loops for {self.resources}")
+        await asyncio.gather(self._requeue(), *[self._loop() for _ in range(loops)])
+
+
+if __name__ == '__main__':
+    with open("logging.json", 'r', encoding="utf-8") as fd:
+        logging.config.dictConfig(json.load(fd))
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <rpa_manager.json> [worker_name]")
+        sys.exit(1)
+    worker = YoquWorker(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    asyncio.run(worker.run())
@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+#
+# Start a Yoqu worker (jobs queued with POST /yoqu/jobs/), browsers from <rpa_manager.json> must not be used by the
+# API or other workers
+#
+PYTHONPATH=$PWD python ktxo/yoqu/worker.py ${1:?"Usage: run_worker.sh <rpa_manager.json> [worker_name]"} $2 2>&1 | egrep -v "MESA-INTEL|DevTools|\.cc|wrong ELF|-vkGetInstanceProcAddr"
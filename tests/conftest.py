@@ -0,0 +1,93 @@
+#
+# Tests run with a temporary SQLite file (DB_URL) and fake resources (no browser)
+#
+import os
+import tempfile
+import uuid
+
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='yoqu_test_')}/yoqu.db"
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ktxo.yoqu import db
+from ktxo.yoqu.common.exceptions import YoquBrowserException
+from ktxo.yoqu.common.model import RPAChat, RPAMessage
+
+
+class FakeRPA():
+    """YoquRPAChat stand-in for pools: running once started unless ok is False, calls recorded"""
+
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.config = config
+        self.type = config.get("type", "fake")
+        self.desc = config.get("desc", "")
+        self.member = config.get("member", 0)
+        self.ok = True
+        self.blocked = False
+        self.started = 0
+        self.calls = []
+
+    def init_resource(self, **kwargs):
+        pass
+
+    def start(self, **kwargs):
+        self.started += 1
+
+    def stop(self, **kwargs):
+        pass
+
+    def is_ok(self, deep: bool = False) -> bool:
+        return self.ok and self.started > 0
+
+    def is_blocked(self) -> bool:
+        return self.blocked
+
+    def echo(self, value):
+        self.calls.append(value)
+        return value
+
+    def create(self, message: str, chat_name: str = None, delete_after=False, use_cache=True) -> RPAChat:
+        if not self.ok:
+            raise YoquBrowserException(f"{self.name}#{self.member} not running")
+        self.calls.append(message)
+        return RPAChat(name=chat_name or message,
+                       messages=[RPAMessage(id=str(uuid.uuid4()), text=message, type="REQUEST"),
+                                 RPAMessage(id=str(uuid.uuid4()), text=f"re: {message}", type="RESPONSE")],
+                       type=self.type,
+                       resource=self.name,
+                       chat_id=str(uuid.uuid4()))
+
+    def fail(self):
+        raise YoquBrowserException(f"{self.name}#{self.member} failed")
+
+
+@pytest.fixture
+def fake_config():
+    return {"name": "fake1", "type": "fake", "pool": {"min_size": 1, "max_size": 2}, "breaker": {"max_wait": 1}}
+
+
+@pytest.fixture
+def fake_manager(monkeypatch):
+    """RPAManager factory with FakeRPA resources: fake_manager({"fake1": max_size, ...})"""
+    from ktxo.yoqu.rpa_manager import RPAManager
+    monkeypatch.setattr(RPAManager, "RESOURCE_TYPES", {"fake": FakeRPA})
+
+    def _manager(sizes: dict[str, int], **config) -> RPAManager:
+        rpas = [{"name": name, "type": "fake", "pool": {"max_size": size}, "breaker": {"max_wait": 0}}
+                for name, size in sizes.items()]
+        return RPAManager({"rpas": rpas, **config}, list(sizes.keys())[0])
+    return _manager
+
+
+@pytest.fixture
+async def new_session():
+    """AsyncSession factory over empty messages/jobs tables"""
+    await db.init_db()
+    async with db.engine.begin() as conn:
+        await conn.exec_driver_sql("DELETE FROM messages")
+        await conn.exec_driver_sql("DELETE FROM jobs")
+    yield lambda: AsyncSession(db.engine)
+    # Connections are bound to the event loop of each test
+    await db.engine.dispose()
@@ -0,0 +1,35 @@
+import httpx
+from fastapi import FastAPI
+from sqlmodel import update
+
+from ktxo.yoqu import db
+from ktxo.yoqu.api.routers import api_resource
+from ktxo.yoqu.api.rpa import get_manager
+from ktxo.yoqu.common.model import Messages, RPAChat, RPAMessage
+
+
+def _client(manager) -> httpx.AsyncClient:
+    app = FastAPI()
+    app.include_router(api_resource.router)
+    app.dependency_overrides[get_manager] = lambda: manager
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_get_completion_from_db(new_session, fake_manager):
+    manager = fake_manager({"fake1": 1})
+    chat = RPAChat(name="stored", chat_id="c1", resource="fake1",
+                   messages=[RPAMessage(id="m1", text="hi"), RPAMessage(id="m2", text="hello", type="RESPONSE")])
+    await db.upsert_chats(new_session(), [chat])
+    # Rows without type (written before chats had one)
+    async with new_session() as session:
+        await session.execute(update(Messages).values(type=None))
+        await session.commit()
+    async with _client(manager) as client:
+        res = await client.get("/yoqu/completions/c1", params={"resource_name": "fake1"})
+        assert res.status_code == 200
+        assert res.json()["resource"] == "fake1"
+        assert [m["text"] for m in res.json()["messages"]] == ["hi", "hello"]
+        res = await client.get("/yoqu/completions/c1", params={"since_message_id": "m1"})
+        assert [m["text"] for m in res.json()["messages"]] == ["hello"]
+    # Not read from the browser
+    assert manager.rpas["fake1"].calls == []
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from ktxo.yoqu.batch import YoquBatch, YoquBatchManager
+
+
+async def _wait(batch: YoquBatch) -> YoquBatch:
+    async for _ in batch.results():
+        pass
+    return batch
+
+
+async def test_distribution(fake_manager, tmp_path):
+    manager = fake_manager({"fake1": 2, "fake2": 1})
+    batches = YoquBatchManager(manager, str(tmp_path), save_interval=0.01)
+    batch = await _wait(batches.submit([f"prompt {i}" for i in range(30)]))
+    assert batch.status == YoquBatch.DONE
+    assert all(item["status"] == YoquBatch.DONE for item in batch.items)
+    # One worker per pool member
+    used = {item["resource"] for item in batch.items}
+    assert used == {"fake1", "fake2"}
+    calls = sum(len(member.rpa.calls) for pool in manager.pools.values() for member in pool.members)
+    assert calls == 30
+    assert len(manager.pools["fake1"].members) == 2
+    await asyncio.sleep(0.05)
+    with open(tmp_path / f"{batch.batch_id}.json") as fd:
+        assert json.load(fd)["done"] == 30
+
+
+async def test_broken_resource(fake_manager, tmp_path):
+    manager = fake_manager({"fake1": 1, "fake2": 1})
+    manager.pools["fake2"].primary.ok = False
+    batches = YoquBatchManager(manager, str(tmp_path), save_interval=0.01)
+    batch = await _wait(batches.submit([f"prompt {i}" for i in range(10)], ["fake1", "fake2"]))
+    # Prompts failed by fake2 are requeued for fake1
+    assert batch.status == YoquBatch.DONE
+    assert [item["status"] for item in batch.items] == [YoquBatch.DONE] * 10
+    assert {item["resource"] for item in batch.items} == {"fake1"}
+    assert len(manager.pools["fake1"].primary.calls) == 10
+    assert [item.get("attempts", 0) for item in batch.items].count(1) == 1
+    assert not any("error" in item for item in batch.items)
+
+
+async def test_all_resources_broken(fake_manager, tmp_path):
+    manager = fake_manager({"fake1": 1})
+    batches = YoquBatchManager(manager, str(tmp_path), save_interval=0.01, max_attempts=2)
+    manager.pools["fake1"].primary.ok = False
+    batch = await _wait(batches.submit(["a", "b"]))
+    assert batch.status == YoquBatch.ERROR
+    assert all(item["status"] == YoquBatch.ERROR for item in batch.items)
+    assert batch.items[0]["attempts"] == 1 and "no healthy members" in batch.items[0]["error"]
+    assert batch.items[1]["error"] == "No healthy resources"
+
+
+async def test_resume(fake_manager, tmp_path):
+    manager = fake_manager({"fake1": 1})
+    batch = YoquBatch(["a", "b", "c"], name="resumed")
+    batch.items[0] = {"status": YoquBatch.DONE, "resource": "fake1"}
+    with open(tmp_path / f"{batch.batch_id}.json", "w") as fd:
+        json.dump(batch.info(items=True), fd, default=str)
+    batches = YoquBatchManager(manager, str(tmp_path), save_interval=0.01)
+    batches.start()
+    batch = await _wait(batches.get(batch.batch_id))
+    assert batch.status == YoquBatch.DONE
+    assert manager.pools["fake1"].primary.calls == ["b", "c"]
+
+
+def test_upload_invalid_lines():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from ktxo.yoqu.api.routers import api_batch
+    from ktxo.yoqu.api.rpa import get_batch_manager
+
+    app = FastAPI()
+    app.include_router(api_batch.router)
+    app.dependency_overrides[get_batch_manager] = lambda: None
+    client = TestClient(app)
+    res = client.post("/yoqu/batches/upload/", files={"file": ("b.jsonl", b'{"prompt": "a"}\n\n{"text": "b"}\n')})
+    assert res.status_code == 400
+    assert res.json()["detail"].startswith("Line 3 ")
+    res = client.post("/yoqu/batches/upload/", files={"file": ("b.jsonl", b'"a"\n{"prompt": \n')})
+    assert res.status_code == 400
+    assert res.json()["detail"].startswith("Line 2 is not valid JSON")
@@ -0,0 +1,113 @@
+
+from datetime import datetime
+
+from sqlalchemy.dialects.sqlite import insert
+
+from ktxo.yoqu import db
+from ktxo.yoqu.common.model import Messages, RPAChat, RPAMessage
+
+
+class ListWriter():
+    def __init__(self):
+        self.chats = []
+
+    def put(self, chat: RPAChat):
+        self.chats.append(chat)
+
+
+async def test_chat_done(fake_manager):
+    manager = fake_manager({"fake1": 1})
+    manager.writer = ListWriter()
+    async with manager.get_resource("fake1") as rpa:
+        kept = await manager.run(rpa, rpa.create, "kept")
+        await manager.run(rpa, rpa.create, "one-shot", None, True)
+        await manager.run(rpa, rpa.create, "one-shot", delete_after=True)
+    # delete_after chats don't exist in the resource anymore
+    assert manager.writer.chats == [kept]
+    assert list(manager.recent.keys()) == [kept.chat_id]
+
+
+async def test_update_message(new_session):
+    await db.add_message(new_session(), Messages(id="c1", message_id="m1", name="chat", messages="[]"))
+    m = await db.update_message(new_session(), "c1", resource_name="fake1", deleted=True)
+    # Attributes readable after the session is closed
+    assert (m.id, m.name, m.resource, m.online) == ("c1", "chat", "fake1", False)
+    assert await db.update_message(new_session(), "unknown", resource_name="fake1") is None
+
+
+def _chat(chat_id: str, texts: list[str], since_message_id: str = None, **kwargs) -> RPAChat:
+    return RPAChat(name=f"chat {chat_id}",
+                   chat_id=chat_id,
+                   messages=[RPAMessage(id=f"{chat_id}-{text}", text=text) for text in texts],
+                   since_message_id=since_message_id,
+                   **kwargs)
+
+
+async def _stored(new_session, chat_id: str) -> list[str]:
+    page = await db.get_messages(new_session(), id_=chat_id, with_messages=True)
+    return [m["text"] for m in page["items"][0]["messages"]]
+
+
+async def test_upsert(new_session):
+    assert await db.upsert_chats(new_session(), [_chat("c1", ["a", "b"], type="chatgpt", resource="fake1"),
+                                                 _chat("c2", ["x"])]) == 2
+    row = (await db.get_messages(new_session(), id_="c2"))["items"][0]
+    # Chats without type/resource
+    assert (row["type"], row["resource"]) == ("chatgpt", "default")
+    assert await db.upsert_chats(new_session(), [_chat("c1", ["a", "b", "c"], type="chatgpt", resource="fake1")]) == 1
+    assert await _stored(new_session, "c1") == ["a", "b", "c"]
+
+
+async def test_upsert_partial(new_session):
+    await db.upsert_chats(new_session(), [_chat("c1", ["a", "b"])])
+    # Incremental chats (messages after since_message_id) are appended, known messages replaced
+    await db.upsert_chats(new_session(), [_chat("c1", ["b", "c"], since_message_id="c1-a")])
+    assert await _stored(new_session, "c1") == ["a", "b", "c"]
+    # Several partial chats in the same write
+    await db.upsert_chats(new_session(), [_chat("c1", ["d"], since_message_id="c1-c"),
+                                          _chat("c1", ["e"], since_message_id="c1-d")])
+    assert await _stored(new_session, "c1") == ["a", "b", "c", "d", "e"]
+    # Partial chat not stored yet
+    await db.upsert_chats(new_session(), [_chat("c2", ["y"], since_message_id="c2-x")])
+    assert await _stored(new_session, "c2") == ["y"]
+
+
+async def test_pagination(new_session):
+    # Same created for some rows: ties are ordered by id
+    rows = [{**db.chat_to_row(_chat(f"c{i:02d}", [f"text {i}"], resource="fake1" if i % 2 else "fake2")),
+             "created": datetime(2024, 1, 1 + i // 3)} for i in range(10)]
+    async with new_session() as session:
+        await session.execute(insert(Messages).values(rows))
+        await session.commit()
+    ids, cursor = [], None
+    while True:
+        page = await db.get_messages(new_session(), limit=3, cursor=cursor)
+        assert len(page["items"]) <= 3
+        ids += [row["id"] for row in page["items"]]
+        if not (cursor := page["next"]):
+            break
+    assert ids == [f"c{i:02d}" for i in reversed(range(10))]
+    page = await db.get_messages(new_session(), resource_name="fake1", limit=10)
+    assert [row["id"] for row in page["items"]] == ["c09", "c07", "c05", "c03", "c01"]
+    assert page["next"] is None
+    assert "messages" not in page["items"][0]
+
+
+async def test_search(new_session):
+    await db.upsert_chats(new_session(), [_chat("c1", ["the quick brown fox"]),
+                                          _chat("c2", ["lazy dog", "brown bear"]),
+                                          _chat("c3", ["nothing here"])])
+    assert db.fts_enabled
+
+    async def search(query: str) -> list[str]:
+        return sorted(row["id"] for row in (await db.get_messages(new_session(), query=query))["items"])
+
+    assert await search("brown") == ["c1", "c2"]
+    assert await search("brown fox") == ["c1"]
+    # Names too
+    assert await search("c3") == ["c3"]
+    # No FTS5 syntax errors
+    assert await search('"quick" OR') == []
+    # Index follows updates
+    await db.upsert_chats(new_session(), [_chat("c3", ["a brown cat"])])
+    assert await search("brown") == ["c1", "c2", "c3"]
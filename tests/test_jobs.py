@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+from ktxo.yoqu import db, worker
+from ktxo.yoqu.common.model import Jobs
+
+
+def _job(resource: str = None, prompt: str = "hello") -> Jobs:
+    return Jobs(request=json.dumps({"prompt": prompt}), resource=resource)
+
+
+async def test_claim(new_session):
+    first = await db.add_job(new_session(), _job())
+    await asyncio.sleep(0.001)
+    await db.add_job(new_session(), _job("other"))
+    job = await db.claim_job(new_session(), "w1", ["fake1"])
+    assert job.id == first.id
+    assert (job.status, job.worker, job.attempts) == ("RUNNING", "w1", 1)
+    assert job.heartbeat is not None
+    # Jobs of other resources are not claimed
+    assert await db.claim_job(new_session(), "w2", ["fake1"]) is None
+    assert (await db.claim_job(new_session(), "w2", ["other"])).worker == "w2"
+
+
+async def test_claim_once(new_session):
+    await db.add_job(new_session(), _job())
+    jobs = await asyncio.gather(*[db.claim_job(new_session(), f"w{i}", []) for i in range(5)])
+    assert len([job for job in jobs if job]) == 1
+
+
+async def test_finish(new_session):
+    job = await db.add_job(new_session(), _job())
+    await db.finish_job(new_session(), job.id, error="boom")
+    job = await db.get_job(new_session(), job.id)
+    assert (job.status, job.error) == ("ERROR", "boom")
+
+
+async def test_requeue_stale(new_session):
+    job = await db.add_job(new_session(), _job())
+    await db.claim_job(new_session(), "w1", [])
+    # Heartbeat is recent
+    assert await db.requeue_stale_jobs(new_session(), 60) == 0
+    assert await db.requeue_stale_jobs(new_session(), -1) == 1
+    job = await db.get_job(new_session(), job.id)
+    assert (job.status, job.worker) == ("PENDING", None)
+    # Too many attempts
+    await db.claim_job(new_session(), "w1", [])
+    await db.requeue_stale_jobs(new_session(), -1, max_attempts=2)
+    job = await db.get_job(new_session(), job.id)
+    assert (job.status, job.error, job.attempts) == ("ERROR", "Too many attempts", 2)
+
+
+async def test_worker(new_session, fake_manager, monkeypatch):
+    monkeypatch.setattr(worker, "RPAManager", lambda config: fake_manager({"fake1": 1}))
+    w = worker.YoquWorker({}, "w1", heartbeat_secs=0.01)
+    beats = []
+
+    async def heartbeat_job(session, id_):
+        beats.append(id_)
+        if len(beats) == 1:
+            raise Exception("database is locked")
+
+    monkeypatch.setattr(worker, "heartbeat_job", heartbeat_job)
+    rpa = w.manager.rpas["fake1"]
+    create = rpa.create
+
+    def slow_create(*args):
+        time.sleep(0.05)
+        return create(*args)
+
+    rpa.create = slow_create
+    await db.add_job(new_session(), _job())
+    job = await db.claim_job(new_session(), w.name, w.resources)
+    await w.run_job(job)
+    job = await db.get_job(new_session(), job.id)
+    assert job.status == "DONE"
+    assert json.loads(job.result)["resource"] == "fake1"
+    # Heartbeats go on after a failed one
+    assert len(beats) > 1
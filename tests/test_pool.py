@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from ktxo.yoqu.common.exceptions import YoquException, YoquBrowserException
+from ktxo.yoqu.pool import YoquResourcePool, build_member_config
+from ktxo.yoqu.supervisor import YoquSupervisor
+
+from conftest import FakeRPA
+
+
+CHROME = {"command": ["chrome", "--remote-debugging-port=9222", "--user-data-dir=chrome_data/chatgpt"],
+          "options_experimental": [["debuggerAddress", "127.0.0.1:9222"]]}
+
+
+def test_member_config():
+    config = build_member_config({"name": "chatgpt1", "resource": CHROME}, 2)
+    assert config["member"] == 2
+    assert config["resource"]["command"] == ["chrome", "--remote-debugging-port=9224",
+                                             "--user-data-dir=chrome_data/chatgpt_2"]
+    assert config["resource"]["options_experimental"] == [["debuggerAddress", "127.0.0.1:9224"]]
+    assert build_member_config({"name": "chatgpt1", "resource": CHROME}, 0)["resource"] == CHROME
+
+
+def test_member_profiles(tmp_path):
+    profile = str(tmp_path / "chatgpt")
+    config = {"name": "chatgpt1", "resource": {"command": ["chrome", f"--user-data-dir={profile}"]},
+              "pool": {"max_size": 2}}
+    with pytest.raises(YoquException, match="profiles not found"):
+        YoquResourcePool("chatgpt1", config, FakeRPA)
+    (tmp_path / "chatgpt_1").mkdir()
+    assert YoquResourcePool("chatgpt1", config, FakeRPA).max_size == 2
+    # Explicit member configuration
+    config["pool"]["members"] = [{}, {"command": ["chrome", f"--user-data-dir={tmp_path}/other"]}]
+    (tmp_path / "chatgpt_1").rmdir()
+    assert YoquResourcePool("chatgpt1", config, FakeRPA).max_size == 2
+
+
+async def test_checkout(fake_config):
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    assert pool.start()
+    assert pool.state == pool.READY
+    async with pool.checkout() as rpa1:
+        assert rpa1.member == 0
+        # Member 0 busy: new member up to max_size
+        async with pool.checkout() as rpa2:
+            assert rpa2.member == 1
+            assert len(pool.members) == 2
+            assert await pool.run(rpa2, rpa2.echo, "x") == "x"
+    assert not any(member.busy for member in pool.members)
+    assert pool.checkouts == 2
+
+
+async def test_checkout_waits(fake_config):
+    fake_config["pool"]["max_size"] = 1
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    order = []
+
+    async def request(i):
+        async with pool.checkout():
+            order.append(i)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request(i) for i in range(3)])
+    assert order == [0, 1, 2]
+    assert pool.waiting == 0
+
+
+async def test_checkout_queue_full(fake_config):
+    fake_config["pool"].update({"max_size": 1, "queue_size": 1})
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    async with pool.checkout():
+        waiter = asyncio.create_task(pool.checkout().__aenter__())
+        await asyncio.sleep(0)
+        with pytest.raises(YoquException, match="queue full"):
+            async with pool.checkout():
+                pass
+        waiter.cancel()
+
+
+async def test_lazy_start(fake_config):
+    fake_config["pool"]["lazy"] = True
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    assert pool.start()
+    assert pool.state == pool.LAZY and pool.is_ok()
+    assert pool.primary.started == 0
+    # Started by the first request
+    async with pool.checkout() as rpa:
+        assert rpa.started == 1
+    assert pool.state == pool.READY
+
+
+async def test_lazy_start_failed(fake_config):
+    fake_config["pool"].update({"lazy": True, "max_size": 1})
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    pool.primary.ok = False
+    with pytest.raises(YoquException, match="no healthy members"):
+        async with pool.checkout():
+            pass
+    assert pool.state == pool.FAILED and not pool.is_ok()
+
+
+async def test_breaker(fake_config):
+    fake_config.update({"pool": {"max_size": 1}, "breaker": {"failures": 2, "open_secs": 0.05, "max_wait": 1}})
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    member = pool.members[0]
+    async with pool.checkout() as rpa:
+        # Caller errors don't count
+        with pytest.raises(TypeError):
+            await pool.run(rpa, rpa.echo)
+        for _ in range(2):
+            with pytest.raises(YoquBrowserException):
+                await pool.run(rpa, rpa.fail)
+    assert member.circuit == member.OPEN
+    assert not pool.is_ok()
+    # Requests wait for half open (open_secs < max_wait)
+    async with pool.checkout() as rpa:
+        assert member.circuit == member.HALF_OPEN
+        with pytest.raises(YoquBrowserException):
+            await pool.run(rpa, rpa.fail)
+    # Failed trial: open again
+    assert member.circuit == member.OPEN
+    async with pool.checkout() as rpa:
+        await pool.run(rpa, rpa.echo, "ok")
+    assert member.circuit == member.CLOSED and pool.is_ok()
+
+
+async def test_breaker_unavailable(fake_config):
+    fake_config.update({"pool": {"max_size": 1}, "breaker": {"max_wait": 1}})
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    pool.members[0].open("blocked", 60)
+    with pytest.raises(YoquBrowserException, match="unavailable"):
+        async with pool.checkout():
+            pass
+    # Other members keep serving requests
+    fake_config["pool"]["max_size"] = 2
+    pool = YoquResourcePool("fake1", fake_config, FakeRPA)
+    pool.start()
+    pool.members[0].open("blocked", 60)
+    async with pool.checkout() as rpa:
+        assert rpa.member == 1
+
+
+async def test_supervisor(fake_manager):
+    manager = fake_manager({"fake1": 1})
+    pool = manager.pools["fake1"]
+    member = pool.members[0]
+    supervisor = YoquSupervisor(manager, interval=60, backoff=10)
+    assert await supervisor.check_all() == {"fake1": ["ok"]}
+    member.rpa.blocked = True
+    assert await supervisor.check(pool, member) == "blocked"
+    assert member.circuit == member.OPEN and member.circuit_reason == "blocked"
+    member.rpa.blocked = False
+    assert await supervisor.check(pool, member) == "ok"
+    assert member.circuit == member.CLOSED
+    # Dead browser restarted
+    member.rpa.started = 0
+    assert await supervisor.check(pool, member) == "dead"
+    assert member.rpa.started == 1 and member.circuit == member.CLOSED
+    # Cannot be restarted: out of rotation until the next try (backoff)
+    member.rpa.ok = False
+    assert await supervisor.check(pool, member) == "dead"
+    assert member.circuit == member.OPEN and member.backoff == 10
+    assert await supervisor.check(pool, member) == "dead"
+    assert supervisor.restarts == 2
+    member.rpa.ok = True
+    assert await supervisor.check(pool, member) == "ok"
+    assert member.circuit == member.CLOSED
+    # Busy members are not probed
+    async with pool.checkout():
+        assert await supervisor.check(pool, member) is None
@@ -0,0 +1,105 @@
+import pytest
+
+from ktxo.yoqu import db
+from ktxo.yoqu.common.exceptions import YoquException
+from ktxo.yoqu.common.model import RPAChat, RPAMessage
+from ktxo.yoqu.metrics import metrics
+from ktxo.yoqu.pool import YoquResourcePool
+from ktxo.yoqu.resource.rpa_chatgpt import RPAChatGPTResource
+from ktxo.yoqu.router import YoquRouter
+
+from conftest import FakeRPA
+
+
+@pytest.fixture
+def pools() -> dict[str, YoquResourcePool]:
+    pools = {}
+    for name, size, desc in [("r1", 1, "account 1"), ("r2", 2, "account 2"), ("r3", 1, "account 3")]:
+        pools[name] = YoquResourcePool(name, {"name": name, "desc": desc, "pool": {"max_size": size}}, FakeRPA)
+        pools[name].start()
+    return pools
+
+
+def test_policies(pools):
+    with pytest.raises(YoquException, match="unknown"):
+        YoquRouter("fastest")
+    assert YoquRouter(YoquRouter.DEFAULT).choose(pools, "r2") == "r2"
+    router = YoquRouter(YoquRouter.ROUND_ROBIN)
+    assert [router.choose(pools, "r1") for _ in range(4)] == ["r1", "r2", "r3", "r1"]
+    assert router.info()["routed"] == {"r1": 2, "r2": 1, "r3": 1}
+
+
+def test_least_outstanding(pools):
+    router = YoquRouter(YoquRouter.LEAST_OUTSTANDING)
+    # Ties: default resource
+    assert router.choose(pools, "r3") == "r3"
+    pools["r3"].members[0].busy = True
+    pools["r1"].waiting = 1
+    # r2: 0 busy of 2
+    assert router.choose(pools, "r3") == "r2"
+    pools["r2"].members[0].busy = True
+    assert router.choose(pools, "r3") == "r2"
+    pools["r2"].waiting = 2
+    # r1 1/1, r2 3/2, r3 1/1 (default)
+    assert router.choose(pools, "r3") == "r3"
+    pools["r3"].waiting = 1
+    assert router.choose(pools, "r3") == "r1"
+
+
+def test_latency(pools):
+    metrics.reset()
+    router = YoquRouter(YoquRouter.LATENCY)
+    metrics.observe("wait_response", "r1", "create", 5)
+    metrics.observe("wait_response", "r2", "create", 1)
+    metrics.observe("wait_response", "r3", "create", 2)
+    assert router.choose(pools) == "r2"
+    pools["r2"].waiting = 2
+    assert router.choose(pools) == "r3"
+    metrics.reset()
+
+
+def test_weighted(pools):
+    router = YoquRouter(YoquRouter.WEIGHTED, {"r1": 0, "account 2": 0, "r3": 3})
+    assert {router.choose(pools) for _ in range(20)} == {"r3"}
+    assert YoquRouter(YoquRouter.WEIGHTED, {"r1": 0, "r2": 0, "r3": 0}).choose(pools, "r1") == "r1"
+
+
+def test_unhealthy(pools):
+    router = YoquRouter(YoquRouter.ROUND_ROBIN)
+    pools["r1"].members[0].open("blocked", 60)
+    pools["r3"].state = pools["r3"].FAILED
+    pools["r3"].members[0].healthy = False
+    assert {router.choose(pools, "r1") for _ in range(4)} == {"r2"}
+    pools["r2"].members[0].healthy = False
+    # Nothing can serve requests
+    assert router.choose(pools, "r1") == "r1"
+
+
+class ChatGPTPage(RPAChatGPTResource):
+    """RPAChatGPTResource with a fake page: new chats are listed first in the sidebar"""
+
+    def _new_chat(self) -> bool:
+        return True
+
+    def _send(self, message: str, since_message_id: str = None) -> list[RPAMessage]:
+        return [RPAMessage(id="m1", text=message), RPAMessage(id="m2", text="hello", type="RESPONSE")]
+
+    def _load_chats(self):
+        self.chats = [RPAChat(chat_id="c-new", name="new chat", type=self.type, resource=self.name)]
+        return self.chats
+
+
+async def test_follow_up(fake_manager, new_session):
+    manager = fake_manager({"fake1": 1, "fake2": 1}, routing={"policy": "round_robin"})
+    rpa = ChatGPTPage("fake2", {"name": "fake2", "type": "chatgpt",
+                                "resource": {"url": "https://chatgpt.com", "command": ["chrome"]}})
+    chat = rpa._create_chat("hi")
+    assert (chat.type, chat.resource) == ("chatgpt", "fake2")
+    # Follow-ups go to the resource that created the chat, not by policy (default: fake1)
+    manager._chat_done(chat)
+    assert [await manager.route(chat.chat_id) for _ in range(3)] == ["fake2"] * 3
+    # From the DB, e.g. after a restart
+    await db.upsert_chats(new_session(), [chat])
+    manager.recent.clear()
+    assert await manager.route(chat.chat_id) == "fake2"
+    assert await manager.route("unknown") == "fake1"
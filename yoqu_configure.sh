@@ -7,14 +7,18 @@
 usage() {
   echo ""
   echo "Usage"
-  echo " ./yoqu_configure.sh <config_file.json>"
+  echo " ./yoqu_configure.sh <config_file.json> [member]"
+  echo ""
+  echo " member: pool member (0 by default), members 1..max_size-1 use port + member and '<user-data-dir>_member'"
+  echo "         unless pool.members[member] sets the command"
   echo ""
   exit 1
 }
 
-[ $# -ne 1 ] && usage
+[ $# -lt 1 -o $# -gt 2 ] && usage
 
 config=$1
+member=${2:-0}
 if [ ! -f "${config}" ];then
   echo "ERROR: Cannot open file '${config}'"
   exit 1
@@ -27,11 +31,18 @@ mkdir chrome_data 2>/dev/null
 #
 what="`jq -r '.type  + " (" + .desc + ")"' ${config}`"
 url_login="`jq -r '.resource.url_login' ${config}` "
-cmd="`jq -r '.resource.command | join(" ")' ${config}` ${url_login}"
+cmd="`jq -r --argjson m ${member} '
+  if $m > 0 and .pool.members[$m].command then .pool.members[$m].command
+  else .resource.command | map(
+    if $m > 0 and startswith("--user-data-dir=") then . + "_\($m)"
+    elif $m > 0 and startswith("--remote-debugging-port=") then
+      "--remote-debugging-port=" + ((ltrimstr("--remote-debugging-port=") | tonumber) + $m | tostring)
+    else . end)
+  end | join(" ")' ${config}` ${url_login}"
 
 echo "================================================================================"
 echo "==> Configuration from file '${config}'":
-echo "==> '${what}'"
+echo "==> '${what}' member ${member}"
 echo "==> Cmd: ${cmd}"
 echo "==> Launching Chrome, please login, then close the browser"
 echo "================================================================================"